@@ -0,0 +1,174 @@
+from __future__ import annotations
+import math
+import random
+import time
+from contextlib import contextmanager
+
+from main import ActionList, BusCharacter, GameManager, GameOver, Team
+from match_random import MatchRandom
+from simulate import HEADLESS, Decision, Policy, alive_targets, apply_decisions, play_act, random_policy, ready_characters
+
+# Every distinct action one character can declare this act, both slots naming the same skill count once
+def character_options(manager: GameManager, i: int) -> list[Decision]:
+    character = manager.player.characters[i]
+    options = []
+    seen_skills = set()
+    for slot in (1, 2):
+        skill_choice = character.skillcycle[slot - 1]
+        if skill_choice in seen_skills:
+            continue
+        seen_skills.add(skill_choice)
+        for target in alive_targets(manager.enemy):
+            options.append(Decision(i, slot, target, False))
+            if character.can_choose_clash(manager.enemy.characters[target]):
+                options.append(Decision(i, slot, target, True))
+    return options
+
+# Compact key of everything the outcome of an act depends on, seen from the side to move
+def state_key(manager: GameManager) -> int:
+    return hash(tuple(
+        (c.name, c.skillcycle[0], c.skillcycle[1], c.save())
+        for c in (*manager.player.characters, *manager.enemy.characters)
+    ) + (manager.act,))
+
+# Share of health left of a team's Mephistopheles and, on average, of its identities, wherever they sit
+def _health_shares(team: Team) -> tuple[float, float]:
+    bus = 0.0
+    units = []
+    for c in team.characters:
+        if isinstance(c, BusCharacter):
+            bus = c.curhp / c.maxhp
+        else:
+            units.append(c.curhp / c.maxhp)
+    return bus, sum(units) / max(len(units), 1)
+
+# Heuristic value of an unfinished match for team: mostly Mephistopheles health, a little of the identities' health
+def evaluate(manager: GameManager, team: Team) -> float:
+    enemy = manager.enemy if team is manager.player else manager.player
+    my_bus, my_units = _health_shares(team)
+    their_bus, their_units = _health_shares(enemy)
+    return 0.5 + 0.4 * (my_bus - their_bus) + 0.1 * (my_units - their_units)
+
+# Lets the search play acts on the real manager: the game's random stream, event bus, recorder and
+# declared actions are swapped out, and the undo log puts the board back as it was on exit
+@contextmanager
+def sandbox(manager: GameManager, rng: MatchRandom):
+    characters = [*manager.player.characters, *manager.enemy.characters]
+    player, enemy = manager.player, manager.enemy
+    action_list, events, recorder = manager.action_list, manager.events, manager.recorder
+    saved = [(c.rng, c.events) for c in characters]
+    manager.action_list, manager.events, manager.recorder = ActionList(), HEADLESS, None
+    for c in characters:
+        c.rng, c.events = rng, HEADLESS
+    manager.push_undo()
+    try:
+        yield
+    finally:
+        manager.undo()
+        manager.player, manager.enemy = player, enemy
+        for c, (c_rng, c_events) in zip(characters, saved):
+            c.rng, c.events = c_rng, c_events
+        manager.action_list, manager.events, manager.recorder = action_list, events, recorder
+
+# Monte Carlo tree search over the act's decisions of the side to move, one tree level per ready character.
+# The opponent's actions, coin tosses and a few rollout acts after this one are sampled in every simulation.
+# Node statistics live in a transposition table keyed by (state key, decisions so far) that persists between
+# calls. Use as a Policy; the search stops after time_budget seconds or max_simulations simulations
+class SearchAI:
+    def __init__(
+            self,
+            time_budget: float = 0.5,
+            max_simulations: int | None = None,
+            rollout_acts: int = 2,
+            exploration: float = 1.4,
+            opponent: Policy = random_policy,
+            rollout_policy: Policy = random_policy,
+            table_size: int = 200_000
+        ):
+        self.time_budget = time_budget
+        self.max_simulations = max_simulations
+        self.rollout_acts = rollout_acts
+        self.exploration = exploration
+        self.opponent = opponent
+        self.rollout_policy = rollout_policy
+        self.table_size = table_size
+        # (state key, decisions so far) -> (visits per option, total value per option)
+        self.table: dict[tuple, tuple[list[int], list[float]]] = {}
+        self.simulations = 0
+
+    def __call__(self, manager: GameManager, rng: random.Random) -> list[Decision]:
+        return self.search(manager, rng)
+
+    def search(self, manager: GameManager, rng: random.Random) -> list[Decision]:
+        ready = ready_characters(manager.player)
+        if not ready:
+            return []
+        options = [character_options(manager, i) for i in ready]
+        if len(self.table) > self.table_size:
+            self.table.clear()
+        root = state_key(manager)
+        search_rng = MatchRandom(rng.getrandbits(64))
+        deadline = time.perf_counter() + self.time_budget
+        self.simulations = 0
+        while time.perf_counter() < deadline and (self.max_simulations is None or self.simulations < self.max_simulations):
+            path = self.select(root, options, search_rng)
+            value = self.simulate(manager, [options[depth][choice] for depth, (_, choice) in enumerate(path)], search_rng)
+            for key, choice in path:
+                visits, values = self.table[key]
+                visits[choice] += 1
+                values[choice] += value
+            self.simulations += 1
+        return self.best(root, options)
+
+    def node(self, key: tuple, count: int) -> tuple[list[int], list[float]]:
+        entry = self.table.get(key)
+        if entry is None:
+            entry = self.table[key] = ([0] * count, [0.0] * count)
+        return entry
+
+    # UCB1 from the root down, untried options first
+    def select(self, root: int, options: list[list[Decision]], rng: random.Random) -> list[tuple[tuple, int]]:
+        path = []
+        prefix: tuple[int, ...] = ()
+        for depth_options in options:
+            key = (root, prefix)
+            visits, values = self.node(key, len(depth_options))
+            untried = [i for i, n in enumerate(visits) if n == 0]
+            if untried:
+                choice = rng.choice(untried)
+            else:
+                log_total = math.log(sum(visits))
+                choice = max(
+                    range(len(visits)),
+                    key=lambda i: values[i] / visits[i] + self.exploration * math.sqrt(log_total / visits[i]),
+                )
+            path.append((key, choice))
+            prefix += (choice,)
+        return path
+
+    # Win 1, loss 0, evaluate() when the rollout ends first
+    def simulate(self, manager: GameManager, plan: list[Decision], rng: MatchRandom) -> float:
+        team = manager.player
+        with sandbox(manager, rng):
+            try:
+                apply_decisions(manager, plan)
+                manager.change_side()
+                apply_decisions(manager, self.opponent(manager, rng))
+                manager.change_side()
+                manager.resolve_action()
+                for _ in range(self.rollout_acts):
+                    play_act(manager, self.rollout_policy, self.rollout_policy, rng)
+            except GameOver as over:
+                return 0.0 if over.loser in team.characters else 1.0
+            return evaluate(manager, team)
+
+    # Most visited option at every level
+    def best(self, root: int, options: list[list[Decision]]) -> list[Decision]:
+        plan = []
+        prefix: tuple[int, ...] = ()
+        for depth_options in options:
+            visits, _ = self.node((root, prefix), len(depth_options))
+            choice = max(range(len(visits)), key=visits.__getitem__)
+            plan.append(depth_options[choice])
+            prefix += (choice,)
+        return plan
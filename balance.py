@@ -0,0 +1,238 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+from dataclasses import dataclass
+from multiprocessing import Pool
+
+from main import BusCharacter, Character, GameOver, Resistance, Skill, assign_skillcycle, identity_catalog
+from match_random import MatchRandom
+from simulate import new_match, play_act
+from tournament import POLICIES, Roster, identities, roster_pairings
+
+PARAMETER_NAMES = (
+    "maxhp", "maxstag", "spmin", "spmax", "slash", "pierce", "bash",
+    "s1_base", "s1_coins", "s1_val", "s2_base", "s2_coins", "s2_val", "s3_base", "s3_coins", "s3_val",
+)
+
+# Allowed range of one tunable number, moves go by step
+@dataclass(frozen=True)
+class Bound:
+    low: float
+    high: float
+    step: float
+
+    def clamp(self, value: float) -> float:
+        return min(max(value, self.low), self.high)
+
+# The roster's current numbers, in PARAMETER_NAMES order for every identity
+def current_values() -> dict[int, tuple[float, ...]]:
+    values = {}
+    for number in identities():
+        c = identity_catalog()[number]
+        skills = tuple(value for skill in c.skills for value in (skill.baseval, skill.coinnum, skill.coinval))
+        values[number] = (c.maxhp, c.maxstag, c.spmin, c.spmax, c.resistance.slash, c.resistance.pierce, c.resistance.bash, *skills)
+    return values
+
+# Bounds around the current numbers. Coin counts stay as they are, like the README's PvP sheet keeps them;
+# give them a wider Bound to let the search change them too
+def default_bounds(values: dict[int, tuple[float, ...]]) -> dict[int, tuple[Bound, ...]]:
+    bounds = {}
+    for number, row in values.items():
+        maxhp, maxstag = row[0], row[1]
+        identity_bounds = [
+            Bound(round(maxhp * 0.6), round(maxhp * 1.4), 5),
+            Bound(round(maxstag * 0.6), round(maxstag * 1.4), 2),
+            Bound(1, 9, 1),
+            Bound(1, 9, 1),
+            Bound(0.5, 2, 0.25),
+            Bound(0.5, 2, 0.25),
+            Bound(0.5, 2, 0.25),
+        ]
+        for s in range(3):
+            coins = row[8 + 3 * s]
+            identity_bounds += [Bound(1, 10, 1), Bound(coins, coins, 1), Bound(1, 16, 1)]
+        bounds[number] = tuple(identity_bounds)
+    return bounds
+
+Params = tuple[tuple[float, ...], ...]
+
+def to_params(values: dict[int, tuple[float, ...]]) -> Params:
+    return tuple(tuple(values[number]) for number in identities())
+
+# A roster builder for simulate_match that uses params instead of the numbers in the identity catalog
+class ParamRoster:
+    def __init__(self, params: Params):
+        self.rows = dict(zip(identities(), params))
+
+    def __call__(self, number_list: list[int], rng: random.Random) -> list[Character]:
+        characters = []
+        for number in number_list:
+            if number == 0:
+                characters.append(BusCharacter(rng))
+                continue
+            spec = identity_catalog()[number]
+            row = self.rows[number]
+            maxhp, maxstag, spmin, spmax, slash, pierce, bash = row[:7]
+            skills = tuple(Skill(int(row[7 + 3 * s]), int(row[8 + 3 * s]), int(row[9 + 3 * s]), spec.skills[s].skill_type) for s in range(3))
+            characters.append(Character(
+                spec.name, int(maxhp), int(maxstag), 0, assign_skillcycle(rng),
+                int(spmin), int(spmax), Resistance(slash, pierce, bash), skills, rng,
+            ))
+        return characters
+
+# matchups random drafts of three identities a side, each played from both seats so seating evens out
+def draft_pairs(matchups: int, seed: int) -> list[tuple[Roster, Roster]]:
+    return [pair for team1, team2 in roster_pairings(matchups, seed) for pair in ((team1, team2), (team2, team1))]
+
+# Player 1's score (a draw is half a win) over the seeds, in full 3v3 matches with the roster built from params
+def play_drafts(task: tuple[Params, list[tuple[Roster, Roster]], list[int], str, int]) -> list[tuple[Roster, Roster, float]]:
+    params, pairs, seeds, policy, max_acts = task
+    roster = ParamRoster(params)
+    results = []
+    for team1, team2 in pairs:
+        score = 0.0
+        for seed in seeds:
+            manager = new_match(list(team1), list(team2), MatchRandom(seed), roster)
+            policy_rng = random.Random(f"policy:{seed}")
+            try:
+                while manager.act < max_acts:
+                    play_act(manager, POLICIES[policy], POLICIES[policy], policy_rng)
+                score += 0.5
+            except GameOver as over:
+                if over.loser not in manager.player.characters:
+                    score += 1.0
+        results.append((team1, team2, score / len(seeds)))
+    return results
+
+# Mean squared distance from 50% of every identity-vs-identity win rate, read off the drafted matchups: each
+# draft counts for every identity of one side against every identity of the other. Pairs that no draft put
+# on opposite sides don't count
+def imbalance(scores: dict[tuple[Roster, Roster], float]) -> float:
+    totals: dict[tuple[int, int], list[float]] = {}
+    for (team1, team2), score in scores.items():
+        for first in team1:
+            for second in team2:
+                # Kept under the lower number, as that identity's share
+                pair, share = ((first, second), score) if first < second else ((second, first), 1 - score)
+                entry = totals.setdefault(pair, [0.0, 0])
+                entry[0] += share
+                entry[1] += 1
+    return sum((total / count - 0.5) ** 2 for total, count in totals.values()) / len(totals)
+
+# Hill climbing over bounded roster numbers. Every candidate plays the same drafts on the same seeds
+# (common random numbers), so two parameter sets are compared on identical coin tosses instead of fresh noise.
+# Evaluations are cached by parameter set and by every setting the score depends on, and can be kept in a
+# JSON file between runs
+class BalanceOptimizer:
+    def __init__(
+            self,
+            games: int = 20,
+            matchups: int = 132,
+            seed: int = 0,
+            workers: int | None = None,
+            policy: str = "random",
+            max_acts: int = 100,
+            cache_path: str | None = None,
+            bounds: dict[int, tuple[Bound, ...]] | None = None
+        ):
+        values = current_values()
+        self.start = to_params(values)
+        self.bounds = bounds if bounds is not None else default_bounds(values)
+        self.seeds = [seed * 1_000_003 + game for game in range(games)]
+        self.pairs = draft_pairs(matchups, seed)
+        self.rng = random.Random(seed)
+        self.workers = workers
+        self.policy = policy
+        self.max_acts = max_acts
+        # Part of every cache key: a score only stands for the games, drafts, seed, policy and act limit it was played with
+        self.settings = (("games", games), ("matchups", matchups), ("seed", seed), ("policy", policy), ("max_acts", max_acts))
+        self.cache_path = cache_path
+        self.cache: dict[tuple[tuple, Params], float] = {}
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, encoding="utf-8") as file:
+                for record in json.load(file):
+                    # Entries written before the settings were kept have none and are skipped
+                    if "settings" in record:
+                        key = (tuple(tuple(item) for item in record["settings"]), tuple(tuple(row) for row in record["params"]))
+                        self.cache[key] = record["imbalance"]
+
+    def save_cache(self):
+        if self.cache_path is None:
+            return
+        with open(self.cache_path, "w", encoding="utf-8") as file:
+            json.dump([
+                {"settings": settings, "params": params, "imbalance": score}
+                for (settings, params), score in self.cache.items()
+            ], file)
+
+    # Plays every draft of every uncached candidate in one pool run
+    def evaluate(self, candidates: list[Params], pool: Pool) -> list[float]:
+        todo = list(dict.fromkeys(params for params in candidates if (self.settings, params) not in self.cache))
+        chunks = [self.pairs[i:i + 12] for i in range(0, len(self.pairs), 12)]
+        tasks = [(params, chunk, self.seeds, self.policy, self.max_acts) for params in todo for chunk in chunks]
+        scores: dict[Params, dict[tuple[Roster, Roster], float]] = {params: {} for params in todo}
+        for params, result in zip((task[0] for task in tasks), pool.imap(play_drafts, tasks)):
+            for team1, team2, score in result:
+                scores[params][(team1, team2)] = score
+        for params in todo:
+            self.cache[(self.settings, params)] = imbalance(scores[params])
+        return [self.cache[(self.settings, params)] for params in candidates]
+
+    # Move one to three random numbers one step up or down, keeping spmin <= spmax
+    def neighbour(self, params: Params) -> Params:
+        rows = [list(row) for row in params]
+        numbers = identities()
+        for _ in range(self.rng.randint(1, 3)):
+            position = self.rng.randrange(len(numbers))
+            index = self.rng.randrange(len(PARAMETER_NAMES))
+            bound = self.bounds[numbers[position]][index]
+            row = rows[position]
+            row[index] = bound.clamp(row[index] + self.rng.choice((-1, 1)) * bound.step)
+            if row[2] > row[3]:
+                row[2], row[3] = row[3], row[2]
+        return tuple(tuple(row) for row in rows)
+
+    def optimize(self, iterations: int = 50, neighbours: int = 8, start: Params | None = None) -> tuple[Params, float]:
+        best = start if start is not None else self.start
+        with Pool(self.workers) as pool:
+            best_score = self.evaluate([best], pool)[0]
+            for iteration in range(iterations):
+                candidates = [self.neighbour(best) for _ in range(neighbours)]
+                scores = self.evaluate(candidates, pool)
+                score, candidate = min(zip(scores, candidates))
+                if score < best_score:
+                    best, best_score = candidate, score
+                print(f"Iteration {iteration + 1}: imbalance {best_score:.5f}")
+                self.save_cache()
+        return best, best_score
+
+def params_to_json(params: Params) -> dict:
+    return {
+        identity_catalog()[number].name: dict(zip(PARAMETER_NAMES, row))
+        for number, row in zip(identities(), params)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Search roster numbers that bring every identity matchup toward 50%")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--neighbours", type=int, default=8, help="candidates evaluated per iteration")
+    parser.add_argument("--games", type=int, default=20, help="games per draft and seat")
+    parser.add_argument("--matchups", type=int, default=132, help="random 3v3 drafts every candidate plays")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--policy", choices=POLICIES, default="random")
+    parser.add_argument("--cache", help="JSON file to keep evaluated parameter sets in")
+    parser.add_argument("--output", help="write the best numbers to this JSON file")
+    args = parser.parse_args()
+
+    optimizer = BalanceOptimizer(args.games, args.matchups, args.seed, args.workers, args.policy, cache_path=args.cache)
+    best, score = optimizer.optimize(args.iterations, args.neighbours)
+    print(f"Best imbalance {score:.5f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(params_to_json(best), file, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
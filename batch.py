@@ -0,0 +1,316 @@
+from __future__ import annotations
+from functools import lru_cache
+
+import numpy as np
+
+from main import Character, Resistance, Skill, SkillType, identity_catalog, numbers_to_characters
+from match_random import MatchRandom
+
+# Every match has the same board layout: units 0-3 are team1 and 4-7 team2, slot 0 of each team is Mephistopheles
+TEAM_SIZE = 4
+UNITS = 2 * TEAM_SIZE
+BUS_UNITS = (0, TEAM_SIZE)
+SKILLCYCLE = np.array([1, 1, 1, 2, 2, 3], dtype=np.int8)
+
+# Roster values of every identity as arrays indexed by identity number, read once from the identity catalog
+class IdentityTable:
+    def __init__(self):
+        characters = numbers_to_characters(list(range(max(identity_catalog().numbers()) + 1)), MatchRandom(0))
+        self.names = [character.name for character in characters]
+        self.maxhp = np.array([c.maxhp for c in characters], dtype=np.int32)
+        self.maxstag = np.array([c.maxstag for c in characters], dtype=np.int32)
+        self.spmin = np.array([c.spmin for c in characters], dtype=np.int32)
+        self.spmax = np.array([c.spmax for c in characters], dtype=np.int32)
+        self.resistance = np.array([[c.resistance.slash, c.resistance.pierce, c.resistance.bash] for c in characters], dtype=np.float64)
+        self.skill_base = np.array([[s.baseval for s in c.skills] for c in characters], dtype=np.int32)
+        self.skill_coins = np.array([[s.coinnum for s in c.skills] for c in characters], dtype=np.int32)
+        self.skill_val = np.array([[s.coinval for s in c.skills] for c in characters], dtype=np.int32)
+        self.skill_type = np.array([[s.skill_type.value - 1 for s in c.skills] for c in characters], dtype=np.int8)
+
+@lru_cache(maxsize=None)
+def identity_table() -> IdentityTable:
+    return IdentityTable()
+
+# Declared actions of a batch of matches, one row per match and up to `slots` actions per row.
+# Units are board units (0-7), skill is the skill number (1 to 3). Like ActionList, the row order
+# breaks speed ties and an attacker may only appear once per row
+class BatchActions:
+    def __init__(self, matches: int, slots: int = UNITS - len(BUS_UNITS)):
+        self.att = np.zeros((matches, slots), dtype=np.int8)
+        self.skill = np.ones((matches, slots), dtype=np.int8)
+        self.target = np.zeros((matches, slots), dtype=np.int8)
+        self.clash = np.zeros((matches, slots), dtype=bool)
+        self.valid = np.zeros((matches, slots), dtype=bool)
+
+# Game state of many matches as one array per attribute, shaped (matches, units).
+# next_turn, take_damage, find_mult, clash and one_side_attack follow the rules of the Character and
+# Action methods of the same name, applied to every selected match at once
+class BatchState:
+    def __init__(self, team1_ids, team2_ids, seed: int | None = None):
+        team1_ids = np.asarray(team1_ids, dtype=np.int32)
+        matches = len(team1_ids)
+        self.rng = np.random.default_rng(seed)
+        self.matches = matches
+        self.ids = np.zeros((matches, UNITS), dtype=np.int32)
+        self.is_bus = np.zeros((matches, UNITS), dtype=bool)
+        self.maxhp = np.zeros((matches, UNITS), dtype=np.int32)
+        self.curhp = np.zeros((matches, UNITS), dtype=np.int32)
+        self.maxstag = np.zeros((matches, UNITS), dtype=np.int32)
+        self.curstag = np.zeros((matches, UNITS), dtype=np.int32)
+        self.sanity = np.zeros((matches, UNITS), dtype=np.int32)
+        self.spmin = np.zeros((matches, UNITS), dtype=np.int32)
+        self.spmax = np.zeros((matches, UNITS), dtype=np.int32)
+        self.speed = np.zeros((matches, UNITS), dtype=np.int32)
+        self.deathtimer = np.zeros((matches, UNITS), dtype=np.int32)
+        self.staggertimer = np.zeros((matches, UNITS), dtype=np.int32)
+        self.resistance = np.zeros((matches, UNITS, 3), dtype=np.float64)
+        self.skill_base = np.zeros((matches, UNITS, 3), dtype=np.int32)
+        self.skill_coins = np.zeros((matches, UNITS, 3), dtype=np.int32)
+        self.skill_val = np.zeros((matches, UNITS, 3), dtype=np.int32)
+        self.skill_type = np.zeros((matches, UNITS, 3), dtype=np.int8)
+        self.skillcycle = np.zeros((matches, UNITS, len(SKILLCYCLE)), dtype=np.int8)
+        self.act = np.zeros(matches, dtype=np.int32)
+        # 0 while the match runs, then the winning side (1 or 2)
+        self.winner = np.zeros(matches, dtype=np.int8)
+        self.reset(np.arange(matches), team1_ids, team2_ids)
+
+    # Start the matches m over as new ones between the given teams, the other matches are left alone
+    def reset(self, m: np.ndarray, team1_ids, team2_ids):
+        table = identity_table()
+        ids = np.zeros((len(m), UNITS), dtype=np.int32)
+        ids[:, 1:TEAM_SIZE] = team1_ids
+        ids[:, TEAM_SIZE + 1:] = team2_ids
+        self.ids[m] = ids
+        self.is_bus[m] = ids == 0
+        self.maxhp[m] = self.curhp[m] = table.maxhp[ids]
+        self.maxstag[m] = self.curstag[m] = table.maxstag[ids]
+        self.sanity[m] = 0
+        self.spmin[m] = table.spmin[ids]
+        self.spmax[m] = table.spmax[ids]
+        self.speed[m] = 0
+        self.deathtimer[m] = 0
+        self.staggertimer[m] = 0
+        self.resistance[m] = table.resistance[ids]
+        self.skill_base[m] = table.skill_base[ids]
+        self.skill_coins[m] = table.skill_coins[ids]
+        self.skill_val[m] = table.skill_val[ids]
+        self.skill_type[m] = table.skill_type[ids]
+        self.skillcycle[m] = SKILLCYCLE[np.argsort(self.rng.random((len(m), UNITS, len(SKILLCYCLE))), axis=2)]
+        self.act[m] = 0
+        self.winner[m] = 0
+
+    def running(self) -> np.ndarray:
+        return self.winner == 0
+
+    def character(self, match: int, unit: int) -> CharacterView:
+        return CharacterView(self, match, unit)
+
+    def next_turn(self):
+        running = self.running()
+        self.act[running] += 1
+        # Mephistopheles skips next_turn entirely
+        update = running[:, None] & ~self.is_bus
+        speed = self.rng.integers(self.spmin, self.spmax + 1)
+        self.speed = np.where(update, speed, self.speed)
+        ticking = update & (self.deathtimer > 0)
+        self.deathtimer[ticking] -= 1
+        revive = ticking & (self.deathtimer == 0)
+        self.curhp[revive] = self.maxhp[revive]
+        ticking = update & (self.staggertimer > 0)
+        self.staggertimer[ticking] -= 1
+        recover = ticking & (self.staggertimer == 0)
+        self.curstag[recover] = self.maxstag[recover]
+
+    def find_mult(self, m: np.ndarray, u: np.ndarray, skill_type: np.ndarray) -> np.ndarray:
+        return np.where(self.curstag[m, u] < 1, 2.0, self.resistance[m, u, skill_type])
+
+    # Each match may appear only once in m
+    def take_damage(self, m: np.ndarray, u: np.ndarray, damage: np.ndarray):
+        curhp = self.curhp[m, u] - damage
+        curstag = self.curstag[m, u]
+        curstag = np.where(curstag > 0, curstag - damage, curstag)
+        staggered = curstag <= 0
+        self.curstag[m, u] = np.maximum(curstag, 0)
+        timer = self.staggertimer[m, u]
+        self.staggertimer[m, u] = np.where(staggered & (timer == 0), 2, timer)
+        dead = curhp <= 0
+        self.curhp[m, u] = np.maximum(curhp, 0)
+        timer = self.deathtimer[m, u]
+        self.deathtimer[m, u] = np.where(dead & (timer == 0), 3, timer)
+
+    def coin_heads(self, m: np.ndarray, u: np.ndarray) -> np.ndarray:
+        return self.rng.random(len(m)) * 100 < 50 + self.sanity[m, u]
+
+    # s is the skill index (0 to 2), coin_lost the coins already lost in a clash
+    def one_side_attack(self, m: np.ndarray, att: np.ndarray, defn: np.ndarray, s: np.ndarray, coin_lost: np.ndarray):
+        coin_count = self.skill_coins[m, att, s]
+        coin_val = self.skill_val[m, att, s]
+        skill_type = self.skill_type[m, att, s]
+        dmg_val = self.skill_base[m, att, s].astype(np.float64)
+        coin_num = coin_lost.copy()
+        going = coin_num < coin_count
+        while going.any():
+            i = np.flatnonzero(going)
+            mi, ai, di = m[i], att[i], defn[i]
+            dmg_ratio = self.find_mult(mi, di, skill_type[i])
+            dmg_val[i] += np.where(self.coin_heads(mi, ai), coin_val[i], 0)
+            damage = (dmg_val[i] * dmg_ratio).astype(np.int32)
+            self.take_damage(mi, di, damage)
+            coin_num[i] += 1
+            killed = self.curhp[mi, di] <= 0
+            bus_killed = killed & self.is_bus[mi, di]
+            self.winner[mi[bus_killed]] = np.where(ai[bus_killed] < TEAM_SIZE, 1, 2)
+            going[i] = (coin_num[i] < coin_count[i]) & ~killed
+
+    # defn_target is the target of the defender's own action, which is who Action.clash makes a winning defender hit
+    def clash(self, m: np.ndarray, att: np.ndarray, defn: np.ndarray, s_att: np.ndarray, s_defn: np.ndarray, defn_target: np.ndarray):
+        att_coin_count = self.skill_coins[m, att, s_att]
+        defn_coin_count = self.skill_coins[m, defn, s_defn]
+        att_base, att_val = self.skill_base[m, att, s_att], self.skill_val[m, att, s_att]
+        defn_base, defn_val = self.skill_base[m, defn, s_defn], self.skill_val[m, defn, s_defn]
+        att_head = np.clip(50 + self.sanity[m, att], 0, 100) / 100
+        defn_head = np.clip(50 + self.sanity[m, defn], 0, 100) / 100
+        att_coin_lost = np.zeros(len(m), dtype=np.int32)
+        defn_coin_lost = np.zeros(len(m), dtype=np.int32)
+        clash_num = np.zeros(len(m), dtype=np.int32)
+        going = (att_coin_count > 0) & (defn_coin_count > 0)
+        # Sanity doesn't change during the clash, so each side's heads in a round are binomial
+        while going.any():
+            i = np.flatnonzero(going)
+            clash_num[i] += 1
+            att_total = att_base[i] + att_val[i] * self.rng.binomial(att_coin_count[i] - att_coin_lost[i], att_head[i])
+            defn_total = defn_base[i] + defn_val[i] * self.rng.binomial(defn_coin_count[i] - defn_coin_lost[i], defn_head[i])
+            defn_coin_lost[i] += att_total > defn_total
+            att_coin_lost[i] += defn_total > att_total
+            going[i] = (att_coin_lost[i] < att_coin_count[i]) & (defn_coin_lost[i] < defn_coin_count[i])
+        att_won = np.flatnonzero(defn_coin_count == defn_coin_lost)
+        np.add.at(self.sanity, (m[att_won], att[att_won]), 10 + clash_num[att_won])
+        self.one_side_attack(m[att_won], att[att_won], defn[att_won], s_att[att_won], att_coin_lost[att_won])
+        defn_won = np.flatnonzero((att_coin_count == att_coin_lost) & (self.winner[m] == 0))
+        np.add.at(self.sanity, (m[defn_won], defn[defn_won]), 10 + clash_num[defn_won])
+        self.one_side_attack(m[defn_won], defn[defn_won], defn_target[defn_won], s_defn[defn_won], defn_coin_lost[defn_won])
+
+    # GameManager.resolve_action for every running match: each round takes the fastest remaining action of
+    # every match, pairs it with the defender's action the same way and fights all the battles at once
+    def resolve_action(self, actions: BatchActions):
+        slots = actions.att.shape[1]
+        rows = np.arange(self.matches)[:, None]
+        remaining = actions.valid & self.running()[:, None]
+        speed = self.speed[rows, actions.att]
+        order = np.where(remaining, -speed * (slots + 1) + np.arange(slots), np.iinfo(np.int32).max)
+        for _ in range(slots):
+            live = np.flatnonzero(remaining.any(axis=1) & self.running())
+            if len(live) == 0:
+                break
+            k = np.argmin(np.where(remaining[live], order[live], np.iinfo(np.int32).max), axis=1)
+            remaining[live, k] = False
+            att = actions.att[live, k].astype(np.intp)
+            defn = actions.target[live, k].astype(np.intp)
+            declared = remaining[live] & (actions.att[live] == defn[:, None])
+            exists = declared.any(axis=1)
+            j = np.argmax(declared, axis=1)
+            mutual = exists & (speed[live, j] == speed[live, k]) & (actions.target[live, j] == att)
+            is_clash = actions.clash[live, k]
+            remaining[live[exists & (mutual | is_clash)], j[exists & (mutual | is_clash)]] = False
+            defending = exists & np.where(is_clash, ~mutual, mutual)
+            alive = self.curhp[live, defn] > 0
+            s_att = actions.skill[live, k].astype(np.intp) - 1
+            s_defn = actions.skill[live, j].astype(np.intp) - 1
+            c = np.flatnonzero(defending & alive)
+            defn_target = actions.target[live, j].astype(np.intp)
+            self.clash(live[c], att[c], defn[c], s_att[c], s_defn[c], defn_target[c])
+            o = np.flatnonzero(~defending & alive)
+            self.one_side_attack(live[o], att[o], defn[o], s_att[o], np.zeros(len(o), dtype=np.int32))
+
+    # Vectorized random_policy: every ready unit of both sides picks a random slot, a living target and maybe a clash,
+    # written into actions when one is given
+    def random_actions(self, actions: BatchActions | None = None) -> BatchActions:
+        if actions is None:
+            actions = BatchActions(self.matches)
+        rows = np.arange(self.matches)[:, None]
+        units = np.array([u for u in range(UNITS) if u not in BUS_UNITS])
+        ready = (self.curhp[:, units] > 0) & (self.curstag[:, units] >= 1) & self.running()[:, None]
+        slot = self.rng.integers(0, 2, (self.matches, len(units)))
+        skill = self.skillcycle[rows, units, slot]
+        enemy_units = np.where(units < TEAM_SIZE, TEAM_SIZE, 0)[None, :] + np.arange(TEAM_SIZE)[:, None, None]
+        enemy_alive = self.curhp[rows[None], enemy_units] > 0
+        pick = np.argmax(np.where(enemy_alive, self.rng.random(enemy_alive.shape), -1), axis=0)
+        target = enemy_units[0] + pick
+        can_clash = (
+            ~self.is_bus[rows, target]
+            & (self.speed[:, units] > self.speed[rows, target])
+            & (self.curstag[rows, target] >= 1)
+        )
+        actions.att[:] = units
+        actions.skill[:] = skill
+        actions.target[:] = target
+        actions.clash[:] = can_clash & (self.rng.random(can_clash.shape) < 0.5)
+        actions.valid[:] = ready
+        return actions
+
+    # Play every match to the end with random actions, like simulate_match with random_policy on both sides
+    def run(self, max_acts: int = 100) -> np.ndarray:
+        while self.running().any() and self.act.max() < max_acts:
+            self.next_turn()
+            self.resolve_action(self.random_actions())
+        return self.winner
+
+# One unit of one match in a BatchState, with the attribute and method names of Character
+class CharacterView:
+    def __init__(self, batch: BatchState, match: int, unit: int):
+        self.batch = batch
+        self.match = match
+        self.unit = unit
+
+    def _field(name: str):
+        return property(
+            lambda self: int(getattr(self.batch, name)[self.match, self.unit]),
+            lambda self, value: getattr(self.batch, name).__setitem__((self.match, self.unit), value),
+        )
+
+    maxhp = _field("maxhp")
+    curhp = _field("curhp")
+    maxstag = _field("maxstag")
+    curstag = _field("curstag")
+    sanity = _field("sanity")
+    spmin = _field("spmin")
+    spmax = _field("spmax")
+    speed = _field("speed")
+    deathtimer = _field("deathtimer")
+    staggertimer = _field("staggertimer")
+    del _field
+
+    @property
+    def name(self) -> str:
+        return identity_table().names[self.batch.ids[self.match, self.unit]]
+
+    @property
+    def skillcycle(self) -> list[int]:
+        return self.batch.skillcycle[self.match, self.unit].tolist()
+
+    @property
+    def resistance(self) -> Resistance:
+        return Resistance(*self.batch.resistance[self.match, self.unit].tolist())
+
+    @property
+    def skills(self) -> tuple[Skill, Skill, Skill]:
+        b, m, u = self.batch, self.match, self.unit
+        return tuple(
+            Skill(int(b.skill_base[m, u, s]), int(b.skill_coins[m, u, s]), int(b.skill_val[m, u, s]), SkillType(int(b.skill_type[m, u, s]) + 1))
+            for s in range(3)
+        )
+
+    def is_alive(self):
+        return self.curhp > 0
+
+    def is_stagger(self):
+        return self.curstag < 1
+
+    def find_mult(self, skill_type: SkillType) -> float:
+        return float(self.batch.find_mult(np.array([self.match]), np.array([self.unit]), np.array([skill_type.value - 1]))[0])
+
+    def take_damage(self, damage: int):
+        self.batch.take_damage(np.array([self.match]), np.array([self.unit]), np.array([damage]))
+
+    __repr__ = Character.__repr__
+    basic_info = Character.basic_info
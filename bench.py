@@ -0,0 +1,301 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+from itertools import combinations_with_replacement
+from typing import Callable
+
+from effects import KINDS, EffectCatalog, EffectSpec
+from main import Action, ActionList, ActionType, GameManager, Skill, Team, identity_catalog, numbers_to_characters
+from match_random import MatchRandom
+from simulate import HEADLESS, simulate_match
+
+DEFAULT_SEED = 1234
+DEFAULT_THRESHOLD = 0.15
+DEFAULT_ROUNDS = 7
+# Times a benchmark that looks regressed is measured again before it counts as one
+DEFAULT_RETRIES = 2
+
+# One measured operation. setup() returns the function to time, built from a seeded random stream
+@dataclass
+class Benchmark:
+    name: str
+    setup: Callable[[MatchRandom], Callable[[], None]]
+    # Calls of the timed function per timing round, the whole round is timed at once
+    number: int
+
+# noise is how far the median timing round was from the best one, as a share of the median
+@dataclass
+class BenchResult:
+    name: str
+    ops_per_sec: float
+    bytes_per_op: float
+    noise: float = 0.0
+
+# Two identities without Mephistopheles, with enough health that a clash or attack never kills anyone,
+# put back to their starting state before every operation
+def duelists(rng: MatchRandom):
+    att, defn = numbers_to_characters([1, 2], rng)
+    for character in (att, defn):
+        character.maxhp = character.curhp = 10 ** 9
+        character.events = HEADLESS
+    start = (att.save(), defn.save())
+
+    def reset():
+        att.load(start[0])
+        defn.load(start[1])
+    return att, defn, reset
+
+def distinct_skills() -> list[Skill]:
+    catalog = identity_catalog()
+    return list(dict.fromkeys(skill for number in catalog.numbers() for skill in catalog[number].skills))
+
+# Action.clash over every pairing of the roster's distinct skills, one pairing per call in turn
+def clash_setup(rng: MatchRandom) -> Callable[[], None]:
+    att, defn, reset = duelists(rng)
+    pairs = [
+        (Action(5, first, att, defn, ActionType.CLASH), Action(5, second, defn, att, ActionType.CLASH))
+        for first, second in combinations_with_replacement(distinct_skills(), 2)
+    ]
+    state = [0]
+
+    def clash():
+        reset()
+        attack, defend = pairs[state[0]]
+        state[0] = (state[0] + 1) % len(pairs)
+        attack.clash(defend)
+    return clash
+
+def one_side_setup(rng: MatchRandom) -> Callable[[], None]:
+    att, defn, reset = duelists(rng)
+    actions = [Action(5, skill, att, defn, ActionType.ONESIDE) for skill in distinct_skills()]
+    state = [0]
+
+    def one_side_attack():
+        reset()
+        action = actions[state[0]]
+        state[0] = (state[0] + 1) % len(actions)
+        action.one_side_attack()
+    return one_side_attack
+
+# Declare count actions into a fresh ActionList and resolve them all, every attacker against a random
+# enemy with a random speed and clash choice
+def action_list_setup(count: int) -> Callable[[MatchRandom], Callable[[], None]]:
+    def setup(rng: MatchRandom) -> Callable[[], None]:
+        numbers = identity_catalog().numbers()
+        sides = [numbers_to_characters([rng.choice(numbers) for _ in range(count)], rng) for _ in range(2)]
+        manager = GameManager(ActionList(), Team("Player 1", sides[0]), Team("Player 2", sides[1]), HEADLESS)
+        characters = [*sides[0], *sides[1]]
+        for character in characters:
+            character.maxhp = character.curhp = 10 ** 9
+        start = [character.save() for character in characters]
+        plan = []
+        for side, enemy in ((sides[0], sides[1]), (sides[1], sides[0])):
+            for character in side[:count // 2]:
+                speed = rng.randint(1, 9)
+                number = rng.randrange(3) + 1
+                clash = ActionType.CLASH if rng.random() < 0.5 else ActionType.ONESIDE
+                plan.append((speed, number, character, rng.choice(enemy), clash))
+
+        def insert_and_resolve():
+            for character, state in zip(characters, start):
+                character.load(state)
+            for speed, number, att, defn, clash in plan:
+                manager.action_list.add_action(Action(speed, att.skills[number - 1], att, defn, clash, number))
+            manager.resolve_action()
+        return insert_and_resolve
+    return setup
+
+# Whole seeded headless matches between random drafts
+def match_setup(rng: MatchRandom) -> Callable[[], None]:
+    numbers = identity_catalog().numbers()
+    drafts = []
+    for _ in range(64):
+        picks = rng.sample(numbers, 6)
+        drafts.append((picks[:3], picks[3:], rng.getrandbits(32)))
+    state = [0]
+
+    def match():
+        team1, team2, seed = drafts[state[0]]
+        state[0] = (state[0] + 1) % len(drafts)
+        simulate_match(team1, team2, seed=seed)
+    return match
+
+def setup_setup(rng: MatchRandom) -> Callable[[], None]:
+    numbers = identity_catalog().numbers()
+
+    def match_setup():
+        numbers_to_characters([0, *rng.sample(numbers, 3)], rng)
+    return match_setup
+
+# size effects spread over every kind and allowed hook, the first `loadout` of them on identity 1 and none on 2
+def synthetic_catalog(size: int, loadout: int) -> EffectCatalog:
+    pairs = [(kind, hook) for kind, (_, hooks) in KINDS.items() for hook in hooks]
+    specs = [EffectSpec(f"effect{i}", pairs[i % len(pairs)][1], pairs[i % len(pairs)][0], 1) for i in range(size)]
+    return EffectCatalog(specs, {1: [spec.name for spec in specs[:loadout]]})
+
+# Nanoseconds per coin of one-sided attacks by an identity without effects and by one with the same `loadout`
+# effects, as the catalog grows. Both should stay flat: a character only ever runs its own table
+def effect_benchmark(sizes: list[int], loadout: int, coins: int, seed: int, rounds: int = 7) -> list[dict]:
+    skill = max(distinct_skills(), key=lambda skill: skill.coinnum)
+    results = []
+    for size in sizes:
+        catalog = synthetic_catalog(size, min(loadout, size))
+        row = {"catalog": size}
+        for label, number in (("plain_ns_per_coin", 2), ("equipped_ns_per_coin", 1)):
+            rng = MatchRandom(seed)
+            att, defn = numbers_to_characters([number, 2], rng)
+            att.effects = catalog.compile(catalog.identities.get(number, []))
+            for character in (att, defn):
+                character.maxhp = character.curhp = 10 ** 9
+                character.events = HEADLESS
+            start_state = (att.save(), defn.save())
+            action = Action(5, skill, att, defn, ActionType.ONESIDE)
+            attacks = max(1, coins // skill.coinnum)
+            best = float("inf")
+            # Round 0 only warms up
+            for timing in range(rounds + 1):
+                att.load(start_state[0])
+                defn.load(start_state[1])
+                start = time.perf_counter()
+                for _ in range(attacks):
+                    action.one_side_attack()
+                if timing:
+                    best = min(best, time.perf_counter() - start)
+            row[label] = best / (attacks * skill.coinnum) * 1e9
+        results.append(row)
+    return results
+
+BENCHMARKS = [
+    Benchmark("clash", clash_setup, 2000),
+    Benchmark("one_side_attack", one_side_setup, 5000),
+    *(Benchmark(f"action_list_{count}", action_list_setup(count), max(20, 4000 // count)) for count in (4, 16, 64, 256)),
+    Benchmark("match", match_setup, 200),
+    Benchmark("numbers_to_characters", setup_setup, 2000),
+]
+
+# Best of rounds timing rounds for throughput, then one traced round for memory: bytes per operation is
+# the peak traced memory of one operation above what was live before it
+def run_benchmark(benchmark: Benchmark, seed: int = DEFAULT_SEED, rounds: int = DEFAULT_ROUNDS) -> BenchResult:
+    operation = benchmark.setup(MatchRandom(seed, stream=BENCHMARKS.index(benchmark)))
+    for _ in range(max(1, benchmark.number // 10)):
+        operation()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(benchmark.number):
+            operation()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    best, median = timings[0], timings[len(timings) // 2]
+    traced = min(benchmark.number, 200)
+    tracemalloc.start()
+    peak_total = 0
+    for _ in range(traced):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        operation()
+        peak_total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return BenchResult(benchmark.name, benchmark.number / best, peak_total / traced, (median - best) / median)
+
+# Drop below the baseline a result may show before it counts as a regression: threshold, or twice the
+# noise its own rounds showed when the machine is noisier than that
+def allowed_drop(result: BenchResult, threshold: float) -> float:
+    return max(threshold, 2 * result.noise)
+
+# Names of the benchmarks whose throughput fell further below the baseline than allowed_drop
+def regressions(results: list[BenchResult], baseline: dict[str, float], threshold: float) -> list[str]:
+    return [
+        result.name for result in results
+        if result.name in baseline and result.ops_per_sec < baseline[result.name] * (1 - allowed_drop(result, threshold))
+    ]
+
+# Measure again whatever looks regressed, up to retries times, keeping the best throughput of all the runs.
+# A real regression stays slow every time, a burst of load on the machine doesn't
+def confirm_regressions(
+        results: list[BenchResult],
+        baseline: dict[str, float],
+        threshold: float,
+        seed: int = DEFAULT_SEED,
+        rounds: int = DEFAULT_ROUNDS,
+        retries: int = DEFAULT_RETRIES
+    ) -> list[str]:
+    known = {benchmark.name: benchmark for benchmark in BENCHMARKS}
+    by_name = {result.name: result for result in results}
+    failed = regressions(results, baseline, threshold)
+    for _ in range(retries):
+        if not failed:
+            break
+        for name in failed:
+            again = run_benchmark(known[name], seed, rounds)
+            if again.ops_per_sec > by_name[name].ops_per_sec:
+                by_name[name].ops_per_sec = again.ops_per_sec
+                by_name[name].noise = again.noise
+        failed = regressions([by_name[name] for name in failed], baseline, threshold)
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Seeded combat and match throughput benchmarks")
+    parser.add_argument("names", nargs="*", help="benchmarks to run, all by default")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="timing rounds per benchmark, the best one counts")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="times a regressed benchmark is measured again before failing")
+    parser.add_argument("--save", help="write ops/sec of this run to a baseline JSON file, keeping the benchmarks not run")
+    parser.add_argument("--baseline", help="compare against this baseline JSON file and fail on a regression")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed throughput drop, 0.15 is 15%%, more when the run is noisier")
+    parser.add_argument("--effect-sizes", type=int, nargs="*", metavar="SIZE", help="instead, time the effect hooks per coin as the effect catalog grows to these sizes")
+    parser.add_argument("--effect-loadout", type=int, default=5, help="effects on the equipped identity")
+    parser.add_argument("--effect-coins", type=int, default=200_000, help="coins tossed per effect timing round")
+    args = parser.parse_args()
+
+    if args.effect_sizes is not None:
+        print(f"{'catalog':>8}{'plain ns/coin':>15}{'equipped ns/coin':>18}")
+        for row in effect_benchmark(args.effect_sizes or [0, 10, 100, 1000, 10000], args.effect_loadout, args.effect_coins, args.seed, args.rounds):
+            print(f"{row['catalog']:>8,}{row['plain_ns_per_coin']:>15.0f}{row['equipped_ns_per_coin']:>18.0f}")
+        return
+
+    known = {benchmark.name: benchmark for benchmark in BENCHMARKS}
+    unknown = [name for name in args.names if name not in known]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}. Choose from {', '.join(known)}")
+    selected = [known[name] for name in args.names] if args.names else BENCHMARKS
+
+    baseline: dict[str, float] = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    results = []
+    print(f"{'benchmark':<24}{'ops/sec':>14}{'bytes/op':>12}{'noise':>8}{'vs baseline':>13}")
+    for benchmark in selected:
+        result = run_benchmark(benchmark, args.seed, args.rounds)
+        results.append(result)
+        change = ""
+        if result.name in baseline:
+            change = f"{result.ops_per_sec / baseline[result.name] - 1:+.1%}"
+        print(f"{result.name:<24}{result.ops_per_sec:>14,.0f}{result.bytes_per_op:>12,.0f}{result.noise:>8.0%}{change:>13}")
+
+    failed = confirm_regressions(results, baseline, args.threshold, args.seed, args.rounds, args.retries)
+    if args.save:
+        saved: dict[str, float] = {}
+        if os.path.exists(args.save):
+            with open(args.save, encoding="utf-8") as file:
+                saved = json.load(file)
+        saved.update({result.name: result.ops_per_sec for result in results})
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(saved, file, indent=2)
+    if failed:
+        drops = ", ".join(
+            f"{result.name} {result.ops_per_sec / baseline[result.name] - 1:+.1%}"
+            for result in results if result.name in failed
+        )
+        print(f"Throughput regressed more than allowed after {args.retries} more runs: {drops}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
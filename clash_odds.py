@@ -0,0 +1,102 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from functools import lru_cache
+from math import comb
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # main.py imports damage_odds, which builds on this module
+    from main import Skill
+
+# Exact outcome of Action.clash between two skills.
+# att_coins_left[k] / defn_coins_left[k] is the chance that side wins the clash with k coins left,
+# expected_rounds counts every clash round including the even ones, like clash_num in Action.clash
+@dataclass(frozen=True)
+class ClashOdds:
+    win: float
+    att_coins_left: tuple[float, ...]
+    defn_coins_left: tuple[float, ...]
+    expected_rounds: float
+
+    @property
+    def lose(self) -> float:
+        return 1 - self.win
+
+    # Sanity restored to the winner, 10 + clash rounds
+    @property
+    def expected_sanity_heal(self) -> float:
+        return 10 + self.expected_rounds
+
+def head_chance(sanity: int) -> float:
+    return min(max(50 + sanity, 0), 100) / 100
+
+# Chance of each coin value total when tossing the remaining coins of a skill
+@lru_cache(maxsize=None)
+def _roll_distribution(baseval: int, coinval: int, coins: int, sanity: int) -> tuple[tuple[int, float], ...]:
+    p = head_chance(sanity)
+    return tuple(
+        (baseval + coinval * heads, comb(coins, heads) * p ** heads * (1 - p) ** (coins - heads))
+        for heads in range(coins + 1)
+    )
+
+# Chance that the attacker wins, loses or ties one clash round
+@lru_cache(maxsize=None)
+def _round_odds(att: tuple[int, int], att_coins: int, att_sanity: int, defn: tuple[int, int], defn_coins: int, defn_sanity: int) -> tuple[float, float, float]:
+    win = lose = tie = 0.0
+    defn_rolls = _roll_distribution(defn[0], defn[1], defn_coins, defn_sanity)
+    for att_val, att_p in _roll_distribution(att[0], att[1], att_coins, att_sanity):
+        for defn_val, defn_p in defn_rolls:
+            if att_val > defn_val:
+                win += att_p * defn_p
+            elif defn_val > att_val:
+                lose += att_p * defn_p
+            else:
+                tie += att_p * defn_p
+    return win, lose, tie
+
+def _skill_key(skill: Skill) -> tuple[int, int, int]:
+    return skill.baseval, skill.coinnum, skill.coinval
+
+def clash_odds(att_skill: Skill, defn_skill: Skill, att_sanity: int = 0, defn_sanity: int = 0) -> ClashOdds:
+    return _clash_odds(_skill_key(att_skill), _skill_key(defn_skill), att_sanity, defn_sanity)
+
+# Dynamic programming over (attacker coins lost, defender coins lost).
+# Even rounds change nothing, so each state only moves on a decisive round; they only add to the round count
+@lru_cache(maxsize=65536)
+def _clash_odds(att: tuple[int, int, int], defn: tuple[int, int, int], att_sanity: int, defn_sanity: int) -> ClashOdds:
+    att_base, att_count, att_val = att
+    defn_base, defn_count, defn_val = defn
+    att_left = [0.0] * (att_count + 1)
+    defn_left = [0.0] * (defn_count + 1)
+    if defn_count == 0:
+        att_left[att_count] = 1.0
+        return ClashOdds(1.0, tuple(att_left), tuple(defn_left), 0.0)
+    if att_count == 0:
+        defn_left[defn_count] = 1.0
+        return ClashOdds(0.0, tuple(att_left), tuple(defn_left), 0.0)
+
+    # reach[att_lost][defn_lost]: chance the clash passes through that state
+    reach = [[0.0] * (defn_count + 1) for _ in range(att_count + 1)]
+    reach[0][0] = 1.0
+    expected_rounds = 0.0
+    for att_lost in range(att_count):
+        for defn_lost in range(defn_count):
+            here = reach[att_lost][defn_lost]
+            if here == 0.0:
+                continue
+            win, lose, tie = _round_odds(
+                (att_base, att_val), att_count - att_lost, att_sanity,
+                (defn_base, defn_val), defn_count - defn_lost, defn_sanity,
+            )
+            decisive = win + lose
+            if decisive == 0.0:
+                raise ValueError("The clash can never be decided, every round is even")
+            expected_rounds += here / decisive
+            reach[att_lost][defn_lost + 1] += here * win / decisive
+            reach[att_lost + 1][defn_lost] += here * lose / decisive
+
+    for att_lost in range(att_count):
+        att_left[att_count - att_lost] = reach[att_lost][defn_count]
+    for defn_lost in range(defn_count):
+        defn_left[defn_count - defn_lost] = reach[att_count][defn_lost]
+    return ClashOdds(sum(att_left), tuple(att_left), tuple(defn_left), expected_rounds)
@@ -0,0 +1,71 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from clash_odds import head_chance
+
+if TYPE_CHECKING:
+    # main.py imports this module for its target prompt
+    from main import Character, Skill
+
+# Exact outcome of Action.one_side_attack against one target.
+# damage[k] is the chance the target loses k health (capped at the health it has), stagger and kill
+# are the chances it ends the attack staggered by it or dead
+@dataclass(frozen=True)
+class OneSideOdds:
+    damage: dict[int, float]
+    stagger: float
+    kill: float
+
+    @property
+    def expected_damage(self) -> float:
+        return sum(damage * p for damage, p in self.damage.items())
+
+def one_side_odds(skill: Skill, sanity: int, target: Character, coin_lost: int = 0) -> OneSideOdds:
+    staggered = target.is_stagger()
+    resistance = 2 if staggered else target.resistance.of_type(skill.skill_type)
+    return _one_side_odds(
+        skill.baseval, skill.coinnum - coin_lost, skill.coinval, sanity,
+        resistance, 0 if staggered else target.curstag, target.curhp,
+    )
+
+# Dynamic programming over the coins, one state per (heads so far, damage so far, staggered yet).
+# Keyed by everything the outcome depends on, so a cached entry only stops being used once one of them changes:
+# the skill, the attacker's sanity, the target's resistance to the skill, and the target's stagger and health left.
+# A stagger halfway through makes the rest of the coins hit for double, and a kill ends the attack
+@lru_cache(maxsize=65536)
+def _one_side_odds(base: int, coins: int, coinval: int, sanity: int, resistance: float, stagger_left: int, hp: int) -> OneSideOdds:
+    p = head_chance(sanity)
+    states = {(0, 0, stagger_left <= 0): 1.0}
+    ended: dict[tuple[int, bool], float] = {}
+    for _ in range(coins):
+        following: dict[tuple[int, int, bool], float] = {}
+        for (heads, dealt, staggered), chance in states.items():
+            for head, coin_chance in ((1, p), (0, 1 - p)):
+                if coin_chance == 0.0:
+                    continue
+                total_heads = heads + head
+                damage = int((base + coinval * total_heads) * (2 if staggered else resistance))
+                now_dealt = dealt + damage
+                now_staggered = staggered or now_dealt >= stagger_left
+                if now_dealt >= hp:
+                    key = (hp, now_staggered)
+                    ended[key] = ended.get(key, 0.0) + chance * coin_chance
+                else:
+                    key = (total_heads, now_dealt, now_staggered)
+                    following[key] = following.get(key, 0.0) + chance * coin_chance
+        states = following
+    for (_, dealt, staggered), chance in states.items():
+        ended[(dealt, staggered)] = ended.get((dealt, staggered), 0.0) + chance
+
+    damage: dict[int, float] = {}
+    stagger = kill = 0.0
+    already = stagger_left <= 0
+    for (dealt, staggered), chance in ended.items():
+        damage[dealt] = damage.get(dealt, 0.0) + chance
+        if staggered and not already:
+            stagger += chance
+        if dealt >= hp:
+            kill += chance
+    return OneSideOdds(dict(sorted(damage.items())), stagger, kill)
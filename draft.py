@@ -0,0 +1,114 @@
+from __future__ import annotations
+import argparse
+import time
+from typing import Callable
+
+from main import identity_catalog
+from tournament import PairingResult, Roster, load_results
+
+# Same snake draft as main(): P1, P2, P2, P1, P1, P2
+PICK_ORDER = (0, 1, 1, 0, 0, 1)
+
+# Chance that the first roster beats the second, rosters in ascending identity order
+Matchup = Callable[[Roster, Roster], float]
+
+# Win rates of a tournament run. A pairing only played the other way round counts from the other seat,
+# one never played counts as even
+def roster_matchups(results: dict[tuple[Roster, Roster], PairingResult]) -> Matchup:
+    rates = {pairing: result.win_rate for pairing, result in results.items() if result.games}
+
+    def matchup(team1: Roster, team2: Roster) -> float:
+        rate = rates.get((team1, team2))
+        if rate is not None:
+            return rate
+        rate = rates.get((team2, team1))
+        return 1 - rate if rate is not None else 0.5
+    return matchup
+
+# Rosters scored from identity against identity win rates, the mean over all nine pairings
+def identity_matchups(rates: dict[int, dict[int, float]]) -> Matchup:
+    def matchup(team1: Roster, team2: Roster) -> float:
+        return sum(rates[a][b] for a in team1 for b in team2) / (len(team1) * len(team2))
+    return matchup
+
+# Minimax over the draft tree: player 1 picks to raise player 1's win rate, player 2 to lower it.
+# Positions are memoized by the two sets of picked identities (as bitmasks), whatever order they were picked in,
+# so after solve() every recommendation is a dictionary lookup
+class DraftSolver:
+    def __init__(self, matchup: Matchup, identities: list[int] | None = None, order: tuple[int, ...] = PICK_ORDER):
+        self.matchup = matchup
+        self.identities = list(identities) if identities is not None else identity_catalog().numbers()
+        self.order = order
+        self.bits = {number: 1 << i for i, number in enumerate(self.identities)}
+        # (team1 mask, team2 mask) -> (player 1's win rate with best play from here, best pick of the side to move)
+        self.memo: dict[tuple[int, int], tuple[float, int | None]] = {}
+
+    def _roster(self, mask: int) -> Roster:
+        return tuple(number for number in self.identities if mask & self.bits[number])
+
+    def _value(self, mask1: int, mask2: int) -> tuple[float, int | None]:
+        known = self.memo.get((mask1, mask2))
+        if known is not None:
+            return known
+        picked = (mask1 | mask2).bit_count()
+        if picked == len(self.order):
+            result = (self.matchup(self._roster(mask1), self._roster(mask2)), None)
+        else:
+            first = self.order[picked] == 0
+            best_value, best_pick = None, None
+            for number in self.identities:
+                bit = self.bits[number]
+                if (mask1 | mask2) & bit:
+                    continue
+                value = self._value(mask1 | bit, mask2)[0] if first else self._value(mask1, mask2 | bit)[0]
+                if best_value is None or (value > best_value if first else value < best_value):
+                    best_value, best_pick = value, number
+            result = (best_value, best_pick)
+        self.memo[(mask1, mask2)] = result
+        return result
+
+    def _masks(self, picks1: list[int], picks2: list[int]) -> tuple[int, int]:
+        mask1 = mask2 = 0
+        for number in picks1:
+            mask1 |= self.bits[number]
+        for number in picks2:
+            mask2 |= self.bits[number]
+        if mask1 & mask2 or (mask1 | mask2).bit_count() != len(picks1) + len(picks2):
+            raise ValueError("An identity can only be picked once")
+        return mask1, mask2
+
+    # Solve the whole tree up front
+    def solve(self) -> float:
+        return self._value(0, 0)[0]
+
+    # Best pick for whoever picks next and player 1's win rate if both sides keep picking their best,
+    # or (None, win rate) once the draft is over
+    def recommend(self, picks1: list[int], picks2: list[int]) -> tuple[int | None, float]:
+        value, pick = self._value(*self._masks(picks1, picks2))
+        return pick, value
+
+def main():
+    parser = argparse.ArgumentParser(description="Best pick of the 1-2-2-1 draft from tournament win rates")
+    parser.add_argument("checkpoint", help="tournament results file (JSON lines)")
+    parser.add_argument("--picks", type=int, nargs="*", default=[], help="identities picked so far, in draft order")
+    args = parser.parse_args()
+
+    solver = DraftSolver(roster_matchups(load_results(args.checkpoint)))
+    start = time.perf_counter()
+    solver.solve()
+    solved = time.perf_counter() - start
+    picks: tuple[list[int], list[int]] = ([], [])
+    for side, number in zip(PICK_ORDER, args.picks):
+        picks[side].append(number)
+    start = time.perf_counter()
+    pick, value = solver.recommend(*picks)
+    answered = time.perf_counter() - start
+    print(f"Solved {len(solver.memo):,} positions in {solved:.2f}s, answered in {answered * 1000:.3f} ms")
+    if pick is None:
+        print(f"Draft over, player 1 wins {value:.1%}")
+    else:
+        side = PICK_ORDER[len(args.picks)] + 1
+        print(f"Player {side} should pick {pick} ({identity_catalog()[pick].name}), player 1 then wins {value:.1%}")
+
+if __name__ == "__main__":
+    main()
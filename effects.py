@@ -0,0 +1,148 @@
+from __future__ import annotations
+import json
+import os
+from dataclasses import dataclass
+from typing import Callable
+
+from main import HOOKS, NO_EFFECTS, BusCharacter, Character, Effect, EffectTable, Team
+
+EFFECTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "effects.json")
+# Effects never push sanity past this either way. With 95 in 100 heads a tied clash still ends, with every coin
+# heads on both sides two equal skills would clash forever. Clash wins can take sanity further, and an effect
+# then leaves it where it is rather than pulling it back
+SANITY_LIMIT = 45
+
+# One catalogued effect: kind and amount say what it does, hook when. Source is where it comes from
+# (an EGO tier such as "zayin", "resonance", a Mephistopheles part) and changes nothing in combat
+@dataclass(frozen=True)
+class EffectSpec:
+    name: str
+    hook: str
+    kind: str
+    amount: int
+    source: str = ""
+
+def _shift_sanity(owner: Character, change: int):
+    if change > 0:
+        owner.sanity = max(owner.sanity, min(owner.sanity + change, SANITY_LIMIT))
+    elif change < 0:
+        owner.sanity = min(owner.sanity, max(owner.sanity + change, -SANITY_LIMIT))
+
+def _sanity(amount: int) -> Effect:
+    def effect(owner: Character, other: Character | None, value: int) -> int:
+        _shift_sanity(owner, amount)
+        return value
+    return effect
+
+# value is the heads of the toss
+def _sanity_per_head(amount: int) -> Effect:
+    def effect(owner: Character, other: Character | None, value: int) -> int:
+        _shift_sanity(owner, amount * value)
+        return value
+    return effect
+
+def _heal(amount: int) -> Effect:
+    def effect(owner: Character, other: Character | None, value: int) -> int:
+        if owner.curhp > 0:
+            owner.curhp = min(owner.curhp + amount, owner.maxhp)
+        return value
+    return effect
+
+def _recover_stagger(amount: int) -> Effect:
+    def effect(owner: Character, other: Character | None, value: int) -> int:
+        if owner.curstag > 0:
+            owner.curstag = min(owner.curstag + amount, owner.maxstag)
+        return value
+    return effect
+
+def _damage(amount: int) -> Effect:
+    def effect(owner: Character, other: Character | None, value: int) -> int:
+        return max(value + amount, 0)
+    return effect
+
+# Kind -> (builder of the effect from its amount, hooks it may be registered on)
+KINDS: dict[str, tuple[Callable[[int], Effect], tuple[str, ...]]] = {
+    "sanity": (_sanity, HOOKS),
+    "sanity_per_head": (_sanity_per_head, ("coin_toss",)),
+    "heal": (_heal, HOOKS),
+    "recover_stagger": (_recover_stagger, ("coin_toss", "on_hit", "clash_win", "turn_start")),
+    "damage": (_damage, ("on_hit",)),
+}
+
+# Every catalogued effect, plus which ones each identity has and which ones each Mephistopheles part gives to
+# the whole team. Effects are built once here, and a table is compiled once per distinct loadout and shared by
+# every character with that loadout
+class EffectCatalog:
+    def __init__(
+            self,
+            specs: list[EffectSpec],
+            identities: dict[int, list[str]] | None = None,
+            parts: dict[str, list[str]] | None = None
+        ):
+        self.specs: dict[str, EffectSpec] = {}
+        self.effects: dict[str, Effect] = {}
+        for spec in specs:
+            if spec.name in self.specs:
+                raise ValueError(f"Effect {spec.name} is declared twice")
+            if spec.kind not in KINDS:
+                raise ValueError(f"Effect {spec.name} has unknown kind {spec.kind}")
+            build, hooks = KINDS[spec.kind]
+            if spec.hook not in hooks:
+                raise ValueError(f"Effect {spec.name} of kind {spec.kind} can't fire on {spec.hook}")
+            self.specs[spec.name] = spec
+            self.effects[spec.name] = build(spec.amount)
+        self.identities = {number: list(names) for number, names in (identities or {}).items()}
+        self.parts = {part: list(names) for part, names in (parts or {}).items()}
+        for names in (*self.identities.values(), *self.parts.values()):
+            for name in names:
+                if name not in self.specs:
+                    raise ValueError(f"Unknown effect {name}")
+        self.tables: dict[tuple[str, ...], EffectTable] = {(): NO_EFFECTS}
+
+    def __len__(self) -> int:
+        return len(self.specs)
+
+    # Dispatch table of the named effects, which fire in the order given on every hook
+    def compile(self, names: list[str] | tuple[str, ...]) -> EffectTable:
+        key = tuple(dict.fromkeys(names))
+        table = self.tables.get(key)
+        if table is None:
+            by_hook: dict[str, list[Effect]] = {hook: [] for hook in HOOKS}
+            for name in key:
+                by_hook[self.specs[name].hook].append(self.effects[name])
+            table = EffectTable(**{hook: tuple(effects) for hook, effects in by_hook.items()})
+            self.tables[key] = table
+        return table
+
+    # The catalog as load_effects() reads it, so a replay can carry the catalog it was played with
+    def to_data(self) -> dict:
+        return {
+            "effects": [
+                {"name": spec.name, "hook": spec.hook, "kind": spec.kind, "amount": spec.amount, "source": spec.source}
+                for spec in self.specs.values()
+            ],
+            "identities": {str(number): names for number, names in self.identities.items()},
+            "parts": self.parts,
+        }
+
+    @staticmethod
+    def from_data(data: dict) -> EffectCatalog:
+        specs = [
+            EffectSpec(entry["name"], entry["hook"], entry["kind"], int(entry["amount"]), entry.get("source", ""))
+            for entry in data["effects"]
+        ]
+        identities = {int(number): names for number, names in data.get("identities", {}).items()}
+        return EffectCatalog(specs, identities, data.get("parts", {}))
+
+    # Give every identity of team the effects of its number and of the team's parts, at the start of a match.
+    # numbers are the identity numbers the team was built from, slot by slot
+    def equip(self, team: Team, numbers: list[int], parts: list[str] | tuple[str, ...] = ()):
+        shared = [name for part in parts for name in self.parts[part]]
+        for character, number in zip(team.characters, numbers):
+            if isinstance(character, BusCharacter):
+                continue
+            character.effects = self.compile(self.identities.get(number, []) + shared)
+
+def load_effects(path: str = EFFECTS_PATH) -> EffectCatalog:
+    with open(path, encoding="utf-8") as file:
+        return EffectCatalog.from_data(json.load(file))
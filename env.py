@@ -0,0 +1,258 @@
+from __future__ import annotations
+import argparse
+import random
+import time
+
+import numpy as np
+
+from batch import TEAM_SIZE, UNITS, BatchActions, BatchState
+from main import BusCharacter, GameManager, GameOver, Team, identity_catalog, numbers_to_characters
+from match_random import MatchRandom
+from simulate import Decision, Policy, Roster, apply_decisions, new_match, random_policy
+
+# Per unit, in this order: health, stagger, sanity, speed, both skills of the cycle, death and stagger timers
+FEATURES = ("hp", "stagger", "sanity", "speed", "skill1", "skill2", "deathtimer", "staggertimer")
+OBSERVATION_SHAPE = (UNITS, len(FEATURES))
+# One action per character: skill slot x target slot x clash (odd) or one-sided (even)
+ACTIONS = 2 * TEAM_SIZE * 2
+# One action for each character that isn't Mephistopheles, a negative one leaves the character idle
+ACTORS = TEAM_SIZE - 1
+
+def encode_action(slot: int, target: int, clash: bool) -> int:
+    return ((slot - 1) * TEAM_SIZE + target) * 2 + int(clash)
+
+def decode_action(action: int) -> tuple[int, int, bool]:
+    return action // (2 * TEAM_SIZE) + 1, action // 2 % TEAM_SIZE, bool(action & 1)
+
+def _random_rosters(rng: random.Random) -> tuple[list[int], list[int]]:
+    picks = rng.sample(identity_catalog().numbers(), 2 * ACTORS)
+    return picks[:ACTORS], picks[ACTORS:]
+
+def _team_rows(team: Team) -> list[list[int]]:
+    rows = []
+    for character in team.characters:
+        if isinstance(character, BusCharacter):
+            rows.append([character.curhp, 0, 0, 0, 0, 0, character.deathtimer, 0])
+        else:
+            rows.append([
+                character.curhp, character.curstag, character.sanity, character.speed,
+                character.skillcycle[0], character.skillcycle[1], character.deathtimer, character.staggertimer,
+            ])
+    return rows
+
+# Gym-style environment of one match played through GameManager, the agent is player 1 and opponent plays player 2.
+# reset() and step() return observations of OBSERVATION_SHAPE, the agent's team in rows 0-3 and the enemy's in 4-7,
+# step() takes ACTORS actions (see encode_action) for characters 1-3. An action the rules don't allow this act is
+# skipped rather than refused. Rewards are 1 for a win, -1 for a loss and 0 otherwise
+class MatchEnv:
+    def __init__(
+            self,
+            team1_ids: list[int] | None = None,
+            team2_ids: list[int] | None = None,
+            opponent: Policy = random_policy,
+            max_acts: int = 100,
+            roster: Roster = numbers_to_characters
+        ):
+        self.team1_ids = team1_ids
+        self.team2_ids = team2_ids
+        self.opponent = opponent
+        self.max_acts = max_acts
+        self.roster = roster
+        self.manager: GameManager | None = None
+        self.policy_rng = random.Random()
+
+    def observation(self) -> np.ndarray:
+        return np.array(_team_rows(self.manager.player) + _team_rows(self.manager.enemy), dtype=np.float32)
+
+    # Actions allowed this act, shaped (ACTORS, ACTIONS)
+    def action_mask(self) -> np.ndarray:
+        mask = np.zeros((ACTORS, ACTIONS), dtype=bool)
+        team, enemy = self.manager.player, self.manager.enemy
+        for i, character in enumerate(team.characters[1:]):
+            if not character.is_alive() or character.is_stagger():
+                continue
+            for target, target_character in enumerate(enemy.characters):
+                if not target_character.is_alive():
+                    continue
+                for slot in (1, 2):
+                    mask[i, encode_action(slot, target, False)] = True
+                    mask[i, encode_action(slot, target, True)] = character.can_choose_clash(target_character)
+        return mask
+
+    def reset(self, seed: int | None = None) -> tuple[np.ndarray, dict]:
+        if seed is None:
+            seed = random.getrandbits(64)
+        team1_ids, team2_ids = _random_rosters(random.Random(f"draft:{seed}"))
+        team1_ids = self.team1_ids or team1_ids
+        team2_ids = self.team2_ids or team2_ids
+        self.manager = new_match(team1_ids, team2_ids, MatchRandom(seed), self.roster)
+        self.policy_rng = random.Random(f"policy:{seed}")
+        self.manager.next_turn()
+        return self.observation(), {"seed": seed, "team1": team1_ids, "team2": team2_ids}
+
+    # (observation, reward, terminated, truncated, info)
+    def step(self, actions) -> tuple[np.ndarray, float, bool, bool, dict]:
+        manager = self.manager
+        mask = self.action_mask()
+        decisions = []
+        for i, action in enumerate(actions):
+            action = int(action)
+            if 0 <= action < ACTIONS and mask[i, action]:
+                decisions.append(Decision(i + 1, *decode_action(action)))
+            elif 0 <= action < ACTIONS and action & 1 and mask[i, action - 1]:
+                # A clash that isn't possible is fought one-sided, as at the prompt
+                decisions.append(Decision(i + 1, *decode_action(action - 1)))
+        try:
+            apply_decisions(manager, decisions)
+            manager.change_side()
+            apply_decisions(manager, self.opponent(manager, self.policy_rng))
+            manager.change_side()
+            manager.resolve_action()
+        except GameOver as over:
+            reward = -1.0 if over.loser in manager.player.characters else 1.0
+            return self.observation(), reward, True, False, {"act": manager.act}
+        if manager.act >= self.max_acts:
+            return self.observation(), 0.0, False, True, {"act": manager.act}
+        manager.next_turn()
+        return self.observation(), 0.0, False, False, {"act": manager.act}
+
+# MatchEnv over `matches` independent matches played by a BatchState, with the random policy as every opponent.
+# step() takes actions shaped (matches, ACTORS) and returns arrays with one row per match. A match that ends is
+# started over with new random rosters within the same step, so its row of the observation is already the new
+# match's first act, and terminated/truncated say that the previous one ended. The observation, reward and
+# done arrays are reused by every step, copy them to keep them
+class VectorMatchEnv:
+    def __init__(self, matches: int, max_acts: int = 100, seed: int | None = None):
+        self.matches = matches
+        self.max_acts = max_acts
+        self.seed = seed
+        self.numbers = np.array(identity_catalog().numbers(), dtype=np.int32)
+        self.batch: BatchState | None = None
+        self.actions = BatchActions(matches)
+        self.rows = np.arange(matches)[:, None]
+        self.units = np.arange(1, TEAM_SIZE)
+        self.observations = np.zeros((matches, *OBSERVATION_SHAPE), dtype=np.float32)
+        self.rewards = np.zeros(matches, dtype=np.float32)
+        self.terminated = np.zeros(matches, dtype=bool)
+        self.truncated = np.zeros(matches, dtype=bool)
+        # Finished matches so far and those player 1 won
+        self.episodes = 0
+        self.wins = 0
+
+    def _rosters(self, count: int) -> np.ndarray:
+        order = np.argsort(self.batch.rng.random((count, len(self.numbers))), axis=1)
+        return self.numbers[order[:, :2 * ACTORS]]
+
+    def _observe(self) -> np.ndarray:
+        batch, obs = self.batch, self.observations
+        obs[:, :, 0] = batch.curhp
+        obs[:, :, 1] = batch.curstag
+        obs[:, :, 2] = batch.sanity
+        obs[:, :, 3] = batch.speed
+        obs[:, :, 4:6] = batch.skillcycle[:, :, :2]
+        obs[:, :, 6] = batch.deathtimer
+        obs[:, :, 7] = batch.staggertimer
+        # Mephistopheles shows like the Character of the same name: no stagger, speed or skills
+        obs[:, 0, 1:6] = obs[:, TEAM_SIZE, 1:6] = 0
+        obs[:, 0, 7] = obs[:, TEAM_SIZE, 7] = 0
+        return obs
+
+    def reset(self) -> np.ndarray:
+        rng = np.random.default_rng(self.seed)
+        numbers = self.numbers
+        picks = numbers[np.argsort(rng.random((self.matches, len(numbers))), axis=1)[:, :2 * ACTORS]]
+        self.batch = BatchState(picks[:, :ACTORS], picks[:, ACTORS:], rng.integers(2 ** 63))
+        self.batch.next_turn()
+        return self._observe()
+
+    # Actions allowed this act, shaped (matches, ACTORS, ACTIONS)
+    def action_mask(self) -> np.ndarray:
+        batch, rows = self.batch, self.rows
+        ready = (batch.curhp[:, self.units] > 0) & (batch.curstag[:, self.units] >= 1)
+        action = np.arange(ACTIONS)
+        target = TEAM_SIZE + action // 2 % TEAM_SIZE
+        alive = batch.curhp[:, target] > 0
+        can_clash = (
+            ~batch.is_bus[:, target][:, None, :]
+            & (batch.speed[:, self.units][:, :, None] > batch.speed[:, target][:, None, :])
+            & (batch.curstag[:, target] >= 1)[:, None, :]
+        )
+        return ready[:, :, None] & alive[:, None, :] & (((action & 1) == 0) | can_clash)
+
+    def step(self, actions: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, dict]:
+        batch, rows, units = self.batch, self.rows, self.units
+        # Opponents first, then the agent's actions take the first ACTORS columns, which are units 1-3
+        batch.random_actions(self.actions)
+        actions = np.asarray(actions)
+        chosen = np.where(actions >= 0, actions, 0)
+        slot = chosen // (2 * TEAM_SIZE)
+        target = TEAM_SIZE + chosen // 2 % TEAM_SIZE
+        can_clash = (
+            ~batch.is_bus[rows, target]
+            & (batch.speed[:, units] > batch.speed[rows, target])
+            & (batch.curstag[rows, target] >= 1)
+        )
+        ready = (batch.curhp[:, units] > 0) & (batch.curstag[:, units] >= 1) & batch.running()[:, None]
+        self.actions.skill[:, :ACTORS] = batch.skillcycle[rows, units, slot]
+        self.actions.target[:, :ACTORS] = target
+        self.actions.clash[:, :ACTORS] = (chosen & 1).astype(bool) & can_clash
+        self.actions.valid[:, :ACTORS] = ready & (actions >= 0) & (actions < ACTIONS) & (batch.curhp[rows, target] > 0)
+        batch.resolve_action(self.actions)
+
+        winner = batch.winner
+        self.terminated[:] = winner != 0
+        self.truncated[:] = (winner == 0) & (batch.act >= self.max_acts)
+        self.rewards[:] = 0
+        self.rewards[winner == 1] = 1
+        self.rewards[winner == 2] = -1
+        done = np.flatnonzero(self.terminated | self.truncated)
+        if len(done):
+            self.episodes += len(done)
+            self.wins += int(np.count_nonzero(winner[done] == 1))
+            picks = self._rosters(len(done))
+            batch.reset(done, picks[:, :ACTORS], picks[:, ACTORS:])
+        batch.next_turn()
+        return self._observe(), self.rewards, self.terminated, self.truncated, {}
+
+# Env-steps per second of VectorMatchEnv taking random allowed actions, and of MatchEnv for comparison
+def env_benchmark(matches: int, steps: int, seed: int) -> dict:
+    env = VectorMatchEnv(matches, seed=seed)
+    env.reset()
+    rng = np.random.default_rng(seed)
+    # Random actions drawn up front so the benchmark times the simulator, not the agent
+    all_actions = rng.integers(0, ACTIONS, (steps, matches, ACTORS))
+    start = time.perf_counter()
+    for actions in all_actions:
+        env.step(actions)
+    vector_seconds = time.perf_counter() - start
+
+    single = MatchEnv()
+    single_rng = random.Random(seed)
+    single.reset(seed)
+    single_steps = min(steps * matches, 20_000)
+    start = time.perf_counter()
+    for _ in range(single_steps):
+        _, _, terminated, truncated, _ = single.step([single_rng.randrange(ACTIONS) for _ in range(ACTORS)])
+        if terminated or truncated:
+            single.reset(single_rng.getrandbits(64))
+    single_seconds = time.perf_counter() - start
+    return {
+        "matches": matches,
+        "steps": steps,
+        "vector_steps_per_s": steps * matches / vector_seconds,
+        "episodes": env.episodes,
+        "agent_win_rate": env.wins / env.episodes if env.episodes else 0.0,
+        "single_steps_per_s": single_steps / single_seconds,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Env-steps per second of the vectorized training environment")
+    parser.add_argument("--matches", type=int, default=8192)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for name, value in env_benchmark(args.matches, args.steps, args.seed).items():
+        print(f"{name:<20}{value:>14,.2f}" if isinstance(value, float) else f"{name:<20}{value:>14,}")
+
+if __name__ == "__main__":
+    main()
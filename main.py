@@ -1,10 +1,18 @@
 from __future__ import annotations
+import heapq
+import json
+import os
 import random
 import sys
 import time
+import tomllib
 from enum import Enum
 from dataclasses import dataclass
-from itertools import chain
+from itertools import chain, permutations
+from typing import Callable, TextIO
+
+from damage_odds import one_side_odds
+from match_random import MatchRandom
 
 SkillTuple = tuple["Skill", "Skill", "Skill"]
 
@@ -27,7 +35,191 @@ class ActionType(Enum):
     ONESIDE = 1
     CLASH = 2
 
-@dataclass(unsafe_hash=True)
+# Raised when a Mephistopheles goes down, ending the match
+class GameOver(Exception):
+    def __init__(self, loser: Character):
+        super().__init__(f"{loser.name} is destroyed")
+        self.loser = loser
+
+# Combat events. Characters are the live objects, sinks read what they need from them right away
+@dataclass(frozen=True, slots=True)
+class ClashStart:
+    att: Character
+    defn: Character
+
+@dataclass(frozen=True, slots=True)
+class OneSidedAttack:
+    att: Character
+    defn: Character
+    staggered: bool = False
+
+@dataclass(frozen=True, slots=True)
+class AlreadyDead:
+    defn: Character
+
+@dataclass(frozen=True, slots=True)
+class CoinToss:
+    att: Character
+    number: int
+    heads: bool
+
+@dataclass(frozen=True, slots=True)
+class DamageDealt:
+    att: Character
+    defn: Character
+    damage: int
+
+@dataclass(frozen=True, slots=True)
+class ClashRound:
+    att: Character
+    defn: Character
+    number: int
+    att_val: int
+    defn_val: int
+
+# Skills are skill numbers (1 to 3) of the winner's and the loser's clashing skill
+@dataclass(frozen=True, slots=True)
+class ClashWon:
+    winner: Character
+    loser: Character
+    sanity: int
+    winner_skill: int
+    loser_skill: int
+
+@dataclass(frozen=True, slots=True)
+class Stagger:
+    character: Character
+
+@dataclass(frozen=True, slots=True)
+class Death:
+    character: Character
+
+@dataclass(frozen=True, slots=True)
+class Revive:
+    character: Character
+
+@dataclass(frozen=True, slots=True)
+class GameEnd:
+    loser: Character
+
+Event = ClashStart | OneSidedAttack | AlreadyDead | CoinToss | DamageDealt | ClashRound | ClashWon | Stagger | Death | Revive | GameEnd
+
+#Fans combat events out to its sinks. Emitters check active first, so a bus without sinks
+#never builds an event and a headless match pays one attribute read per would-be message
+class EventBus:
+    __slots__ = ("sinks", "active")
+
+    def __init__(self, sinks: list[Callable[[Event], None]] | None = None):
+        self.sinks = list(sinks or [])
+        self.active = bool(self.sinks)
+
+    def subscribe(self, sink: Callable[[Event], None]):
+        self.sinks.append(sink)
+        self.active = True
+
+    def unsubscribe(self, sink: Callable[[Event], None]):
+        self.sinks.remove(sink)
+        self.active = bool(self.sinks)
+
+    def emit(self, event: Event):
+        for sink in self.sinks:
+            sink(event)
+
+# Combat narration shown to the players, paced for a human reader
+class TerminalRenderer:
+    def __init__(self, pacing: bool = True):
+        self.pacing = pacing
+
+    def say(self, text: str):
+        print(text)
+
+    def wait(self, seconds: float):
+        if self.pacing:
+            time.sleep(seconds)
+
+    def __call__(self, event: Event):
+        match event:
+            case ClashStart(att, defn):
+                self.say(f"{att.name} begin clash against {defn.name}")
+                self.wait(0.5)
+            case OneSidedAttack(att, defn, staggered):
+                self.say(f"{att.name} is attacking {'staggered ' if staggered else ''}{defn.name}{'' if staggered else ' one-sided'}")
+                self.wait(0.5)
+            case AlreadyDead(defn):
+                self.say(f"{defn.name} is already dead")
+                self.wait(0.5)
+            case CoinToss(_, number, heads):
+                self.say(f"Toss the coin #{number}")
+                self.wait(0.5)
+                self.say("Coin is on head" if heads else "Coin is on tail")
+                self.wait(0.5)
+            case DamageDealt(att, defn, damage):
+                self.say(f"{att.name} dealt {damage} damage to {defn.name}")
+                self.wait(0.5)
+            case ClashRound(att, defn, number, att_val, defn_val):
+                if att_val > defn_val:
+                    self.say(f"Clash #{number}, {att_val}:{defn_val}. {defn.name} lost a coin.")
+                elif defn_val > att_val:
+                    self.say(f"Clash #{number}, {att_val}:{defn_val}. {att.name} lost a coin.")
+                else:
+                    self.say(f"Clash #{number}, {att_val}:{defn_val}. It's even.")
+                self.wait(0.25)
+            case ClashWon(winner, loser, sanity):
+                self.say(f"{winner.name} won the clash, restores {sanity} sanity and starts attacking {loser.name}")
+                self.wait(0.5)
+            case Stagger(character):
+                self.say(f"{character.name} is staggered!")
+            case Death(character):
+                self.say(f"{character.name} is dead!")
+            case Revive(character):
+                self.say(f"{character.name} is back on its feet!")
+            case GameEnd(_):
+                self.say("Game is over.")
+
+#Writes one JSON object per event, characters by name
+class JsonLinesSink:
+    def __init__(self, file: TextIO):
+        self.file = file
+
+    def __call__(self, event: Event):
+        record = {"event": type(event).__name__}
+        for name in event.__slots__:
+            value = getattr(event, name)
+            record[name] = value.name if isinstance(value, Character) else value
+        self.file.write(json.dumps(record) + "\n")
+
+TERMINAL = EventBus([TerminalRenderer()])
+
+#Points in combat an effect can fire on, see effects.py
+HOOKS = ("coin_toss", "on_hit", "clash_win", "stagger", "turn_start")
+#Called as effect(owner, other, value) and returns the value. For coin_toss the value is the number of heads of
+#one toss: a one-sided attack tosses its coins one at a time (0 or 1), a clash round tosses all the coins left at
+#once. For on_hit it is the damage about to be dealt, for clash_win the clash rounds, and 0 for stagger and
+#turn_start, where there is no other character. turn_start only fires for living characters
+Effect = Callable[["Character", "Character | None", int], int]
+
+#Compiled effects of one character, a tuple per hook holding only the effects registered for it.
+#A hook with nothing registered costs one truth test where it would fire
+class EffectTable:
+    __slots__ = HOOKS
+
+    def __init__(
+            self,
+            coin_toss: tuple[Effect, ...] = (),
+            on_hit: tuple[Effect, ...] = (),
+            clash_win: tuple[Effect, ...] = (),
+            stagger: tuple[Effect, ...] = (),
+            turn_start: tuple[Effect, ...] = ()
+        ):
+        self.coin_toss = coin_toss
+        self.on_hit = on_hit
+        self.clash_win = clash_win
+        self.stagger = stagger
+        self.turn_start = turn_start
+
+NO_EFFECTS = EffectTable()
+
+@dataclass(frozen=True, slots=True)
 class Resistance:
     slash: float
     pierce: float
@@ -42,6 +234,11 @@ class Resistance:
 
 #Class with all informations of ID
 class Character:
+    __slots__ = (
+        "name", "maxhp", "curhp", "maxstag", "curstag", "sanity", "skillcycle", "spmin", "spmax",
+        "speed", "resistance", "skills", "deathtimer", "staggertimer", "rng", "events", "effects",
+    )
+
     def __init__(
             self,
             name:str,
@@ -52,7 +249,8 @@ class Character:
             spmin: int,
             spmax: int,
             resistance: Resistance,
-            skills: SkillTuple
+            skills: SkillTuple,
+            rng: MatchRandom | None = None
         ):
         self.name = name
         self.maxhp = maxhp
@@ -68,38 +266,57 @@ class Character:
         self.skills = skills
         self.deathtimer: int = 0
         self.staggertimer: int = 0
+        self.rng = rng if rng is not None else MatchRandom()
+        self.events = TERMINAL
+        self.effects = NO_EFFECTS
 
     def stagger(self):
-        print(f"{self.name} is staggered!")
+        if self.events.active:
+            self.events.emit(Stagger(self))
         self.staggertimer = 2
+        for effect in self.effects.stagger:
+            effect(self, None, 0)
 
     def die(self):
-        print(f"{self.name} is dead!")
+        if self.events.active:
+            self.events.emit(Death(self))
         self.deathtimer = 3
 
     def set_speed(self):
-        self.speed = random.randint(self.spmin, self.spmax)
+        self.speed = self.rng.randint(self.spmin, self.spmax)
 
     def is_alive(self):
         return self.curhp > 0
+
+    #Mutable state of the character, everything else stays the same for the whole match
+    def save(self) -> tuple:
+        return (self.curhp, self.curstag, self.sanity, self.speed, self.deathtimer, self.staggertimer)
+
+    def load(self, state: tuple):
+        self.curhp, self.curstag, self.sanity, self.speed, self.deathtimer, self.staggertimer = state
     
     def is_stagger(self):
         return self.curstag < 1
 
     def coin_toss(self) -> bool:
-        #True: head / False: tail
-        return random.randint(0,99) < 50 + self.sanity
+        #True: head / False: tail, randint(0,99) < 50 + sanity
+        return self.rng.heads(1, self.sanity) == 1
 
     def next_turn(self):
-        self.set_speed()
+        self.speed = self.rng.randint(self.spmin, self.spmax)
         if self.deathtimer > 0:
             self.deathtimer -= 1
             if self.deathtimer == 0:
                 self.curhp = self.maxhp
+                if self.events.active:
+                    self.events.emit(Revive(self))
         if self.staggertimer > 0:
             self.staggertimer -= 1
             if self.staggertimer == 0:
                 self.curstag = self.maxstag
+        if self.curhp > 0:
+            for effect in self.effects.turn_start:
+                effect(self, None, 0)
     
     #Damage multiplier
     def find_mult(self, skill_type:SkillType) -> float:
@@ -121,14 +338,16 @@ class Character:
             if self.deathtimer == 0:
                 self.die()
 
+    #Only a faster attacker may choose to clash, and never against Mephistopheles or a staggered target
+    def can_choose_clash(self, targ: Character) -> bool:
+        if isinstance(targ, BusCharacter):
+            return False
+        return self.speed > targ.speed and not targ.is_stagger()
+
     #Aim target of the action for the turn
     def target(self, targ: Character, skill_choice: int) -> ActionType:
         print(f"{self.name} targets {targ.name} with skill S{skill_choice} by speed of {self.speed}.")
-        if isinstance(targ, BusCharacter):
-            return ActionType.ONESIDE
-        if self.speed > targ.speed:
-            if targ.is_stagger():
-                return ActionType.ONESIDE
+        if self.can_choose_clash(targ):
             print(f"{self.name} is faster than {targ.name}, you can choose to perform one-side attack or clash")
             choice = 0
             while True:
@@ -176,16 +395,21 @@ class Character:
                 print("Invalid input. Please enter a valid integer.")
         return self.skillcycle[choice - 1]
 
-    def user_select_target(self, enemy_team: Team) -> int:
+    def user_select_target(self, enemy_team: Team, skill_choice: int | None = None) -> int:
         print(f"Choose which character for {self.name} to attack with speed of {self.speed}")
         enemy_chars = enemy_team.characters
         for i, character in enumerate(enemy_chars, 1):
-            print(f"{i - 1}. {character.basic_info()}")
+            if skill_choice is not None and character.is_alive():
+                #Odds of the skill hitting this target one-sided
+                odds = one_side_odds(self.skills[skill_choice - 1], self.sanity, character)
+                print(f"{i - 1}. {character.basic_info()} (one-sided: {odds.expected_damage:.1f} damage, stagger {odds.stagger:.0%}, kill {odds.kill:.0%})")
+            else:
+                print(f"{i - 1}. {character.basic_info()}")
         choice = 0
         while True:
             try:
                 choice = int(input("Enter the number of the character you want to attack: "))
-                if choice < 0 or choice > 3:
+                if choice < 0 or choice >= len(enemy_chars):
                     print("Wrong input. Try again")
                 elif not enemy_chars[choice].is_alive():
                     print("Invalid input. The target character is dead")
@@ -196,8 +420,10 @@ class Character:
         return choice
     
 class BusCharacter(Character):
-    def __init__(self):
-        super().__init__("Mephistopheles", 50, 100, 0, assign_skillcycle(), 0, 0, Resistance(1, 1, 1), (Skill(0,0,0,"slash"), Skill(0,0,0,"slash"), Skill(0,0,0,"slash")))
+    __slots__ = ()
+
+    def __init__(self, rng: MatchRandom | None = None):
+        super().__init__("Mephistopheles", 50, 100, 0, assign_skillcycle(rng), 0, 0, Resistance(1, 1, 1), BUS_SKILLS, rng)
 
     def next_turn(self):
         pass
@@ -209,6 +435,8 @@ class BusCharacter(Character):
         return f"{self.name} (Health: {self.curhp})"
     
 class Team:
+    __slots__ = ("name", "characters")
+
     def __init__(self, name: str, characters: list[Character]):
         self.name = name
         self.characters = characters
@@ -222,20 +450,23 @@ class Team:
                 ret_str += f"\n{char}"
         return ret_str
 
-@dataclass
+@dataclass(slots=True)
 class Action:
     speed: int
     skill: Skill
     att: Character
     defn: Character
     act_type: ActionType
+    #Number (1 to 3) of skill among the attacker's skills, as declared. Two of them can be the same skill,
+    #so it can't be looked up from skill. 0 for actions not declared from a character's skills
+    skill_number: int = 0
 
     def _is_clash(self, defending_action: Action | None = None):
         return self.act_type == ActionType.CLASH and defending_action is not None and not self.defn.is_stagger()
 
     def battle(self, defending_action: Action | None = None):
         assert defending_action is None or defending_action.att == self.defn
-        if not self.defn.is_alive():
+        if self.defn.curhp <= 0:
             return
         if defending_action != None:
             self.clash(defending_action)
@@ -248,28 +479,45 @@ class Action:
         coin_base = self.skill.baseval
         dmg_val = coin_base
         coin_num = coin_lost
-        while coin_count > coin_num:
+        defn = self.defn
+        events = self.att.events
+        on_coin = self.att.effects.coin_toss
+        on_hit = self.att.effects.on_hit
+        #Every coin is rolled up front. Only the attacker's own coin_toss and on_hit effects can change its sanity
+        #during the attack, so the odds are worked out again before each coin only when it has some
+        live_odds = bool(on_coin or on_hit)
+        heads_below = 50 + self.att.sanity
+        #find_mult, with the resistance looked up once: only a stagger changes the multiplier mid-attack
+        resistance = defn.resistance.of_type(self.skill.skill_type)
+        for roll in self.att.rng.rolls_of(coin_count - coin_lost):
             coin_num += 1
-            dmg_ratio = self.defn.find_mult(self.skill.skill_type)
-            print(f"Toss the coin #{coin_num}")
-            time.sleep(0.5)
-            if self.att.coin_toss():
-                print("Coin is on head")
+            dmg_ratio = 2 if defn.curstag < 1 else resistance
+            if live_odds:
+                heads_below = 50 + self.att.sanity
+            heads = roll < heads_below
+            if on_coin:
+                tossed = int(heads)
+                for effect in on_coin:
+                    tossed = effect(self.att, self.defn, tossed)
+                heads = tossed > 0
+            if heads:
                 dmg_val += coin_val
-            else:
-                print("Coin is on tail")
-            time.sleep(0.5)
             damage = int(dmg_val * dmg_ratio)
-            print(f"{self.att.name} dealt {damage} damage to {self.defn.name}")
-            self.defn.take_damage(damage)
-            time.sleep(0.5)
-            if not self.defn.is_alive():
-                coin_count = 0
-                if isinstance(self.defn, BusCharacter):
-                    print("Game is over.")
-                    sys.exit()
-
-    def clash(self, defend_action: Action):
+            if on_hit:
+                for effect in on_hit:
+                    damage = effect(self.att, self.defn, damage)
+            if events.active:
+                events.emit(CoinToss(self.att, coin_num, heads))
+                events.emit(DamageDealt(self.att, defn, damage))
+            defn.take_damage(damage)
+            if defn.curhp <= 0:
+                if isinstance(defn, BusCharacter):
+                    if events.active:
+                        events.emit(GameEnd(defn))
+                    raise GameOver(defn)
+                break
+
+    def clash(self, defend_action: Action) -> int:
         clash_num = 0
         att_coin_count = self.skill.coinnum
         defn_coin_count = defend_action.skill.coinnum
@@ -279,64 +527,68 @@ class Action:
         defn_coin_base = defend_action.skill.baseval
         att_coin_lost = 0
         defn_coin_lost = 0
+        events = self.att.events
+        att_on_coin = self.att.effects.coin_toss
+        defn_on_coin = self.defn.effects.coin_toss
         while att_coin_count > att_coin_lost and defn_coin_count > defn_coin_lost:
             clash_num += 1
-            att_val = att_coin_base
-            defn_val = defn_coin_base
-            att_coin_num = att_coin_lost
-            defn_coin_num = defn_coin_lost
-            while att_coin_count > att_coin_num:
-                att_coin_num += 1
-                if self.att.coin_toss():
-                    att_val += att_coin_val
-            while defn_coin_count > defn_coin_num:
-                defn_coin_num += 1
-                if self.defn.coin_toss():
-                    defn_val += defn_coin_val
+            #Each side tosses all its remaining coins at once from the match's pre-generated rolls
+            att_heads = self.att.rng.heads(att_coin_count - att_coin_lost, self.att.sanity)
+            defn_heads = self.defn.rng.heads(defn_coin_count - defn_coin_lost, self.defn.sanity)
+            if att_on_coin:
+                for effect in att_on_coin:
+                    att_heads = effect(self.att, self.defn, att_heads)
+            if defn_on_coin:
+                for effect in defn_on_coin:
+                    defn_heads = effect(self.defn, self.att, defn_heads)
+            att_val = att_coin_base + att_coin_val * att_heads
+            defn_val = defn_coin_base + defn_coin_val * defn_heads
+            if events.active:
+                events.emit(ClashRound(self.att, self.defn, clash_num, att_val, defn_val))
             if att_val > defn_val:
-                print(f"Clash #{clash_num}, {att_val}:{defn_val}. {self.defn.name} lost a coin.")
                 defn_coin_lost += 1
-                time.sleep(0.25)
             elif defn_val > att_val:
-                print(f"Clash #{clash_num}, {att_val}:{defn_val}. {self.att.name} lost a coin.")
                 att_coin_lost += 1
-                time.sleep(0.25)
-            else:
-                print(f"Clash #{clash_num}, {att_val}:{defn_val}. It's even.")
-                time.sleep(0.25)
-                continue
         if defn_coin_count == defn_coin_lost:
             san_heal = 10+clash_num
             self.att.sanity += san_heal
-            print(f"{self.att.name} won the clash, restores {san_heal} sanity and starts attacking {self.defn.name}")
-            time.sleep(0.5)
+            if events.active:
+                events.emit(ClashWon(self.att, self.defn, san_heal, self.skill_number, defend_action.skill_number))
+            for effect in self.att.effects.clash_win:
+                effect(self.att, self.defn, clash_num)
             self.one_side_attack(att_coin_lost)
         if att_coin_count == att_coin_lost:
             san_heal = 10+clash_num
             self.defn.sanity += san_heal
-            print(f"{self.defn.name} won the clash, restores {san_heal} sanity and starts attacking {self.att.name}")
-            time.sleep(0.5)
+            if events.active:
+                events.emit(ClashWon(self.defn, self.att, san_heal, defend_action.skill_number, self.skill_number))
+            for effect in self.defn.effects.clash_win:
+                effect(self.defn, self.att, clash_num)
             defend_action.one_side_attack(defn_coin_lost)
+        return clash_num
 
+#Skills are shared by every copy of the game state and never change once built
+@dataclass(frozen=True, slots=True)
 class Skill:
-    def __init__(self, baseval, coinnum, coinval, skill_type:str | SkillType):
-        self.baseval = baseval
-        self.coinnum = coinnum
-        self.coinval = coinval
-        self.skill_type: SkillType
-        if isinstance(skill_type, str):
-            self.skill_type = SkillType.from_str(skill_type)
-        else:
-            self.skill_type = skill_type
+    baseval: int
+    coinnum: int
+    coinval: int
+    skill_type: SkillType
+
+    def __post_init__(self):
+        if isinstance(self.skill_type, str):
+            object.__setattr__(self, "skill_type", SkillType.from_str(self.skill_type))
 
     def __repr__(self):
         return f"{self.baseval}+{self.coinval}*{self.coinnum}, Type: {self.skill_type.name}"
 
+#Every distinct order of [1, 1, 1, 2, 2, 3]. Shuffling the list makes each of them equally likely,
+#so picking one with a single draw gives the same odds
+SKILLCYCLES = tuple(sorted(set(permutations((1, 1, 1, 2, 2, 3)))))
+
 # Roll the skill cycle at the start of character init
-def assign_skillcycle():
-    integer_list = [1, 1, 1, 2, 2, 3]
-    random.shuffle(integer_list)
-    return integer_list
+def assign_skillcycle(rng: random.Random | None = None):
+    return list(SKILLCYCLES[int((rng or random).random() * len(SKILLCYCLES))])
 
 
 
@@ -357,87 +609,172 @@ def get_valid_input(prompt, valid_choices: list[int]):
             choice = int(user_input)
             if choice in valid_choices:
                 return choice
-            print("Invalid choice. Please select a valid integer between 1 to 12.")
+            print("Invalid choice. Please select one of the identities still available.")
         except ValueError:
             print("Invalid input. Please enter an integer.")
 
-def numbers_to_characters(number_list: list[int]):
-    character_mapping = {
-        0: BusCharacter(),
-        1: Character("Yisang", 159, 24, 0, assign_skillcycle(), 4, 8, Resistance(2, 0.5, 1), (Skill(4, 1, 7, "slash"), Skill(4, 2, 4, "pierce"), Skill(6, 3, 2, "slash"))),
-        2: Character("Faust", 186, 28, 0, assign_skillcycle(), 2, 4, Resistance(2, 0.5, 1), (Skill(4, 1, 7, "bash"), Skill(5, 2, 4, "bash"), Skill(7, 2, 2, "pierce"))),
-        3: Character("Don Quixote", 146, 29, 0, assign_skillcycle(), 3, 6, Resistance(1, 0.5, 2), (Skill(4, 1, 7, "pierce"), Skill(4, 1, 12, "pierce"), Skill(3, 3, 3, "pierce"))),
-        4: Character("Ryoshu", 146, 29, 0, assign_skillcycle(), 3, 6, Resistance(0.5, 1, 2), (Skill(4, 1, 7, "slash"), Skill(4, 2, 5, "slash"), Skill(5, 3, 3, "slash"))),
-        5: Character("Meursault", 199, 40, 0, assign_skillcycle(), 2, 3, Resistance(1, 2, 0.5), (Skill(3, 2, 4, "bash"), Skill(6, 1, 9, "bash"), Skill(4, 4, 2, "bash"))),
-        6: Character("Honglu", 146, 29, 0, assign_skillcycle(), 3, 6, Resistance(2, 1, 0.5), (Skill(4, 1, 7, "bash"), Skill(4, 2, 4, "slash"), Skill(6, 2, 4, "bash"))),
-        7: Character("Heathcliff", 171, 26, 0, assign_skillcycle(), 2, 5, Resistance(2, 1, 0.5), (Skill(4, 1, 7, "bash"), Skill(4, 2, 4, "bash"), Skill(4, 2, 8, "bash"))),
-        8: Character("Ishmael", 172, 50, 0, assign_skillcycle(), 5, 8, Resistance(2, 1, 0.5), (Skill(4, 1, 7, "bash"), Skill(6, 1, 9, "bash"), Skill(8, 1, 12, "bash"))),
-        9: Character("Rodion", 172, 26, 0, assign_skillcycle(), 2, 5, Resistance(0.5, 2, 1), (Skill(4, 1, 7, "slash"), Skill(4, 2, 4, "slash"), Skill(4, 4, 2, "slash"))),
-        10: Character("Sinclair", 132, 26, 0, assign_skillcycle(), 3, 7, Resistance(0.5, 2, 1), (Skill(4, 1, 7, "slash"), Skill(4, 3, 2, "slash"), Skill(5, 3, 3, "slash"))),
-        11: Character("Outis", 132, 26, 0, assign_skillcycle(), 3, 7, Resistance(0.5, 1, 2), (Skill(3, 3, 2, "pierce"), Skill(5, 2, 4, "slash"), Skill(7, 1, 14, "pierce"))),
-        12: Character("Gregor", 158, 47, 0, assign_skillcycle(), 3, 7, Resistance(1, 0.5, 2), (Skill(4, 1, 7, "slash"), Skill(5, 1, 10, "pierce"), Skill(6, 2, 4, "pierce"))),
-    }
-
-    character_list = [character_mapping[number] for number in number_list]
-    return character_list
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "identities.json")
+BUS_SKILLS = (Skill(0, 0, 0, "slash"),) * 3
+
+# Stats of one identity as read from the catalog file, Characters are built from it per match
+@dataclass(frozen=True, slots=True)
+class IdentitySpec:
+    number: int
+    name: str
+    maxhp: int
+    maxstag: int
+    spmin: int
+    spmax: int
+    resistance: Resistance
+    skills: SkillTuple
+
+    def build(self, rng: MatchRandom | None = None) -> Character:
+        return Character(self.name, self.maxhp, self.maxstag, 0, assign_skillcycle(rng), self.spmin, self.spmax, self.resistance, self.skills, rng)
+
+#Identity roster loaded from a JSON or TOML file. Equal skills and resistances are interned, so every
+#identity and every match shares the same immutable objects. Characters are only built for the numbers asked for.
+#With watch set, the file is checked before every build and reloaded when it changed
+class IdentityCatalog:
+    def __init__(self, path: str = CATALOG_PATH, watch: bool = False):
+        self.path = path
+        self.watch = watch
+        self.identities: dict[int, IdentitySpec] = {}
+        self.mtime = 0.0
+        self.reload()
+
+    def reload(self):
+        self.mtime = os.stat(self.path).st_mtime
+        if self.path.endswith(".toml"):
+            with open(self.path, "rb") as file:
+                data = tomllib.load(file)
+        else:
+            with open(self.path, encoding="utf-8") as file:
+                data = json.load(file)
+        interned: dict = {}
+        identities = {}
+        for entry in data["identities"]:
+            number = int(entry["number"])
+            if number == 0 or number in identities:
+                raise ValueError(f"Identity number {number} is reserved or used twice in {self.path}")
+            resistance = entry["resistance"]
+            resistance = Resistance(resistance["slash"], resistance["pierce"], resistance["bash"])
+            skills = tuple(
+                interned.setdefault(skill, skill)
+                for skill in (Skill(s["base"], s["coins"], s["coin"], s["type"]) for s in entry["skills"])
+            )
+            if len(skills) != 3:
+                raise ValueError(f"{entry['name']} needs exactly 3 skills")
+            spmin, spmax = entry["speed"]
+            identities[number] = IdentitySpec(
+                number, entry["name"], entry["maxhp"], entry["maxstag"], spmin, spmax,
+                interned.setdefault(resistance, resistance), skills,
+            )
+        self.identities = identities
+
+    def reload_if_changed(self) -> bool:
+        if os.stat(self.path).st_mtime == self.mtime:
+            return False
+        self.reload()
+        return True
+
+    def numbers(self) -> list[int]:
+        return sorted(self.identities)
+
+    def __getitem__(self, number: int) -> IdentitySpec:
+        return self.identities[number]
+
+    def characters(self, number_list: list[int], rng: MatchRandom | None = None) -> list[Character]:
+        if self.watch:
+            self.reload_if_changed()
+        return [BusCharacter(rng) if number == 0 else self.identities[number].build(rng) for number in number_list]
+
+_catalog: IdentityCatalog | None = None
+
+# The catalog numbers_to_characters builds from, read on first use
+def identity_catalog() -> IdentityCatalog:
+    global _catalog
+    if _catalog is None:
+        _catalog = IdentityCatalog()
+    return _catalog
+
+# Swap in another roster file, e.g. a balance pass being tried out
+def load_catalog(path: str = CATALOG_PATH, watch: bool = False) -> IdentityCatalog:
+    global _catalog
+    _catalog = IdentityCatalog(path, watch)
+    return _catalog
+
+def numbers_to_characters(number_list: list[int], rng: MatchRandom | None = None) -> list[Character]:
+    return identity_catalog().characters(number_list, rng)
 
 # action_list: list[Action] = []
 
+#Actions of the act ordered by speed, ties resolved in the order they were declared.
+#Heap entries are [-speed, sequence, action], removed entries keep their slot with action set to None
 class ActionList:
+    __slots__ = ("heap", "by_att", "sequence")
+
     def __init__(self):
-        self.action_list: list[Action] = []
+        self.heap: list[list] = []
+        self.by_att: dict[Character, list] = {}
+        self.sequence = 0
 
     def add_action(self, action: Action):
-        # Check if there's an element with the same att
-        for i, existing_action in enumerate(self.action_list):
-            if existing_action.att.name == action.att.name:
-                self.action_list[i] = action  # Replace existing action with the new one
-                return
-
-        # If no existing att, find the correct position based on speed and insert
-        for i, existing_action in enumerate(self.action_list):
-            if action.speed > existing_action.speed:
-                self.action_list.insert(i, action)
-                break
-        else:
-            self.action_list.append(action)
+        # An attacker has only one action, a new one takes the place of the old one
+        entry = self.by_att.get(action.att)
+        if entry is not None:
+            entry[2] = action
+            return
+        entry = [-action.speed, self.sequence, action]
+        self.sequence += 1
+        self.by_att[action.att] = entry
+        heapq.heappush(self.heap, entry)
 
     def remove_all_actions(self):
-        self.action_list = []
+        self.heap = []
+        self.by_att = {}
 
     def find_action_of_target(self, defender: Character):
-        found_action = None
-        for i, action in enumerate(self.action_list):
-            if action.att.name == defender.name:
-                found_action = action
-                return found_action
-        return None
-
-
+        entry = self.by_att.get(defender)
+        if entry is None:
+            return None
+        return entry[2]
 
     def find_and_remove_action_by_att(self, defender: Character):
-        found_action = None
-
-        for i, action in enumerate(self.action_list):
-            if action.att.name == defender.name:
-                found_action = action
-                del self.action_list[i]
-                return found_action
-
-        return None
+        entry = self.by_att.pop(defender, None)
+        if entry is None:
+            return None
+        found_action = entry[2]
+        entry[2] = None
+        return found_action
     
     def __len__(self) -> int:
-        return len(self.action_list)
+        return len(self.by_att)
+
+    def __iter__(self):
+        return (entry[2] for entry in sorted(self.by_att.values()))
     
     def get_top_and_remove(self) -> Action:
-        return self.action_list.pop(0)
+        while True:
+            action = heapq.heappop(self.heap)[2]
+            if action is not None:
+                del self.by_att[action.att]
+                return action
 
 class GameManager:
-    def __init__(self, action_list: ActionList, team1:Team, team2:Team):
+    __slots__ = ("action_list", "player", "enemy", "act", "events", "recorder", "undo_frames")
+
+    def __init__(self, action_list: ActionList, team1:Team, team2:Team, events: EventBus = TERMINAL):
         self.action_list = action_list
         self.player = team1
         self.enemy = team2
         self.act:int = 0
+        self.events = events
+        #Optional replay recorder, told about every act and declared action
+        self.recorder = None
+        #Open undo frames of push_undo(), each is [act, {character: state before the first change}]
+        self.undo_frames: list[list] = []
+        for character in chain(team1.characters, team2.characters):
+            character.events = events
 
     def __repr__(self) -> str:
         ret_str = "=" * 40
@@ -463,13 +800,13 @@ class GameManager:
         while True:
             try:
                 choice = int(input("Enter the number of the character you want to attack with: "))
-                if choice < 0 or choice > 3:
+                if choice < 0 or choice >= len(characters):
                     print("Wrong input. Try again")
                 elif not characters[choice].is_alive():
                     print("Invalid input. The character can't make an action")
                 elif characters[choice].is_stagger():
                     print("Invalid input. The character is staggered")
-                elif choice == 0:
+                elif isinstance(characters[choice], BusCharacter):
                     print("Invalid choice, Mephistopheles can't make an action")
                 else:
                     break
@@ -483,13 +820,18 @@ class GameManager:
     
         skill_choice = attacking_character.user_select_skill()
     
-        target_choice = attacking_character.user_select_target(self.enemy)
+        target_choice = attacking_character.user_select_target(self.enemy, skill_choice)
         target_character = self.enemy.characters[target_choice]
     
         clash_opt = attacking_character.target(target_character, skill_choice)
+        self.make_action(attacking_character, skill_choice, target_character, clash_opt)
+
+    def make_action(self, attacking_character: Character, skill_choice: int, target_character: Character, clash_opt: ActionType):
         skill = attacking_character.skills[skill_choice - 1]
-        action = Action(attacking_character.speed, skill, attacking_character, target_character, clash_opt)
+        action = Action(attacking_character.speed, skill, attacking_character, target_character, clash_opt, skill_choice)
         self.action_list.add_action(action)
+        if self.recorder is not None:
+            self.recorder.record_action(action, skill_choice)
 
     def user_turn(self):
         print(self)
@@ -509,10 +851,16 @@ class GameManager:
 
     def next_turn(self):
         self.act += 1
+        undo = bool(self.undo_frames)
         for character in chain(self.player.characters, self.enemy.characters):
+            if undo:
+                self._touch(character)
             character.next_turn()
+        if self.recorder is not None:
+            self.recorder.record_act()
 
     def resolve_action(self):
+        events = self.events
         while len(self.action_list) > 0:
             attack_action = self.action_list.get_top_and_remove()
             defend_action = None
@@ -520,31 +868,68 @@ class GameManager:
             if action != None:
                 if action.speed == attack_action.speed:
                     if action.defn == attack_action.att:
-                        print(f"{attack_action.att.name} begin clash against {attack_action.defn.name}")
+                        if events.active:
+                            events.emit(ClashStart(attack_action.att, attack_action.defn))
                         defend_action = self.action_list.find_and_remove_action_by_att(attack_action.defn)
             if attack_action.act_type == ActionType.CLASH:
                 defend_action = self.action_list.find_and_remove_action_by_att(attack_action.defn)
-                if defend_action is None:
-                    if attack_action.defn.is_alive():
-                        print(f"{attack_action.att.name} is attacking {attack_action.defn.name} one-sided")
-                        time.sleep(0.5)
-                else:
-                    print(f"{attack_action.att.name} begin clash against {attack_action.defn.name}")
-                    time.sleep(0.5)
-                    if not defend_action.att.is_alive():
-                        print(f"{attack_action.defn.name} is already dead")
-                        time.sleep(0.5)
-                    elif defend_action.att.is_stagger():
-                        print(f"{attack_action.att.name} is attacking staggered {attack_action.defn.name}")
-                        time.sleep(0.5)
-            if action == None:
+                if events.active:
+                    if defend_action is None:
+                        if attack_action.defn.is_alive():
+                            events.emit(OneSidedAttack(attack_action.att, attack_action.defn))
+                    else:
+                        events.emit(ClashStart(attack_action.att, attack_action.defn))
+                        if not defend_action.att.is_alive():
+                            events.emit(AlreadyDead(attack_action.defn))
+                        elif defend_action.att.is_stagger():
+                            events.emit(OneSidedAttack(attack_action.att, attack_action.defn, True))
+            if action == None and events.active:
                 if attack_action.defn.is_alive():
-                    print(f"{attack_action.att.name} is attacking {attack_action.defn.name} one-sided")
-                    time.sleep(0.5)
+                    events.emit(OneSidedAttack(attack_action.att, attack_action.defn))
                 else:
-                    print(f"{attack_action.defn.name} is already dead")
+                    events.emit(AlreadyDead(attack_action.defn))
+            if self.undo_frames:
+                self._touch(attack_action.att)
+                self._touch(attack_action.defn)
+                if defend_action is not None:
+                    self._touch(defend_action.defn)
             attack_action.battle(defend_action)
 
+    #Random streams the characters draw from, each once. A match normally shares one between every character
+    def _streams(self) -> list[MatchRandom]:
+        return list(dict.fromkeys(character.rng for character in chain(self.player.characters, self.enemy.characters)))
+
+    #Board state at the start of an act: every character's state plus the match's random streams.
+    #Skills, resistances and the rest of the roster are shared with the live game, not copied
+    def snapshot(self) -> tuple:
+        characters = tuple(character.save() for character in chain(self.player.characters, self.enemy.characters))
+        return self.act, characters, tuple(rng.getstate() for rng in self._streams())
+
+    def restore(self, snapshot: tuple):
+        self.act, characters, rng_states = snapshot
+        for character, state in zip(chain(self.player.characters, self.enemy.characters), characters):
+            character.load(state)
+        for rng, rng_state in zip(self._streams(), rng_states):
+            rng.setstate(rng_state)
+        self.action_list.remove_all_actions()
+
+    #Start recording changes; undo() puts back every character touched since then.
+    #Frames nest, and the random stream is not rewound, so replaying from a frame draws new coin tosses
+    def push_undo(self):
+        self.undo_frames.append([self.act, {}])
+
+    def _touch(self, character: Character):
+        changed = self.undo_frames[-1][1]
+        if character not in changed:
+            changed[character] = character.save()
+
+    def undo(self):
+        act, changed = self.undo_frames.pop()
+        for character, state in changed.items():
+            character.load(state)
+        self.act = act
+        self.action_list.remove_all_actions()
+
 def main():
     # Get the player name and create a team of limbus ID to defend mephistopheles 
     print("Welcome to the Limbus Company pvp battle")
@@ -555,35 +940,46 @@ def main():
     p2name = input()
     print("Player 2's name is " + p2name + ".")
 
-    all_numbers = list(range(1, 13))
+    all_numbers = identity_catalog().numbers()
     chosen_numbers = []
     for _ in range(6):
         if len(chosen_numbers) in (0, 3, 4):
-            prompt = f"{p1name}, pick a number from 1 to 12 to add to your team: "
+            prompt = f"{p1name}, pick a number from {all_numbers[0]} to {all_numbers[-1]} to add to your team: "
         if len(chosen_numbers) in (1, 2, 5):
-            prompt = f"{p2name}, pick a number from 1 to 12 to add to your team: "
+            prompt = f"{p2name}, pick a number from {all_numbers[0]} to {all_numbers[-1]} to add to your team: "
         valid_choices = [num for num in all_numbers if num not in chosen_numbers]
         choice = get_valid_input(prompt, valid_choices)
         chosen_numbers.append(choice)
     list1 = [0, chosen_numbers[0], chosen_numbers[3], chosen_numbers[4]]
     list2 = [0, chosen_numbers[1], chosen_numbers[2], chosen_numbers[5]]
-    p1team = Team(p1name, numbers_to_characters(list1))
-    p2team = Team(p2name, numbers_to_characters(list2))
+    #One random stream for the whole match, shared by every character
+    rng = MatchRandom()
+    p1team = Team(p1name, numbers_to_characters(list1, rng))
+    p2team = Team(p2name, numbers_to_characters(list2, rng))
+    if len(sys.argv) > 1:
+        #Effect catalog to equip both teams from. effects.py builds on this module, so it is only imported here
+        from effects import load_effects
+        effects = load_effects(sys.argv[1])
+        effects.equip(p1team, list1)
+        effects.equip(p2team, list2)
 
     manager = GameManager(ActionList(), p1team, p2team)
 
-    while True:
-        #Reduce death timer and bring back alive
-        manager.next_turn()
-
-        # Get player input and perform the attack
-        manager.user_turn()
-        manager.change_side()
-        manager.user_turn()
-        manager.change_side()
-
-        # Start the battle phase
-        manager.resolve_action()
+    try:
+        while True:
+            #Reduce death timer and bring back alive
+            manager.next_turn()
+
+            # Get player input and perform the attack
+            manager.user_turn()
+            manager.change_side()
+            manager.user_turn()
+            manager.change_side()
+
+            # Start the battle phase
+            manager.resolve_action()
+    except GameOver:
+        sys.exit()
 
 if __name__ == "__main__":
     main()
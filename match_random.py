@@ -0,0 +1,117 @@
+from __future__ import annotations
+import hashlib
+import os
+import random
+
+# Bytes of SHAKE-128 output per block of the two sub-streams
+DRAW_BLOCK = 256
+COIN_BLOCK = 512
+TO_FLOAT = 2.0 ** -53
+# Coin rolls are bytes below 200 taken mod 100, which keeps every d100 roll equally likely
+_D100 = bytes(value % 100 for value in range(256))
+_OVER = bytes(range(200, 256))
+
+# Random stream of one match, counter based: block n of a stream is SHAKE-128 of (seed, stream, n), so any
+# number of matches can draw side by side, in any process and any order, and a seed always plays the same.
+# Coin tosses come from their own sub-stream of d100 rolls that a clash reads a whole round at a time;
+# random(), randint() and shuffle() use 64-bit words from the other. Drop-in for random.Random in the game
+class MatchRandom(random.Random):
+    def __init__(self, seed: int | None = None, stream: int = 0):
+        self.stream = stream
+        super().__init__(seed)
+
+    def seed(self, a: int | None = None, version: int = 2):
+        if a is None:
+            a = int.from_bytes(os.urandom(8), "little")
+        if not isinstance(a, int):
+            raise TypeError("MatchRandom is seeded with an integer")
+        self.key = b"%d/%d" % (a, self.stream)
+        self.word_block = 0
+        self.word_position = 0
+        self.words: list[int] = []
+        self.coin_block = 0
+        self.coin_position = 0
+        self.rolls = b""
+        self.gauss_next = None
+
+    def _output(self, kind: bytes, block: int, size: int) -> bytes:
+        return hashlib.shake_128(b"%s/%s/%d" % (self.key, kind, block)).digest(size)
+
+    def _load_words(self, block: int):
+        self.words = memoryview(self._output(b"draw", block, DRAW_BLOCK)).cast("Q").tolist()
+        self.word_block = block + 1
+
+    def _load_rolls(self, block: int):
+        self.rolls = self._output(b"coin", block, COIN_BLOCK).translate(_D100, _OVER)
+        self.coin_block = block + 1
+
+    def random(self) -> float:
+        if self.word_position == len(self.words):
+            self._load_words(self.word_block)
+            self.word_position = 0
+        word = self.words[self.word_position]
+        self.word_position += 1
+        return (word >> 11) * TO_FLOAT
+
+    def getrandbits(self, k: int) -> int:
+        bits = 0
+        for shift in range(0, k, 64):
+            if self.word_position == len(self.words):
+                self._load_words(self.word_block)
+                self.word_position = 0
+            bits |= self.words[self.word_position] << shift
+            self.word_position += 1
+        return bits & ((1 << k) - 1)
+
+    def randint(self, a: int, b: int) -> int:
+        return a + int(self.random() * (b - a + 1))
+
+    def shuffle(self, x: list):
+        for i in reversed(range(1, len(x))):
+            j = int(self.random() * (i + 1))
+            x[i], x[j] = x[j], x[i]
+
+    # The next count d100 rolls (0 to 99), a coin is heads when its roll is below 50 + sanity
+    def rolls_of(self, count: int) -> bytes:
+        start = self.coin_position
+        end = start + count
+        if end > len(self.rolls):
+            return self._rolls_across(count)
+        self.coin_position = end
+        return self.rolls[start:end]
+
+    def _rolls_across(self, count: int) -> bytes:
+        chunk = self.rolls[self.coin_position:]
+        while len(chunk) < count:
+            self._load_rolls(self.coin_block)
+            self.coin_position = min(count - len(chunk), len(self.rolls))
+            chunk += self.rolls[:self.coin_position]
+        return chunk
+
+    # Heads among count coins
+    def heads(self, count: int, sanity: int) -> int:
+        start = self.coin_position
+        end = start + count
+        if end > len(self.rolls):
+            return sum(map((50 + sanity).__gt__, self._rolls_across(count)))
+        self.coin_position = end
+        return sum(map((50 + sanity).__gt__, self.rolls[start:end]))
+
+    def getstate(self) -> tuple:
+        return self.key, self.word_block, self.word_position, self.coin_block, self.coin_position, self.gauss_next
+
+    def setstate(self, state: tuple):
+        key, word_block, self.word_position, coin_block, self.coin_position, self.gauss_next = state
+        if key != self.key:
+            self.key = key
+            self.word_block = self.coin_block = -1
+        if word_block != self.word_block:
+            if word_block == 0:
+                self.words, self.word_block = [], 0
+            else:
+                self._load_words(word_block - 1)
+        if coin_block != self.coin_block:
+            if coin_block == 0:
+                self.rolls, self.coin_block = b"", 0
+            else:
+                self._load_rolls(coin_block - 1)
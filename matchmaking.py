@@ -0,0 +1,252 @@
+from __future__ import annotations
+import argparse
+import heapq
+import random
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Callable, Hashable
+
+DEFAULT_RATING = 1500.0
+K_FACTOR = 32.0
+# The queue's index has one bucket per rating point from 0 to RATING_BUCKETS - 1, ratings outside share the end ones
+RATING_BUCKETS = 4096
+
+def expected_score(rating: float, opponent: float) -> float:
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+# Elo ratings by player name, kept in SQLite so they outlive the server
+class RatingStore:
+    def __init__(self, path: str = ":memory:", k_factor: float = K_FACTOR):
+        self.k_factor = k_factor
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS ratings (name TEXT PRIMARY KEY, rating REAL NOT NULL, games INTEGER NOT NULL)")
+        self.db.commit()
+
+    def rating(self, name: str) -> float:
+        row = self.db.execute("SELECT rating FROM ratings WHERE name = ?", (name,)).fetchone()
+        return row[0] if row is not None else DEFAULT_RATING
+
+    # Both new ratings, after one game between winner and loser (or a draw)
+    def record(self, winner: str, loser: str, draw: bool = False) -> tuple[float, float]:
+        old_winner, old_loser = self.rating(winner), self.rating(loser)
+        score = 0.5 if draw else 1.0
+        change = self.k_factor * (score - expected_score(old_winner, old_loser))
+        with self.db:
+            for name, rating in ((winner, old_winner + change), (loser, old_loser - change)):
+                self.db.execute(
+                    "INSERT INTO ratings VALUES (?, ?, 1) ON CONFLICT(name) DO UPDATE SET rating = excluded.rating, games = games + 1",
+                    (name, rating),
+                )
+        return old_winner + change, old_loser - change
+
+    def top(self, count: int = 10) -> list[tuple[str, float, int]]:
+        return self.db.execute("SELECT name, rating, games FROM ratings ORDER BY rating DESC LIMIT ?", (count,)).fetchall()
+
+    def close(self):
+        self.db.close()
+
+@dataclass(slots=True)
+class QueueEntry:
+    key: Hashable
+    name: str
+    rating: float
+    joined: float
+
+# Waiting players indexed by rating. A Fenwick tree counts the players in every rating bucket, so the nearest
+# waiting rating to any other is found in O(log RATING_BUCKETS) steps however many players wait.
+# Within a bucket players are kept in the order they joined, the longest waiting one is paired first
+class RatingQueue:
+    def __init__(self, buckets: int = RATING_BUCKETS):
+        self.size = buckets
+        self.tree = [0] * (buckets + 1)
+        self.buckets: dict[int, dict[Hashable, QueueEntry]] = {}
+        self.entries: dict[Hashable, QueueEntry] = {}
+        self.top_bit = 1 << (buckets.bit_length() - 1)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def _bucket(self, rating: float) -> int:
+        return min(max(int(rating), 0), self.size - 1)
+
+    def _add(self, bucket: int, delta: int):
+        i = bucket + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    # Players in buckets 0 to bucket
+    def _count_to(self, bucket: int) -> int:
+        i = bucket + 1
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    # Bucket of the kth (from 1) lowest rated waiting player
+    def _kth(self, k: int) -> int:
+        i = 0
+        bit = self.top_bit
+        while bit:
+            if i + bit <= self.size and self.tree[i + bit] < k:
+                i += bit
+                k -= self.tree[i]
+            bit >>= 1
+        return i
+
+    def push(self, entry: QueueEntry):
+        bucket = self._bucket(entry.rating)
+        self.buckets.setdefault(bucket, {})[entry.key] = entry
+        self.entries[entry.key] = entry
+        self._add(bucket, 1)
+
+    def remove(self, key: Hashable) -> QueueEntry | None:
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        bucket = self._bucket(entry.rating)
+        players = self.buckets[bucket]
+        del players[key]
+        if not players:
+            del self.buckets[bucket]
+        self._add(bucket, -1)
+        return entry
+
+    # Longest waiting player of the closest rating within window of rating, None if nobody is that close
+    def nearest(self, rating: float, window: float) -> QueueEntry | None:
+        below = self._count_to(self._bucket(rating))
+        candidates = []
+        if below > 0:
+            candidates.append(self._kth(below))
+        if below < len(self.entries):
+            candidates.append(self._kth(below + 1))
+        best = None
+        for bucket in candidates:
+            entry = next(iter(self.buckets[bucket].values()))
+            if abs(entry.rating - rating) <= window and (best is None or abs(entry.rating - rating) < abs(best.rating - rating)):
+                best = entry
+        return best
+
+# Ranked queue: a joining player is paired at once with the closest rating within base_window, otherwise
+# waits while their window widens by widen_by every widen_every seconds up to max_window.
+# Only players whose window just widened are looked at again by tick(), in order from a heap of due times,
+# so neither joining nor ticking goes through the whole queue. on_pair gets the keys of both players
+class Matchmaker:
+    def __init__(
+            self,
+            ratings: RatingStore,
+            on_pair: Callable[[Hashable, Hashable], None],
+            base_window: float = 50,
+            widen_by: float = 50,
+            widen_every: float = 10.0,
+            max_window: float = 400
+        ):
+        self.ratings = ratings
+        self.on_pair = on_pair
+        self.base_window = base_window
+        self.widen_by = widen_by
+        self.widen_every = widen_every
+        self.max_window = max_window
+        self.queue = RatingQueue()
+        # [due time, sequence, key, joined], stale once the player leaves or joins again
+        self.widenings: list[tuple[float, int, Hashable, float]] = []
+        self.sequence = 0
+
+    def window(self, entry: QueueEntry, now: float) -> float:
+        steps = int((now - entry.joined) / self.widen_every)
+        return min(self.base_window + steps * self.widen_by, self.max_window)
+
+    def _schedule(self, entry: QueueEntry, now: float):
+        if self.window(entry, now) >= self.max_window:
+            return
+        steps = int((now - entry.joined) / self.widen_every) + 1
+        self.sequence += 1
+        heapq.heappush(self.widenings, (entry.joined + steps * self.widen_every, self.sequence, entry.key, entry.joined))
+
+    # Pair entry, already out of the queue, or put it back to wait
+    def _try_pair(self, entry: QueueEntry, now: float) -> bool:
+        opponent = self.queue.nearest(entry.rating, self.window(entry, now))
+        if opponent is None:
+            self.queue.push(entry)
+            self._schedule(entry, now)
+            return False
+        self.queue.remove(opponent.key)
+        # The one who waited longer takes the first seat
+        first, second = (opponent, entry) if opponent.joined <= entry.joined else (entry, opponent)
+        self.on_pair(first.key, second.key)
+        return True
+
+    def join(self, key: Hashable, name: str, now: float) -> float:
+        if key in self.queue:
+            raise ValueError(f"{name} is already waiting")
+        rating = self.ratings.rating(name)
+        self._try_pair(QueueEntry(key, name, rating, now), now)
+        return rating
+
+    def leave(self, key: Hashable):
+        self.queue.remove(key)
+
+    def tick(self, now: float):
+        while self.widenings and self.widenings[0][0] <= now:
+            _, _, key, joined = heapq.heappop(self.widenings)
+            entry = self.queue.entries.get(key)
+            if entry is None or entry.joined != joined:
+                continue
+            self._try_pair(self.queue.remove(key), now)
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+# Fills the queue with players of normally spread ratings, then lets time pass until every window is at its widest
+def queue_benchmark(players: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    ratings = RatingStore()
+    pairs: list[tuple[int, int]] = []
+    matchmaker = Matchmaker(ratings, lambda first, second: pairs.append((first, second)), base_window=0)
+    player_ratings = [rng.gauss(DEFAULT_RATING, 300) for _ in range(players)]
+    # Ratings straight into the queue entries, the store only knows names it has seen a game of
+    start = time.perf_counter()
+    for key, rating in enumerate(player_ratings):
+        matchmaker._try_pair(QueueEntry(key, str(key), rating, 0.0), 0.0)
+    joined = time.perf_counter() - start
+    waiting = len(matchmaker)
+    start = time.perf_counter()
+    now = 0.0
+    while matchmaker.widenings:
+        now += matchmaker.widen_every
+        matchmaker.tick(now)
+    ticked = time.perf_counter() - start
+    gaps = [abs(player_ratings[first] - player_ratings[second]) for first, second in pairs]
+    return {
+        "players": players,
+        "join_us": joined / players * 1e6,
+        "waiting_after_joins": waiting,
+        "tick_seconds": ticked,
+        "pairs": len(pairs),
+        "left_waiting": len(matchmaker),
+        "mean_rating_gap": sum(gaps) / len(gaps) if gaps else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Ranked queue benchmark, or the rating table of a store")
+    parser.add_argument("--players", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", help="print the best rated players of this SQLite rating store instead")
+    args = parser.parse_args()
+
+    if args.top:
+        ratings = RatingStore(args.top)
+        for name, rating, games in ratings.top(20):
+            print(f"{name:<24}{rating:>8.0f}{games:>8}")
+        ratings.close()
+        return
+    for name, value in queue_benchmark(args.players, args.seed).items():
+        print(f"{name:<20}{value:>14,.2f}" if isinstance(value, float) else f"{name:<20}{value:>14,}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+from main import Action, Character, GameManager
+from match_random import MatchRandom
+
+# Functions whose calls and wall time are measured. Times are inclusive: a clash's time covers
+# the one-sided attack that follows it, which covers its take_damage calls
+TIMED = (
+    ("resolve_action", GameManager),
+    ("next_turn", GameManager),
+    ("clash", Action),
+    ("one_side_attack", Action),
+    ("take_damage", Character),
+)
+CLASH_ROUND_BUCKETS = (1, 2, 3, 4, 6, 8, 12)
+
+# Process wide counters and timers of the combat hot path. Nothing is measured until enable(), which wraps
+# the measured methods in place; disable() puts the originals back, so a disabled run costs nothing at all
+class Metrics:
+    installed: Metrics | None = None
+
+    def __init__(self):
+        self.originals: list[tuple[type, str, object]] = []
+        # Updated in place, the installed wrappers hold on to these two
+        self.calls: dict[str, int] = {}
+        self.nanoseconds: dict[str, int] = {}
+        self.reset()
+
+    def reset(self):
+        for name, _ in TIMED:
+            self.calls[name] = 0
+            self.nanoseconds[name] = 0
+        self.coins = 0
+        self.staggers = 0
+        self.deaths = 0
+        self.clash_rounds = 0
+        # Clashes by number of rounds, one count per bucket of CLASH_ROUND_BUCKETS plus one for anything longer
+        self.round_buckets = [0] * (len(CLASH_ROUND_BUCKETS) + 1)
+        self.started = time.time()
+
+    @property
+    def enabled(self) -> bool:
+        return Metrics.installed is self
+
+    def enable(self):
+        if Metrics.installed is self:
+            return
+        if Metrics.installed is not None:
+            raise RuntimeError("Another Metrics instance is already enabled")
+        for name, owner in TIMED:
+            self._patch(owner, name, self._timed(name, getattr(owner, name)))
+        self._patch(Action, "clash", self._clash(Action.clash))
+        self._patch(MatchRandom, "heads", self._coins(MatchRandom.heads))
+        self._patch(MatchRandom, "rolls_of", self._coins(MatchRandom.rolls_of))
+        self._patch(Character, "stagger", self._counted("staggers", Character.stagger))
+        self._patch(Character, "die", self._counted("deaths", Character.die))
+        Metrics.installed = self
+
+    def disable(self):
+        if Metrics.installed is not self:
+            return
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals.clear()
+        Metrics.installed = None
+
+    def _patch(self, owner: type, name: str, wrapper):
+        self.originals.append((owner, name, owner.__dict__[name]))
+        setattr(owner, name, wrapper)
+
+    def _timed(self, name: str, function):
+        calls, nanoseconds = self.calls, self.nanoseconds
+        clock = time.perf_counter_ns
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                calls[name] += 1
+                nanoseconds[name] += clock() - start
+        return timed
+
+    # Action.clash returns how many rounds it took
+    def _clash(self, function):
+        @wraps(function)
+        def clash(action: Action, defend_action: Action):
+            rounds = function(action, defend_action)
+            self.clash_rounds += rounds
+            for i, bound in enumerate(CLASH_ROUND_BUCKETS):
+                if rounds <= bound:
+                    self.round_buckets[i] += 1
+                    break
+            else:
+                self.round_buckets[-1] += 1
+            return rounds
+        return clash
+
+    def _coins(self, function):
+        @wraps(function)
+        def tossed(rng: MatchRandom, count: int, *args):
+            self.coins += count
+            return function(rng, count, *args)
+        return tossed
+
+    def _counted(self, counter: str, function):
+        @wraps(function)
+        def counted(*args, **kwargs):
+            setattr(self, counter, getattr(self, counter) + 1)
+            return function(*args, **kwargs)
+        return counted
+
+    def snapshot(self) -> dict:
+        acts = self.calls["next_turn"]
+        # Clashes cut short by the end of the match never report their rounds
+        clashes = sum(self.round_buckets)
+        return {
+            "time": time.time(),
+            "since": self.started,
+            "functions": {
+                name: {"calls": self.calls[name], "seconds": self.nanoseconds[name] / 1e9}
+                for name, _ in TIMED
+            },
+            "acts": acts,
+            "coins_tossed": self.coins,
+            "staggers": self.staggers,
+            "deaths": self.deaths,
+            "staggers_per_act": self.staggers / acts if acts else 0.0,
+            "deaths_per_act": self.deaths / acts if acts else 0.0,
+            "clash_rounds": self.clash_rounds,
+            "clash_rounds_per_clash": self.clash_rounds / clashes if clashes else 0.0,
+            "clash_round_buckets": dict(zip([*map(str, CLASH_ROUND_BUCKETS), "+Inf"], self.round_buckets)),
+        }
+
+    # Prometheus text exposition format
+    def prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP limbus_calls_total Calls of a measured combat function.",
+            "# TYPE limbus_calls_total counter",
+        ]
+        for name, values in snapshot["functions"].items():
+            lines.append(f'limbus_calls_total{{function="{name}"}} {values["calls"]}')
+        lines += [
+            "# HELP limbus_seconds_total Wall time spent in a measured combat function, nested calls included.",
+            "# TYPE limbus_seconds_total counter",
+        ]
+        for name, values in snapshot["functions"].items():
+            lines.append(f'limbus_seconds_total{{function="{name}"}} {values["seconds"]:.9f}')
+        for metric, key, text in (
+                ("limbus_acts_total", "acts", "Acts played."),
+                ("limbus_coins_tossed_total", "coins_tossed", "Coins tossed in clashes and attacks."),
+                ("limbus_staggers_total", "staggers", "Characters staggered."),
+                ("limbus_deaths_total", "deaths", "Characters killed."),
+            ):
+            lines += [f"# HELP {metric} {text}", f"# TYPE {metric} counter", f"{metric} {snapshot[key]}"]
+        lines += [
+            "# HELP limbus_clash_rounds Rounds per clash.",
+            "# TYPE limbus_clash_rounds histogram",
+        ]
+        cumulative = 0
+        for bound, count in snapshot["clash_round_buckets"].items():
+            cumulative += count
+            lines.append(f'limbus_clash_rounds_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"limbus_clash_rounds_sum {snapshot['clash_rounds']}")
+        lines.append(f"limbus_clash_rounds_count {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    # Prometheus text for a .prom or .txt path, a JSON snapshot otherwise. The file is replaced in one step
+    def write(self, path: str):
+        text = self.prometheus() if path.endswith((".prom", ".txt")) else json.dumps(self.snapshot())
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temporary, path)
+
+METRICS = Metrics()
+
+# Writes METRICS (or the given metrics) to path every interval seconds from a daemon thread, set the returned event to stop
+def write_periodically(path: str, interval: float = 10.0, metrics: Metrics = METRICS) -> threading.Event:
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            metrics.write(path)
+        metrics.write(path)
+
+    threading.Thread(target=run, name="metrics-writer", daemon=True).start()
+    return stop
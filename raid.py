@@ -0,0 +1,96 @@
+from __future__ import annotations
+import argparse
+import random
+import time
+
+from main import EventBus, GameManager, GameOver, identity_catalog, numbers_to_characters
+from match_random import MatchRandom
+from simulate import HEADLESS, Decision, Policy, Roster, alive_targets, apply_decisions, new_match, random_policy, ready_characters
+
+# Raid teams are Mephistopheles in slot 0 followed by any number of identities, the same one any number of times.
+# Nothing in GameManager depends on the team size: the ActionList heap orders actions by speed and its table of
+# actions by attacker pairs clashes, so resolve_action costs O(log n) per action. Policies look at each team once
+# per act, so an act costs O(n log n) in the number of units n whatever the policy picks
+def raid_numbers(units: int, rng: random.Random) -> list[int]:
+    numbers = identity_catalog().numbers()
+    return [rng.choice(numbers) for _ in range(units)]
+
+def new_raid(
+        team1_ids: list[int],
+        team2_ids: list[int],
+        rng: MatchRandom,
+        roster: Roster = numbers_to_characters,
+        events: EventBus = HEADLESS
+    ) -> GameManager:
+    return new_match(team1_ids, team2_ids, rng, roster, events, team1_name="Raid 1", team2_name="Raid 2")
+
+# Ready units go for the living enemies with the least health, per_target of them on each, weakest first.
+# Once every living enemy has its share the rest start again from the weakest
+def focus_policy(per_target: int = 3) -> Policy:
+    def policy(manager: GameManager, rng: random.Random) -> list[Decision]:
+        enemy_chars = manager.enemy.characters
+        targets = sorted(alive_targets(manager.enemy), key=lambda i: enemy_chars[i].curhp)
+        return [
+            Decision(i, rng.randint(1, 2), targets[n // per_target % len(targets)], rng.random() < 0.5)
+            for n, i in enumerate(ready_characters(manager.player))
+        ]
+    return policy
+
+# Mean time per act and per declared action of raids with units identities a side. A raid that ends is started
+# over with new teams, the acts timed are the same number at every size
+def raid_benchmark(units: int, acts: int, seed: int, policy: Policy = random_policy) -> dict:
+    rng = random.Random(seed)
+    policy_rng = random.Random(f"policy:{seed}")
+    act_seconds = resolve_seconds = 0.0
+    actions = raids = 0
+    manager = None
+    for _ in range(acts):
+        if manager is None:
+            manager = new_raid(raid_numbers(units, rng), raid_numbers(units, rng), MatchRandom(rng.getrandbits(64)))
+            raids += 1
+        # play_act, with the declared actions counted and resolve_action timed on its own
+        start = time.perf_counter()
+        manager.next_turn()
+        apply_decisions(manager, policy(manager, policy_rng))
+        manager.change_side()
+        apply_decisions(manager, policy(manager, policy_rng))
+        manager.change_side()
+        actions += len(manager.action_list)
+        resolving = time.perf_counter()
+        try:
+            manager.resolve_action()
+        except GameOver:
+            manager = None
+        now = time.perf_counter()
+        act_seconds += now - start
+        resolve_seconds += now - resolving
+    return {
+        "units": units,
+        "acts": acts,
+        "raids": raids,
+        "actions_per_act": actions / acts,
+        "act_ms": act_seconds / acts * 1000,
+        "resolve_ms": resolve_seconds / acts * 1000,
+        "act_us_per_action": act_seconds / actions * 1e6,
+        "resolve_us_per_action": resolve_seconds / actions * 1e6,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-act cost of raids from 4 to 512 units a side")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[4, 8, 16, 32, 64, 128, 256, 512])
+    parser.add_argument("--acts", type=int, default=200, help="acts timed at every size")
+    parser.add_argument("--policy", choices=("random", "focus"), default="random")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    policy = random_policy if args.policy == "random" else focus_policy()
+    print(f"{'units':>6}{'raids':>7}{'actions/act':>13}{'act ms':>10}{'resolve ms':>12}{'us/action':>11}{'resolve us/action':>19}")
+    for units in args.sizes:
+        result = raid_benchmark(units, args.acts, args.seed, policy)
+        print(
+            f"{units:>6}{result['raids']:>7}{result['actions_per_act']:>13,.1f}{result['act_ms']:>10.3f}{result['resolve_ms']:>12.3f}"
+            f"{result['act_us_per_action']:>11.2f}{result['resolve_us_per_action']:>19.2f}"
+        )
+
+if __name__ == "__main__":
+    main()
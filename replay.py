@@ -0,0 +1,186 @@
+from __future__ import annotations
+import json
+from dataclasses import dataclass, field
+
+from effects import EffectCatalog
+from main import Action, ActionType, GameManager, GameOver
+from match_random import MatchRandom
+from simulate import new_match
+
+MAGIC = b"LCR3"
+# Older logs: before negative seeds, whose seed is stored as is, and before effects, without the effect catalog
+MAGIC_UNSIGNED_SEED = b"LCR2"
+MAGIC_NO_EFFECTS = b"LCR1"
+SNAPSHOT_EVERY = 8
+
+# One declared action: side 0 is team1, character and target are team slots, skill is the skill number (1 to 3)
+@dataclass(frozen=True)
+class RecordedAction:
+    side: int
+    character: int
+    skill: int
+    target: int
+    clash: bool
+
+# Everything needed to play a match again: the game only draws from MatchRandom(seed),
+# so the draft, the effect catalog the match was played with and the declared actions of each act reproduce it exactly
+@dataclass
+class ReplayLog:
+    seed: int
+    team1: tuple[int, ...]
+    team2: tuple[int, ...]
+    acts: list[list[RecordedAction]] = field(default_factory=list)
+    # EffectCatalog.to_data() of the match, None if it had no effects
+    effects: dict | None = None
+
+    # Unsigned LEB128 varints throughout, the seed zigzag encoded first so it may be negative.
+    # An action takes 3 bytes for the usual team sizes
+    def encode(self) -> bytes:
+        out = bytearray(MAGIC)
+        _put(out, _zigzag(self.seed))
+        for team in (self.team1, self.team2):
+            _put(out, len(team))
+            for number in team:
+                _put(out, number)
+        effects = json.dumps(self.effects, separators=(",", ":")).encode() if self.effects is not None else b""
+        _put(out, len(effects))
+        out += effects
+        _put(out, len(self.acts))
+        for actions in self.acts:
+            _put(out, len(actions))
+            for action in actions:
+                _put(out, action.character << 1 | action.side)
+                _put(out, action.skill << 1 | action.clash)
+                _put(out, action.target)
+        return bytes(out)
+
+    @staticmethod
+    def decode(data: bytes) -> ReplayLog:
+        if data[:4] not in (MAGIC, MAGIC_UNSIGNED_SEED, MAGIC_NO_EFFECTS):
+            raise ValueError("Not a replay log")
+        reader = _Reader(data, 4)
+        seed = reader.get()
+        if data[:4] == MAGIC:
+            seed = _unzigzag(seed)
+        teams = []
+        for _ in range(2):
+            teams.append(tuple(reader.get() for _ in range(reader.get())))
+        effects = None
+        if data[:4] != MAGIC_NO_EFFECTS:
+            size = reader.get()
+            if size:
+                effects = json.loads(data[reader.pos:reader.pos + size])
+            reader.pos += size
+        acts = []
+        for _ in range(reader.get()):
+            actions = []
+            for _ in range(reader.get()):
+                character, skill, target = reader.get(), reader.get(), reader.get()
+                actions.append(RecordedAction(character & 1, character >> 1, skill >> 1, target, bool(skill & 1)))
+            acts.append(actions)
+        return ReplayLog(seed, teams[0], teams[1], acts, effects)
+
+def _zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+def _unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+def _put(out: bytearray, value: int):
+    if value < 0:
+        raise ValueError(f"Can't store {value}, replay fields other than the seed are never negative")
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+class _Reader:
+    def __init__(self, data: bytes, pos: int):
+        self.data = data
+        self.pos = pos
+
+    def get(self) -> int:
+        value = shift = 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+# Hooked into GameManager.recorder, appends every act and declared action to a ReplayLog
+class ReplayRecorder:
+    def __init__(
+            self,
+            manager: GameManager,
+            seed: int,
+            team1: tuple[int, ...],
+            team2: tuple[int, ...],
+            effects: EffectCatalog | None = None
+        ):
+        self.log = ReplayLog(seed, tuple(team1), tuple(team2), effects=effects.to_data() if effects is not None else None)
+        self.slots = {}
+        for side, team in enumerate((manager.player, manager.enemy)):
+            for i, character in enumerate(team.characters):
+                self.slots[character] = (side, i)
+        manager.recorder = self
+
+    def record_act(self):
+        self.log.acts.append([])
+
+    def record_action(self, action: Action, skill_choice: int):
+        side, character = self.slots[action.att]
+        target = self.slots[action.defn][1]
+        self.log.acts[-1].append(RecordedAction(side, character, skill_choice, target, action.act_type == ActionType.CLASH))
+
+# Plays a ReplayLog back headless. Snapshots are kept every snapshot_every acts while playing,
+# so seeking back to an act already passed only replays the acts after the nearest snapshot
+class Replayer:
+    def __init__(self, log: ReplayLog, snapshot_every: int = SNAPSHOT_EVERY):
+        self.log = log
+        self.snapshot_every = snapshot_every
+        effects = EffectCatalog.from_data(log.effects) if log.effects is not None else None
+        self.manager = new_match(list(log.team1), list(log.team2), MatchRandom(log.seed), effects=effects)
+        self.teams = (self.manager.player, self.manager.enemy)
+        self.winner: int | None = None
+        self.snapshots: dict[int, tuple] = {0: self.manager.snapshot()}
+
+    @staticmethod
+    def from_bytes(data: bytes, snapshot_every: int = SNAPSHOT_EVERY) -> Replayer:
+        return Replayer(ReplayLog.decode(data), snapshot_every)
+
+    def step(self):
+        manager = self.manager
+        if manager.act >= len(self.log.acts):
+            raise IndexError("The replay has no more acts")
+        manager.next_turn()
+        for action in self.log.acts[manager.act - 1]:
+            team = self.teams[action.side]
+            enemy = self.teams[1 - action.side]
+            clash_opt = ActionType.CLASH if action.clash else ActionType.ONESIDE
+            manager.make_action(team.characters[action.character], action.skill, enemy.characters[action.target], clash_opt)
+        try:
+            manager.resolve_action()
+        except GameOver as over:
+            self.winner = 2 if over.loser in self.teams[0].characters else 1
+            manager.action_list.remove_all_actions()
+        if manager.act % self.snapshot_every == 0:
+            self.snapshots[manager.act] = manager.snapshot()
+
+    # Play every remaining act, returns the winning side (1 or 2) or None if the match was cut short
+    def run(self) -> int | None:
+        while self.winner is None and self.manager.act < len(self.log.acts):
+            self.step()
+        return self.winner
+
+    # State right after act `act` was resolved
+    def seek(self, act: int) -> GameManager:
+        if not 0 <= act <= len(self.log.acts):
+            raise IndexError(f"The replay has acts 0 to {len(self.log.acts)}")
+        if act < self.manager.act or self.winner is not None:
+            self.manager.restore(self.snapshots[max(n for n in self.snapshots if n <= act)])
+            self.winner = None
+        while self.manager.act < act:
+            self.step()
+        return self.manager
@@ -0,0 +1,334 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from main import ClashWon, DamageDealt, Death, EventBus, GameOver, identity_catalog
+from match_random import MatchRandom
+from simulate import new_match, play_act
+from tournament import POLICIES, identities, match_seed
+
+PICKS = 6
+# Column name -> (dtype, shape of one row). Pick columns run team1's three picks then team2's,
+# skill columns are [skill of one side - 1][skill of the other side - 1]. Clashes of a skill number against the
+# same number are left out, one side of them always wins
+COLUMNS = {
+    "seed": (np.uint64, ()),
+    "team1": (np.int8, (3,)),
+    "team2": (np.int8, (3,)),
+    # One bit per identity number of the roster, so roster questions are one integer compare per row
+    "mask1": (np.uint64, ()),
+    "mask2": (np.uint64, ()),
+    "winner": (np.int8, ()),
+    "acts": (np.int16, ()),
+    "damage": (np.int32, (PICKS,)),
+    "clashes_won": (np.int16, (PICKS,)),
+    "deaths": (np.int16, (PICKS,)),
+    "skill_clashes": (np.int16, (3, 3)),
+    "skill_clash_wins": (np.int16, (3, 3)),
+}
+CHUNK_ROWS = 1 << 20
+# Highest identity number the uint64 roster masks have a bit for
+MAX_IDENTITY = 63
+
+def roster_mask(identities) -> int:
+    mask = 0
+    for number in identities:
+        number = int(number)
+        if not 0 <= number <= MAX_IDENTITY:
+            raise ValueError(f"Identity number {number} doesn't fit the roster masks, they go from 0 to {MAX_IDENTITY}")
+        mask |= 1 << number
+    return mask
+
+# Counts one match's damage, clash wins and deaths by pick, as an EventBus sink
+class MatchStats:
+    def __init__(self, picks: list):
+        self.slot = {character: i for i, character in enumerate(picks)}
+        self.damage = [0] * PICKS
+        self.clashes_won = [0] * PICKS
+        self.deaths = [0] * PICKS
+        self.skill_clashes = np.zeros((3, 3), dtype=np.int16)
+        self.skill_clash_wins = np.zeros((3, 3), dtype=np.int16)
+
+    def __call__(self, event):
+        match event:
+            case DamageDealt(att, _, damage):
+                self.damage[self.slot[att]] += damage
+            case ClashWon(winner, _, _, winner_skill, loser_skill):
+                self.clashes_won[self.slot[winner]] += 1
+                if winner_skill == loser_skill:
+                    return
+                self.skill_clashes[winner_skill - 1, loser_skill - 1] += 1
+                self.skill_clashes[loser_skill - 1, winner_skill - 1] += 1
+                self.skill_clash_wins[winner_skill - 1, loser_skill - 1] += 1
+            case Death(character) if character in self.slot:
+                self.deaths[self.slot[character]] += 1
+
+# One seeded match with stats, as a row of COLUMNS
+def record_match(team1: tuple[int, ...], team2: tuple[int, ...], seed: int, policy1: str = "random", policy2: str = "random", max_acts: int = 100) -> dict:
+    bus = EventBus()
+    manager = new_match(list(team1), list(team2), MatchRandom(seed), events=bus)
+    stats = MatchStats([*manager.player.characters[1:], *manager.enemy.characters[1:]])
+    bus.subscribe(stats)
+    team1_characters = manager.player.characters
+    policy_rng = random.Random(f"policy:{seed}")
+    winner = 0
+    try:
+        while manager.act < max_acts:
+            play_act(manager, POLICIES[policy1], POLICIES[policy2], policy_rng)
+    except GameOver as over:
+        winner = 2 if over.loser in team1_characters else 1
+    return {
+        "seed": seed,
+        "team1": team1,
+        "team2": team2,
+        "mask1": roster_mask(team1),
+        "mask2": roster_mask(team2),
+        "winner": winner,
+        "acts": manager.act,
+        "damage": stats.damage,
+        "clashes_won": stats.clashes_won,
+        "deaths": stats.deaths,
+        "skill_clashes": stats.skill_clashes,
+        "skill_clash_wins": stats.skill_clash_wins,
+    }
+
+# Append-only columnar store: a directory of chunks, one .npy file per column per chunk, and meta.json listing
+# the finished chunks. Rows are buffered until a chunk is full; meta.json is replaced only after the chunk's
+# files are written, so a reader never sees half a chunk
+class ResultWriter:
+    def __init__(self, path: str, chunk_rows: int = CHUNK_ROWS):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        os.makedirs(path, exist_ok=True)
+        self.chunks = read_meta(path)
+        self.buffer = {name: np.zeros((chunk_rows, *shape), dtype=dtype) for name, (dtype, shape) in COLUMNS.items()}
+        self.rows = 0
+
+    def append(self, row: dict):
+        for name, column in self.buffer.items():
+            column[self.rows] = row[name]
+        self.rows += 1
+        if self.rows == self.chunk_rows:
+            self.flush()
+
+    # Whole columns at once, every array with the same number of rows
+    def append_columns(self, columns: dict[str, np.ndarray]):
+        total = len(columns["seed"])
+        done = 0
+        while done < total:
+            take = min(total - done, self.chunk_rows - self.rows)
+            for name, column in self.buffer.items():
+                column[self.rows:self.rows + take] = columns[name][done:done + take]
+            self.rows += take
+            done += take
+            if self.rows == self.chunk_rows:
+                self.flush()
+
+    def flush(self):
+        if self.rows == 0:
+            return
+        chunk = f"chunk-{len(self.chunks):05d}"
+        os.makedirs(os.path.join(self.path, chunk), exist_ok=True)
+        for name, column in self.buffer.items():
+            np.save(os.path.join(self.path, chunk, f"{name}.npy"), column[:self.rows])
+        self.chunks.append({"name": chunk, "rows": self.rows})
+        temporary = os.path.join(self.path, "meta.json.tmp")
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump({"columns": list(COLUMNS), "chunks": self.chunks}, file)
+        os.replace(temporary, os.path.join(self.path, "meta.json"))
+        self.rows = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self) -> ResultWriter:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_meta(path: str) -> list[dict]:
+    meta = os.path.join(path, "meta.json")
+    if not os.path.exists(meta):
+        return []
+    with open(meta, encoding="utf-8") as file:
+        return json.load(file)["chunks"]
+
+# Read side of a store: every column memory-mapped chunk by chunk, queries sum over the chunks
+class ResultStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.chunks = [
+            {name: np.load(os.path.join(path, chunk["name"], f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+            for chunk in read_meta(path)
+        ]
+
+    def __len__(self) -> int:
+        return sum(len(chunk["seed"]) for chunk in self.chunks)
+
+    # Win rate of the team that has both x and y (x alone if y is None), draws count as half a win
+    def win_rate(self, x: int, y: int | None = None) -> float:
+        want = np.uint64(roster_mask([x] if y is None else [x, y]))
+        wins = games = 0.0
+        for chunk in self.chunks:
+            for side, mask in ((1, chunk["mask1"]), (2, chunk["mask2"])):
+                rows = (mask & want) == want
+                winner = chunk["winner"][rows]
+                games += len(winner)
+                wins += np.count_nonzero(winner == side) + np.count_nonzero(winner == 0) / 2
+        return wins / games if games else float("nan")
+
+    # Mean acts the roster took to win, or for every roster that won at least once keyed by its sorted numbers
+    def mean_acts_to_win(self, roster: tuple[int, ...] | None = None) -> float | dict[tuple[int, ...], float]:
+        if roster is not None:
+            want = np.uint64(roster_mask(roster))
+            total = count = 0
+            for chunk in self.chunks:
+                rows = ((chunk["mask1"] == want) & (chunk["winner"] == 1)) | ((chunk["mask2"] == want) & (chunk["winner"] == 2))
+                total += int(chunk["acts"][rows].sum(dtype=np.int64))
+                count += int(np.count_nonzero(rows))
+            return total / count if count else float("nan")
+        totals: dict[int, list[int]] = {}
+        for chunk in self.chunks:
+            winner = chunk["winner"]
+            won = winner > 0
+            masks = np.where(winner[won] == 1, chunk["mask1"][won], chunk["mask2"][won])
+            if len(masks) and int(masks.max()) < 1 << 20:
+                # Small identity numbers, the masks can index the counts directly instead of being sorted
+                acts = np.bincount(masks.astype(np.int64), weights=chunk["acts"][won])
+                counts = np.bincount(masks.astype(np.int64))
+                unique = np.flatnonzero(counts)
+                acts, counts = acts[unique], counts[unique]
+            else:
+                unique, inverse = np.unique(masks, return_inverse=True)
+                acts = np.bincount(inverse, weights=chunk["acts"][won])
+                counts = np.bincount(inverse)
+            for mask, act_sum, count in zip(unique.tolist(), acts.tolist(), counts.tolist()):
+                entry = totals.setdefault(mask, [0, 0])
+                entry[0] += act_sum
+                entry[1] += count
+        return {
+            tuple(number for number in range(64) if mask >> number & 1): act_sum / count
+            for mask, (act_sum, count) in totals.items()
+        }
+
+    # Share of clashes between skill number skill and skill number other that skill won
+    def clash_win_rate(self, skill: int, other: int) -> float:
+        if skill == other:
+            raise ValueError("Clashes of a skill number against itself aren't kept")
+        wins = clashes = 0
+        for chunk in self.chunks:
+            wins += int(chunk["skill_clash_wins"][:, skill - 1, other - 1].sum(dtype=np.int64))
+            clashes += int(chunk["skill_clashes"][:, skill - 1, other - 1].sum(dtype=np.int64))
+        return wins / clashes if clashes else float("nan")
+
+def play_sweep_chunk(task: tuple[int, int, int, str, str]) -> list[dict]:
+    start, count, base_seed, policy1, policy2 = task
+    rng = random.Random(f"{base_seed}:{start}")
+    numbers = identities()
+    rows = []
+    for game in range(start, start + count):
+        picks = rng.sample(numbers, 6)
+        team1, team2 = tuple(picks[:3]), tuple(picks[3:])
+        rows.append(record_match(team1, team2, match_seed(base_seed, team1, team2, game), policy1, policy2))
+    return rows
+
+# Random drafts, played in a pool and written in the order they were dealt
+def sweep(path: str, matches: int, base_seed: int = 0, policy1: str = "random", policy2: str = "random", workers: int | None = None):
+    # Every identity needs a bit in the roster masks, checked before any match is played
+    roster_mask(identities())
+    tasks = [(start, min(1000, matches - start), base_seed, policy1, policy2) for start in range(0, matches, 1000)]
+    with ResultWriter(path) as writer, Pool(workers) as pool:
+        for rows in pool.imap(play_sweep_chunk, tasks):
+            for row in rows:
+                writer.append(row)
+
+# Random rows in every column, for timing the queries on a store the size of a long sweep
+def synthetic_columns(rows: int, seed: int = 0) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    roster_mask(identities())
+    numbers = np.array(identities(), dtype=np.int8)
+    picks = np.argsort(rng.random((rows, len(numbers))), axis=1)[:, :6]
+    picks = numbers[picks]
+    columns = {
+        "seed": rng.integers(0, 2 ** 63, rows, dtype=np.uint64),
+        "team1": picks[:, :3],
+        "team2": picks[:, 3:],
+        "winner": rng.integers(0, 3, rows, dtype=np.int8),
+        "acts": rng.integers(1, 30, rows, dtype=np.int16),
+        "damage": rng.integers(0, 400, (rows, PICKS), dtype=np.int32),
+        "clashes_won": rng.integers(0, 6, (rows, PICKS), dtype=np.int16),
+        "deaths": rng.integers(0, 3, (rows, PICKS), dtype=np.int16),
+        "skill_clashes": rng.integers(0, 4, (rows, 3, 3), dtype=np.int16),
+    }
+    columns["skill_clashes"][:, np.arange(3), np.arange(3)] = 0
+    columns["skill_clash_wins"] = (columns["skill_clashes"] * rng.random((rows, 3, 3)) // 1).astype(np.int16)
+    bits = np.left_shift(np.uint64(1), picks.astype(np.uint64))
+    columns["mask1"] = np.bitwise_or.reduce(bits[:, :3], axis=1)
+    columns["mask2"] = np.bitwise_or.reduce(bits[:, 3:], axis=1)
+    return columns
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar store of simulated match results")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sweep_parser = commands.add_parser("sweep", help="simulate random drafts into a store")
+    sweep_parser.add_argument("store")
+    sweep_parser.add_argument("--matches", type=int, default=100_000)
+    sweep_parser.add_argument("--seed", type=int, default=0)
+    sweep_parser.add_argument("--policy1", choices=POLICIES, default="random")
+    sweep_parser.add_argument("--policy2", choices=POLICIES, default="random")
+    sweep_parser.add_argument("--workers", type=int, default=None)
+    query_parser = commands.add_parser("query", help="answer one question from a store")
+    query_parser.add_argument("store")
+    query_parser.add_argument("--with", dest="together", type=int, nargs="+", metavar="ID", help="win rate of a team with one or two identities")
+    query_parser.add_argument("--acts", type=int, nargs=3, metavar="ID", help="mean acts to win of a roster")
+    query_parser.add_argument("--clash", type=int, nargs=2, metavar="SKILL", help="clash win rate of one skill number against another")
+    bench_parser = commands.add_parser("bench", help="time the queries over synthetic rows, in a temporary store")
+    bench_parser.add_argument("--rows", type=int, default=10_000_000)
+    args = parser.parse_args()
+    if args.command == "query" and args.clash and args.clash[0] == args.clash[1]:
+        parser.error("--clash takes two different skill numbers")
+    if args.command == "query" and args.together and len(args.together) > 2:
+        parser.error("--with takes one or two identity numbers")
+    if args.command == "query" and any(not 0 <= number <= MAX_IDENTITY for number in (args.together or []) + (args.acts or [])):
+        parser.error(f"identity numbers go from 0 to {MAX_IDENTITY}")
+
+    if args.command == "sweep":
+        sweep(args.store, args.matches, args.seed, args.policy1, args.policy2, args.workers)
+        print(f"{len(ResultStore(args.store)):,} rows in {args.store}")
+    elif args.command == "query":
+        store = ResultStore(args.store)
+        names = identity_catalog()
+        if args.together:
+            together = " and ".join(names[number].name for number in args.together)
+            print(f"Win rate with {together}: {store.win_rate(*args.together):.1%}")
+        if args.acts:
+            print(f"Mean acts to win: {store.mean_acts_to_win(tuple(args.acts)):.2f}")
+        if args.clash:
+            print(f"S{args.clash[0]} against S{args.clash[1]}: {store.clash_win_rate(*args.clash):.1%} of clashes won")
+    else:
+        with tempfile.TemporaryDirectory() as path:
+            with ResultWriter(path) as writer:
+                for start in range(0, args.rows, CHUNK_ROWS):
+                    writer.append_columns(synthetic_columns(min(CHUNK_ROWS, args.rows - start), start))
+            store = ResultStore(path)
+            a, b, c = identities()[:3]
+            for label, query in (
+                    (f"win_rate({a}, {b})", lambda: store.win_rate(a, b)),
+                    (f"mean_acts_to_win(({a}, {b}, {c}))", lambda: store.mean_acts_to_win((a, b, c))),
+                    ("mean_acts_to_win() all rosters", lambda: store.mean_acts_to_win()),
+                    ("clash_win_rate(3, 1)", lambda: store.clash_win_rate(3, 1)),
+                ):
+                start = time.perf_counter()
+                query()
+                print(f"{label:<36}{(time.perf_counter() - start) * 1000:>10.1f} ms over {len(store):,} rows")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+from collections import deque
+
+from main import BusCharacter, Character, EventBus, GameManager, GameOver, Team, identity_catalog
+from draft import PICK_ORDER, DraftSolver, roster_matchups
+from effects import EffectCatalog, load_effects
+from metrics import METRICS, write_periodically
+from match_random import MatchRandom
+from matchmaking import Matchmaker, RatingStore
+from replay import ReplayRecorder
+from tournament import load_results
+from simulate import Decision, new_match, resolve_decision, targeting_hints
+from spectate import SpectatorFeed
+
+ACT_SECONDS = 60
+PICK_SECONDS = 60
+
+# Raised inside a match when one of its players goes away
+class Disconnected(Exception):
+    def __init__(self, player: PlayerConnection):
+        super().__init__(f"{player.name} disconnected")
+        self.player = player
+
+def character_state(character: Character) -> dict:
+    state = {
+        "name": character.name,
+        "hp": character.curhp,
+        "maxhp": character.maxhp,
+    }
+    if not isinstance(character, BusCharacter):
+        state.update({
+            "stagger": character.curstag,
+            "maxstag": character.maxstag,
+            "speed": character.speed,
+            "sanity": character.sanity,
+            "skills": [character.skillcycle[0], character.skillcycle[1]],
+            "deathtimer": character.deathtimer,
+            "staggertimer": character.staggertimer,
+        })
+    return state
+
+def team_state(team: Team) -> dict:
+    return {"name": team.name, "characters": [character_state(character) for character in team.characters]}
+
+# The whole board as both players see it, from the point of view of team
+def board_state(manager: GameManager, team: Team) -> dict:
+    enemy = manager.enemy if team is manager.player else manager.player
+    return {"act": manager.act, "you": team_state(team), "enemy": team_state(enemy)}
+
+# One-sided odds of every option team has this act, damage as its distribution's mean
+def hints_state(team: Team, enemy: Team) -> list[dict]:
+    return [
+        {
+            "character": hint.character, "slot": hint.slot, "target": hint.target,
+            "damage": round(hint.odds.expected_damage, 2), "stagger": round(hint.odds.stagger, 4), "kill": round(hint.odds.kill, 4),
+        }
+        for hint in targeting_hints(team, enemy)
+    ]
+
+# JSON numbers a client sends for slots and identities: ints only, not floats (1.0, 1e400) or booleans
+def is_whole_number(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def whole_number(message: dict, key: str) -> int:
+    value = message[key]
+    if not is_whole_number(value):
+        raise ValueError(f"{key} must be a whole number")
+    return value
+
+# One client, its lines are pumped into inbox by MatchServer.handle_client, None marks the end of the stream
+class PlayerConnection:
+    def __init__(self, name: str, writer: asyncio.StreamWriter):
+        self.name = name
+        self.writer = writer
+        self.inbox: asyncio.Queue[dict | None] = asyncio.Queue()
+
+    async def send(self, message: dict):
+        if self.writer.is_closing():
+            return
+        self.writer.write(json.dumps(message).encode() + b"\n")
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+
+    # Next message before the loop time deadline, None on timeout
+    async def receive(self, deadline: float) -> dict | None:
+        timeout = deadline - asyncio.get_running_loop().time()
+        if timeout <= 0:
+            return None
+        try:
+            message = await asyncio.wait_for(self.inbox.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if message is None:
+            raise Disconnected(self)
+        return message
+
+class MatchSession:
+    def __init__(
+            self,
+            player1: PlayerConnection,
+            player2: PlayerConnection,
+            act_seconds: float = ACT_SECONDS,
+            pick_seconds: float = PICK_SECONDS,
+            replay_dir: str | None = None,
+            draft_solver: DraftSolver | None = None,
+            effects: EffectCatalog | None = None
+        ):
+        self.players = (player1, player2)
+        self.act_seconds = act_seconds
+        self.pick_seconds = pick_seconds
+        self.replay_dir = replay_dir
+        # Gives every pick a hint and makes the picks of a player out of time
+        self.draft_solver = draft_solver
+        # Equipped on both teams at the start of the match
+        self.effects = effects
+        self.seed = random.getrandbits(64)
+        # Listed to anyone, so nothing to do with the seed
+        self.match_id = secrets.token_hex(8)
+        self.feed = SpectatorFeed(self.match_id)
+        # Picks made for a player out of time come from their own stream, so the game stream only depends on the seed
+        self.draft_rng = random.Random()
+        self.manager: GameManager | None = None
+        self.recorder: ReplayRecorder | None = None
+        self.winner: PlayerConnection | None = None
+
+    async def broadcast(self, message: dict):
+        await asyncio.gather(*(player.send(message) for player in self.players))
+
+    async def draft(self) -> list[int]:
+        loop = asyncio.get_running_loop()
+        chosen_numbers: list[int] = []
+        picks: tuple[list[int], list[int]] = ([], [])
+        for side in PICK_ORDER:
+            player = self.players[side]
+            available = [num for num in identity_catalog().numbers() if num not in chosen_numbers]
+            deadline = loop.time() + self.pick_seconds
+            request = {"type": "pick", "available": available, "seconds": self.pick_seconds}
+            best = None
+            if self.draft_solver is not None:
+                best, value = self.draft_solver.recommend(*picks)
+                request["hint"] = {"identity": best, "win_rate": round(value if side == 0 else 1 - value, 4)}
+            await player.send(request)
+            choice = None
+            while choice is None:
+                message = await player.receive(deadline)
+                if message is None:
+                    # Out of time, the pick is the solver's, or made at random without one
+                    choice = best if best is not None else self.draft_rng.choice(available)
+                elif message.get("type") == "pick" and is_whole_number(message.get("identity")) and message["identity"] in available:
+                    choice = message["identity"]
+                else:
+                    await player.send({"type": "error", "message": "Pick one of the available identities"})
+            chosen_numbers.append(choice)
+            picks[side].append(choice)
+            self.feed.pick(side, choice)
+            self.feed.publish()
+            await self.broadcast({"type": "picked", "player": player.name, "identity": choice})
+        return chosen_numbers
+
+    # Gather one player's actions until they end their turn or the act timer runs out
+    async def collect(self, player: PlayerConnection, team: Team, enemy: Team, deadline: float) -> list[Decision]:
+        decisions = []
+        while True:
+            message = await player.receive(deadline)
+            if message is None or message.get("type") == "end":
+                return decisions
+            if message.get("type") != "action":
+                await player.send({"type": "error", "message": "Expected an action or end"})
+                continue
+            try:
+                clash = message.get("clash", True)
+                if not isinstance(clash, bool):
+                    raise ValueError("clash must be true or false")
+                decision = Decision(whole_number(message, "character"), whole_number(message, "slot"), whole_number(message, "target"), clash)
+                resolve_decision(team, enemy, decision)
+            except (KeyError, TypeError, ValueError) as error:
+                await player.send({"type": "error", "message": str(error)})
+                continue
+            decisions.append(decision)
+            await player.send({**message, "type": "accepted"})
+
+    async def play_act(self, manager: GameManager, teams: tuple[Team, Team]):
+        loop = asyncio.get_running_loop()
+        manager.next_turn()
+        self.feed.publish()
+        deadline = loop.time() + self.act_seconds
+        await asyncio.gather(*(
+            player.send({
+                "type": "act", "seconds": self.act_seconds, "board": board_state(manager, team), "hints": hints_state(team, enemy),
+            })
+            for player, team, enemy in zip(self.players, teams, teams[::-1])
+        ))
+        # Both players declare at the same time, the actions are added in the same order as the hot-seat game.
+        # If one of them goes away the other one stops being waited on too
+        collecting = [
+            asyncio.create_task(self.collect(self.players[0], teams[0], teams[1], deadline)),
+            asyncio.create_task(self.collect(self.players[1], teams[1], teams[0], deadline)),
+        ]
+        try:
+            decisions = await asyncio.gather(*collecting)
+        except BaseException:
+            for task in collecting:
+                task.cancel()
+            raise
+        for (team, enemy), side_decisions in zip(((teams[0], teams[1]), (teams[1], teams[0])), decisions):
+            for decision in side_decisions:
+                action = resolve_decision(team, enemy, decision)
+                manager.make_action(*action)
+                self.feed.declare(*action)
+        self.feed.publish()
+        # Runs on the event loop rather than in an executor: the event bus, spectator feed and metrics it feeds
+        # all belong to the loop, and an act resolves in about a millisecond (tests/test_server.py bounds it),
+        # well under what a thread hand-off would save
+        manager.resolve_action()
+        self.feed.publish()
+
+    async def run(self):
+        player1, player2 = self.players
+        winner: PlayerConnection | None = None
+        try:
+            # The seed decides every coin toss and speed roll, players only see it once the match is over
+            await self.broadcast({"type": "start", "players": [player1.name, player2.name]})
+            chosen_numbers = await self.draft()
+            list1 = [chosen_numbers[0], chosen_numbers[3], chosen_numbers[4]]
+            list2 = [chosen_numbers[1], chosen_numbers[2], chosen_numbers[5]]
+            # A bus of its own, the spectator feed subscribes to it while anyone watches
+            self.manager = new_match(list1, list2, MatchRandom(self.seed), events=EventBus(), effects=self.effects)
+            manager = self.manager
+            self.recorder = ReplayRecorder(manager, self.seed, tuple(list1), tuple(list2), self.effects)
+            manager.player.name, manager.enemy.name = player1.name, player2.name
+            teams = (manager.player, manager.enemy)
+            self.feed.start(manager, teams)
+            try:
+                while True:
+                    await self.play_act(manager, teams)
+                    await asyncio.gather(*(
+                        player.send({"type": "resolved", "board": board_state(manager, team)})
+                        for player, team in zip(self.players, teams)
+                    ))
+            except GameOver as over:
+                winner = player2 if over.loser in teams[0].characters else player1
+        except Disconnected as gone:
+            winner = player2 if gone.player is player1 else player1
+        self.winner = winner
+        self.feed.finish(winner.name)
+        await self.broadcast({"type": "game_over", "winner": winner.name, "seed": self.seed})
+        for player in self.players:
+            player.writer.close()
+        if self.replay_dir is not None and self.recorder is not None:
+            with open(os.path.join(self.replay_dir, f"{self.seed:016x}.lcr"), "wb") as file:
+                file.write(self.recorder.log.encode())
+
+# Pairs players in the order they arrive, or by rating when given a RatingStore (ranked)
+class MatchServer:
+    def __init__(
+            self,
+            act_seconds: float = ACT_SECONDS,
+            pick_seconds: float = PICK_SECONDS,
+            replay_dir: str | None = None,
+            ratings: RatingStore | None = None,
+            draft_solver: DraftSolver | None = None,
+            effects: EffectCatalog | None = None
+        ):
+        self.act_seconds = act_seconds
+        self.pick_seconds = pick_seconds
+        self.replay_dir = replay_dir
+        self.draft_solver = draft_solver
+        self.effects = effects
+        self.waiting: deque[PlayerConnection] = deque()
+        self.sessions: set[asyncio.Task] = set()
+        # Matches being played by match id, for spectators to find
+        self.matches: dict[str, MatchSession] = {}
+        self.ratings = ratings
+        self.matchmaker = Matchmaker(ratings, self.start_session) if ratings is not None else None
+
+    def start_session(self, player1: PlayerConnection, player2: PlayerConnection):
+        session = MatchSession(player1, player2, self.act_seconds, self.pick_seconds, self.replay_dir, self.draft_solver, self.effects)
+        task = asyncio.create_task(session.run())
+        self.sessions.add(task)
+        self.matches[session.match_id] = session
+        task.add_done_callback(self.sessions.discard)
+        task.add_done_callback(lambda _: self.session_done(session))
+
+    def session_done(self, session: MatchSession):
+        self.matches.pop(session.match_id, None)
+        if self.ratings is not None and session.winner is not None:
+            loser = session.players[1] if session.winner is session.players[0] else session.players[0]
+            self.ratings.record(session.winner.name, loser.name)
+
+    # Widens the windows of the ranked queue as players wait
+    async def run_matchmaker(self, interval: float = 1.0):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            self.matchmaker.tick(loop.time())
+
+    # Everything the spectator sends is read a line at a time and ignored, the feed writes to it until the match
+    # is over. A line longer than the reader's limit ends the connection
+    async def watch(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, feed: SpectatorFeed):
+        feed.add(writer)
+        try:
+            while await reader.readline():
+                pass
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            feed.remove(writer)
+
+    # Players join with {"type": "join", "name": ...} and are paired in the order they arrive.
+    # {"type": "matches"} lists the matches being played, {"type": "spectate", "match": id} watches one
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        player = None
+        try:
+            async for line in reader:
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not isinstance(message, dict):
+                    continue
+                if player is None:
+                    if message.get("type") == "matches":
+                        matches = [{"match": match_id, "players": [p.name for p in session.players]} for match_id, session in self.matches.items()]
+                        writer.write(json.dumps({"type": "matches", "matches": matches}).encode() + b"\n")
+                        continue
+                    if message.get("type") == "spectate":
+                        session = self.matches.get(message.get("match"))
+                        if session is None:
+                            writer.write(json.dumps({"type": "error", "message": "No such match"}).encode() + b"\n")
+                            continue
+                        await self.watch(reader, writer, session.feed)
+                        return
+                    if message.get("type") != "join":
+                        continue
+                    player = PlayerConnection(str(message.get("name", "Player")), writer)
+                    if self.matchmaker is not None:
+                        await player.send({"type": "waiting", "rating": round(self.ratings.rating(player.name))})
+                        self.matchmaker.join(player, player.name, asyncio.get_running_loop().time())
+                        continue
+                    await player.send({"type": "waiting"})
+                    self.waiting.append(player)
+                    if len(self.waiting) >= 2:
+                        self.start_session(self.waiting.popleft(), self.waiting.popleft())
+                else:
+                    player.inbox.put_nowait(message)
+        except ConnectionError:
+            pass
+        except ValueError:
+            # A line longer than the reader's limit, the client is dropped like one that went away
+            writer.close()
+        finally:
+            if player is not None:
+                if player in self.waiting:
+                    self.waiting.remove(player)
+                if self.matchmaker is not None:
+                    self.matchmaker.leave(player)
+                player.inbox.put_nowait(None)
+
+    async def serve_tcp(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.Server:
+        return await asyncio.start_server(self.handle_client, host, port)
+
+    async def serve_unix(self, path: str) -> asyncio.Server:
+        return await asyncio.start_unix_server(self.handle_client, path)
+
+async def serve(
+        host: str,
+        port: int,
+        unix: str | None,
+        replay_dir: str | None,
+        metrics_path: str | None = None,
+        ratings_path: str | None = None,
+        draft_table: str | None = None,
+        effects_path: str | None = None
+    ):
+    if metrics_path is not None:
+        METRICS.enable()
+        write_periodically(metrics_path)
+    ratings = RatingStore(ratings_path) if ratings_path is not None else None
+    draft_solver = None
+    if draft_table is not None:
+        draft_solver = DraftSolver(roster_matchups(load_results(draft_table)))
+        draft_solver.solve()
+    effects = load_effects(effects_path) if effects_path is not None else None
+    match_server = MatchServer(replay_dir=replay_dir, ratings=ratings, draft_solver=draft_solver, effects=effects)
+    server = await (match_server.serve_unix(unix) if unix else match_server.serve_tcp(host, port))
+    matchmaker = None
+    if match_server.matchmaker is not None:
+        matchmaker = asyncio.create_task(match_server.run_matchmaker())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if matchmaker is not None:
+            matchmaker.cancel()
+
+def main():
+    parser = argparse.ArgumentParser(description="Limbus Company pvp match server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--replays", help="directory to save a replay log of every finished match to")
+    parser.add_argument("--metrics", help="keep combat metrics in this file, Prometheus text for .prom, JSON otherwise")
+    parser.add_argument("--ranked", metavar="DB", help="pair players by Elo rating, kept in this SQLite file")
+    parser.add_argument("--draft-table", help="tournament results file to give pick hints from")
+    parser.add_argument("--effects", help="effect catalog (JSON) to equip both teams of every match from")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.unix, args.replays, args.metrics, args.ranked, args.draft_table, args.effects))
+
+if __name__ == "__main__":
+    main()
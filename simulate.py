@@ -0,0 +1,207 @@
+from __future__ import annotations
+import random
+from dataclasses import dataclass
+from typing import Callable
+
+from damage_odds import OneSideOdds, one_side_odds
+from effects import EffectCatalog
+from main import (
+    ActionList,
+    ActionType,
+    BusCharacter,
+    Character,
+    GameManager,
+    EventBus,
+    GameOver,
+    Team,
+    numbers_to_characters,
+)
+from match_random import MatchRandom
+
+
+# No sinks, combat builds no events at all
+HEADLESS = EventBus()
+
+# One action order of a policy, indexed the same way as the interactive prompts:
+# character and target are team slots, slot is the skill cycle slot (1 or 2)
+@dataclass
+class Decision:
+    character: int
+    slot: int
+    target: int
+    clash: bool = True
+
+Policy = Callable[[GameManager, random.Random], list[Decision]]
+# Builds the characters of the given identity numbers, numbers_to_characters unless a balance pass swaps in its own
+Roster = Callable[[list[int], MatchRandom], list[Character]]
+
+@dataclass
+class MatchResult:
+    seed: int
+    team1: tuple[int, ...]
+    team2: tuple[int, ...]
+    winner: int | None
+    acts: int
+    hp1: tuple[int, ...]
+    hp2: tuple[int, ...]
+    replay: bytes | None = None
+
+# Characters of the side to move that are allowed to make an action this act
+# (alive, not staggered and not Mephistopheles, who is slot 0)
+def ready_characters(team: Team) -> list[int]:
+    return [
+        i for i, character in enumerate(team.characters)
+        if character.curhp > 0 and character.curstag > 0 and not isinstance(character, BusCharacter)
+    ]
+
+def alive_targets(team: Team) -> list[int]:
+    return [i for i, character in enumerate(team.characters) if character.curhp > 0]
+
+# Targeting hint for one option of the act: character and target are team slots, slot is the skill cycle slot
+@dataclass(frozen=True)
+class TargetHint:
+    character: int
+    slot: int
+    target: int
+    odds: OneSideOdds
+
+# Odds of every one-sided option open to team this act: each character that can act, with either skill of
+# its cycle, against each living enemy
+def targeting_hints(team: Team, enemy: Team) -> list[TargetHint]:
+    targets = alive_targets(enemy)
+    hints = []
+    for i in ready_characters(team):
+        character = team.characters[i]
+        for slot in (1, 2):
+            skill = character.skills[character.skillcycle[slot - 1] - 1]
+            for j in targets:
+                hints.append(TargetHint(i, slot, j, one_side_odds(skill, character.sanity, enemy.characters[j])))
+    return hints
+
+# Draws exactly what randint(1, 2), choice(targets) and random() would, through randrange directly
+def random_policy(manager: GameManager, rng: random.Random) -> list[Decision]:
+    targets = alive_targets(manager.enemy)
+    count = len(targets)
+    below = rng.randrange
+    chance = rng.random
+    return [Decision(i, 1 + below(2), targets[below(count)], chance() < 0.5) for i in ready_characters(manager.player)]
+
+# Always uses the skill with the highest maximum roll and hits the enemy with the least health left
+def greedy_policy(manager: GameManager, rng: random.Random) -> list[Decision]:
+    enemy_chars = manager.enemy.characters
+    target = min(alive_targets(manager.enemy), key=lambda i: enemy_chars[i].curhp)
+    decisions = []
+    for i in ready_characters(manager.player):
+        character = manager.player.characters[i]
+        skills = [character.skills[character.skillcycle[slot - 1] - 1] for slot in (1, 2)]
+        rolls = [skill.baseval + skill.coinval * skill.coinnum for skill in skills]
+        decisions.append(Decision(i, 1 if rolls[0] >= rolls[1] else 2, target))
+    return decisions
+
+# Check a decision against the same rules as the prompts and turn it into make_action arguments
+def resolve_decision(team: Team, enemy: Team, decision: Decision) -> tuple[Character, int, Character, ActionType]:
+    if not 0 <= decision.character < len(team.characters):
+        raise ValueError(f"Invalid character {decision.character}")
+    attacking_character = team.characters[decision.character]
+    if isinstance(attacking_character, BusCharacter):
+        raise ValueError("Mephistopheles can't make an action")
+    if attacking_character.curhp <= 0 or attacking_character.curstag < 1:
+        raise ValueError(f"{attacking_character.name} can't make an action")
+    if decision.slot not in (1, 2):
+        raise ValueError(f"Invalid skill slot {decision.slot}")
+    if not 0 <= decision.target < len(enemy.characters):
+        raise ValueError(f"Invalid target {decision.target}")
+    target_character = enemy.characters[decision.target]
+    if target_character.curhp <= 0:
+        raise ValueError(f"{target_character.name} is dead")
+    skill_choice = attacking_character.skillcycle[decision.slot - 1]
+    clash_opt = ActionType.ONESIDE
+    if decision.clash and attacking_character.can_choose_clash(target_character):
+        clash_opt = ActionType.CLASH
+    return attacking_character, skill_choice, target_character, clash_opt
+
+# Turn the decisions of the side to move into actions
+def apply_decisions(manager: GameManager, decisions: list[Decision]):
+    team, enemy, make_action = manager.player, manager.enemy, manager.make_action
+    for decision in decisions:
+        make_action(*resolve_decision(team, enemy, decision))
+
+def play_act(manager: GameManager, policy1: Policy, policy2: Policy, policy_rng: random.Random):
+    manager.next_turn()
+    apply_decisions(manager, policy1(manager, policy_rng))
+    manager.change_side()
+    apply_decisions(manager, policy2(manager, policy_rng))
+    manager.change_side()
+    manager.resolve_action()
+
+# Mephistopheles and then the given identities on each side. Teams can be of any size, each is as long as its ids
+def new_match(
+        team1_ids: list[int],
+        team2_ids: list[int],
+        rng: MatchRandom,
+        roster: Roster = numbers_to_characters,
+        events: EventBus = HEADLESS,
+        effects: EffectCatalog | None = None,
+        team1_name: str = "Player 1",
+        team2_name: str = "Player 2"
+    ) -> GameManager:
+    team1 = Team(team1_name, roster([0, *team1_ids], rng))
+    team2 = Team(team2_name, roster([0, *team2_ids], rng))
+    if effects is not None:
+        effects.equip(team1, [0, *team1_ids])
+        effects.equip(team2, [0, *team2_ids])
+    return GameManager(ActionList(), team1, team2, events)
+
+# Play a whole match without any input, output or pacing.
+# The game and the policies draw from separate streams so a recorded match can be replayed without the policies
+def simulate_match(
+        team1_ids: list[int],
+        team2_ids: list[int],
+        policy1: Policy = random_policy,
+        policy2: Policy = random_policy,
+        seed: int | None = None,
+        max_acts: int = 100,
+        record: bool = False,
+        roster: Roster = numbers_to_characters,
+        effects: EffectCatalog | None = None
+    ) -> MatchResult:
+    if seed is None:
+        seed = random.getrandbits(64)
+    rng = MatchRandom(seed)
+    policy_rng = random.Random(f"policy:{seed}")
+    manager = new_match(team1_ids, team2_ids, rng, roster, effects=effects)
+    team1, team2 = manager.player, manager.enemy
+    recorder = None
+    if record:
+        from replay import ReplayRecorder
+        recorder = ReplayRecorder(manager, seed, tuple(team1_ids), tuple(team2_ids), effects)
+    winner = None
+    try:
+        while manager.act < max_acts:
+            play_act(manager, policy1, policy2, policy_rng)
+    except GameOver as over:
+        winner = 2 if over.loser in team1.characters else 1
+    return MatchResult(
+        seed,
+        tuple(team1_ids),
+        tuple(team2_ids),
+        winner,
+        manager.act,
+        tuple(character.curhp for character in team1.characters),
+        tuple(character.curhp for character in team2.characters),
+        recorder.log.encode() if recorder is not None else None,
+    )
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    wins = [0, 0, 0]
+    start = time.perf_counter()
+    for seed in range(count):
+        result = simulate_match([1, 2, 3], [4, 5, 6], seed=seed)
+        wins[result.winner or 0] += 1
+    elapsed = time.perf_counter() - start
+    print(f"{count} matches in {elapsed:.2f}s ({count / elapsed:.0f} matches/s)")
+    print(f"Player 1: {wins[1]}, Player 2: {wins[2]}, Unfinished: {wins[0]}")
@@ -0,0 +1,297 @@
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import random
+import resource
+import socket
+import time
+from itertools import chain
+
+from main import ActionType, Character, Event, EventBus, GameManager, GameOver, Team, identity_catalog
+from match_random import MatchRandom
+from simulate import new_match, play_act, random_policy
+
+# Character fields spectators are sent, in Character.save() order
+FIELDS = ("hp", "stagger", "sanity", "speed", "deathtimer", "staggertimer")
+# A spectator with more than HIGH_WATER bytes waiting in its socket buffer is skipped, and once it is back
+# under LOW_WATER it gets one full snapshot in place of every delta it missed
+HIGH_WATER = 64 * 1024
+LOW_WATER = 16 * 1024
+
+def encode(message: dict) -> bytes:
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+# Versioned board of one match for any number of spectators. Changes pile up as they happen and publish()
+# sends them as one delta: the character fields that changed since the last version plus the events in
+# between (picks, declared actions, clash rounds, damage, staggers, deaths). A delta is encoded once and the
+# same bytes are written to every spectator without waiting on any of them, so a slow reader never holds up
+# the match. Characters are numbered team1 first, Mephistopheles included, as in the snapshot.
+# Also an EventBus sink: subscribed to the match's bus while anyone watches, and only then
+class SpectatorFeed:
+    def __init__(self, match_id: str, high_water: int = HIGH_WATER, low_water: int = LOW_WATER):
+        self.match_id = match_id
+        self.high_water = high_water
+        self.low_water = low_water
+        self.version = 0
+        self.picks: list[int] = []
+        self.manager: GameManager | None = None
+        self.teams: tuple[Team, ...] = ()
+        self.index: dict[Character, int] = {}
+        self.states: list[tuple] = []
+        # Changes since the last publish(), appended to by the event bus while an act resolves on the event loop
+        self.pending: list[dict] = []
+        # Writer of every spectator, True while it is lagging behind
+        self.spectators: dict[asyncio.StreamWriter, bool] = {}
+        self.snapshots_sent = 0
+        self._snapshot: bytes | None = None
+
+    # Teams in the order the characters are numbered
+    def start(self, manager: GameManager, teams: tuple[Team, Team]):
+        self.manager = manager
+        self.teams = teams
+        characters = list(chain.from_iterable(team.characters for team in teams))
+        self.index = {character: i for i, character in enumerate(characters)}
+        self.states = [character.save() for character in characters]
+        if self.spectators:
+            manager.events.subscribe(self)
+        # The board is new to everyone, so everyone catches up as if they had been lagging
+        self.pending = []
+        self.version += 1
+        self._snapshot = None
+        for writer in self.spectators:
+            self.spectators[writer] = True
+        self._fan_out(self.snapshot())
+
+    def add(self, writer: asyncio.StreamWriter):
+        if not self.spectators and self.manager is not None:
+            self.manager.events.subscribe(self)
+        self.spectators[writer] = False
+        writer.write(self.snapshot())
+
+    def remove(self, writer: asyncio.StreamWriter):
+        if self.spectators.pop(writer, None) is not None and not self.spectators and self.manager is not None:
+            self.manager.events.unsubscribe(self)
+
+    def __call__(self, event: Event):
+        record = {"event": type(event).__name__}
+        for name in event.__slots__:
+            value = getattr(event, name)
+            record[name] = self.index[value] if isinstance(value, Character) else value
+        self.pending.append(record)
+
+    def pick(self, side: int, identity: int):
+        self.picks.append(identity)
+        self.pending.append({"event": "Picked", "side": side, "identity": identity})
+
+    def declare(self, attacker: Character, skill_choice: int, target: Character, clash_opt: ActionType):
+        self.pending.append({
+            "event": "Declared",
+            "character": self.index[attacker],
+            "skill": skill_choice,
+            "target": self.index[target],
+            "clash": clash_opt == ActionType.CLASH,
+        })
+
+    @property
+    def act(self) -> int:
+        return self.manager.act if self.manager is not None else 0
+
+    def snapshot(self) -> bytes:
+        if self._snapshot is None:
+            teams = [
+                {
+                    "name": team.name,
+                    "characters": [
+                        {"name": character.name, "maxhp": character.maxhp, "maxstag": character.maxstag, **dict(zip(FIELDS, character.save()))}
+                        for character in team.characters
+                    ],
+                }
+                for team in self.teams
+            ]
+            self._snapshot = encode({
+                "type": "snapshot", "match": self.match_id, "version": self.version,
+                "act": self.act, "picks": self.picks, "teams": teams,
+            })
+        return self._snapshot
+
+    # Send everything since the last version as the next one, returns False if nothing changed
+    def publish(self) -> bool:
+        changes = []
+        for i, character in enumerate(self.index):
+            state = character.save()
+            old = self.states[i]
+            if state != old:
+                change = {"character": i}
+                for field, value, previous in zip(FIELDS, state, old):
+                    if value != previous:
+                        change[field] = value
+                changes.append(change)
+                self.states[i] = state
+        if not changes and not self.pending:
+            return False
+        events, self.pending = self.pending, []
+        self.version += 1
+        self._snapshot = None
+        self._fan_out(encode({"type": "delta", "version": self.version, "act": self.act, "changes": changes, "events": events}))
+        return True
+
+    def _fan_out(self, line: bytes):
+        closed = []
+        for writer, lagging in self.spectators.items():
+            if writer.is_closing():
+                closed.append(writer)
+                continue
+            buffered = writer.transport.get_write_buffer_size()
+            if lagging:
+                if buffered <= self.low_water:
+                    # Caught up on what it had, the snapshot stands for every delta it was skipped
+                    writer.write(self.snapshot())
+                    self.spectators[writer] = False
+                    self.snapshots_sent += 1
+            elif buffered > self.high_water:
+                self.spectators[writer] = True
+            else:
+                writer.write(line)
+        for writer in closed:
+            self.remove(writer)
+
+    # Last delta, then the result to everyone; lagging spectators get the final board first
+    def finish(self, winner: str | None):
+        self.publish()
+        line = encode({"type": "game_over", "version": self.version, "winner": winner})
+        for writer, lagging in list(self.spectators.items()):
+            if not writer.is_closing():
+                if lagging:
+                    writer.write(self.snapshot())
+                    self.snapshots_sent += 1
+                writer.write(line)
+                writer.close()
+            self.remove(writer)
+
+# What a spectator client keeps: the board as of version, rebuilt from a snapshot and the deltas after it
+class SpectatorBoard:
+    def __init__(self):
+        self.version = -1
+        self.characters: list[dict] = []
+        self.gaps = 0
+
+    def apply(self, message: dict):
+        if message["type"] == "snapshot":
+            self.version = message["version"]
+            self.characters = [dict(character) for team in message["teams"] for character in team["characters"]]
+        elif message["type"] == "delta":
+            if message["version"] != self.version + 1:
+                self.gaps += 1
+            self.version = message["version"]
+            for change in message["changes"]:
+                character = self.characters[change["character"]]
+                for field in FIELDS:
+                    if field in change:
+                        character[field] = change[field]
+
+    def states(self) -> list[tuple]:
+        return [tuple(character[field] for field in FIELDS) for character in self.characters]
+
+# Load test over local sockets: one seeded headless match between random policies, published act by act to
+# spectators connected over loopback TCP. slow of them read nothing until the match is over; a small
+# socket_buffer makes their sockets fill up early enough for the feed to skip them and catch them up later
+async def load_test(
+        spectators: int,
+        slow: float,
+        seed: int,
+        act_delay: float,
+        high_water: int = HIGH_WATER,
+        low_water: int = LOW_WATER,
+        socket_buffer: int = 0
+    ) -> dict:
+    feed = SpectatorFeed(f"{seed:016x}", high_water, low_water)
+    done = asyncio.Event()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if socket_buffer:
+            writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, socket_buffer)
+        feed.add(writer)
+        await reader.read()
+        feed.remove(writer)
+
+    async def watch(lazy: bool) -> SpectatorBoard:
+        sock = socket.socket()
+        if lazy and socket_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, socket_buffer)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, address)
+        reader, writer = await asyncio.open_connection(sock=sock, limit=1 << 20)
+        board = SpectatorBoard()
+        if lazy:
+            await done.wait()
+        async for line in reader:
+            message = json.loads(line)
+            if message["type"] == "game_over":
+                break
+            board.apply(message)
+        writer.close()
+        return board
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0, backlog=spectators)
+    address = server.sockets[0].getsockname()
+    rng = random.Random(seed)
+    lazy_count = int(spectators * slow)
+    clients = [asyncio.create_task(watch(i < lazy_count)) for i in range(spectators)]
+    while len(feed.spectators) < spectators:
+        await asyncio.sleep(0.01)
+
+    picks = rng.sample(identity_catalog().numbers(), 6)
+    manager = new_match(picks[:3], picks[3:], MatchRandom(seed), events=EventBus())
+    feed.start(manager, (manager.player, manager.enemy))
+    policy_rng = random.Random(f"policy:{seed}")
+    fan_out_times = []
+    published = 0
+    winner = None
+    try:
+        while manager.act < 100:
+            play_act(manager, random_policy, random_policy, policy_rng)
+            start = time.perf_counter()
+            published += feed.publish()
+            fan_out_times.append(time.perf_counter() - start)
+            await asyncio.sleep(act_delay)
+    except GameOver as over:
+        winner = manager.player.name if over.loser in manager.enemy.characters else manager.enemy.name
+    feed.finish(winner)
+    snapshot_size = len(feed.snapshot())
+    done.set()
+    boards = await asyncio.gather(*clients)
+    server.close()
+    return {
+        "spectators": spectators,
+        "versions": feed.version,
+        "published": published,
+        "fan_out_ms_mean": sum(fan_out_times) / len(fan_out_times) * 1000,
+        "fan_out_ms_max": max(fan_out_times) * 1000,
+        "snapshot_bytes": snapshot_size,
+        "snapshots_sent": feed.snapshots_sent,
+        "consistent": sum(board.states() == feed.states and board.version == feed.version for board in boards),
+        "gaps": sum(board.gaps for board in boards),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Spectator fan-out load test over loopback TCP")
+    parser.add_argument("--spectators", type=int, default=2000)
+    parser.add_argument("--slow", type=float, default=0.1, help="share of spectators that read nothing until the match ends")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--act-delay", type=float, default=0.01, help="seconds between acts")
+    parser.add_argument("--high-water", type=int, default=HIGH_WATER)
+    parser.add_argument("--low-water", type=int, default=LOW_WATER)
+    parser.add_argument("--socket-buffer", type=int, default=0, help="socket buffer size in bytes on the feed side and the slow spectators side, the system's by default")
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = 2 * args.spectators + 64
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+    result = asyncio.run(load_test(args.spectators, args.slow, args.seed, args.act_delay, args.high_water, args.low_water, args.socket_buffer))
+    for name, value in result.items():
+        print(f"{name:<20}{value:>12,.3f}" if isinstance(value, float) else f"{name:<20}{value:>12,}")
+
+if __name__ == "__main__":
+    main()
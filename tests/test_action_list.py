@@ -0,0 +1,79 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import Action, ActionList, ActionType, identity_catalog, numbers_to_characters
+from match_random import MatchRandom
+
+# The list ActionList replaced: kept sorted by speed on insert, a new action of an attacker takes the old
+# one's place, lookups scan from the front
+class SortedActionList:
+    def __init__(self):
+        self.action_list: list[Action] = []
+
+    def add_action(self, action: Action):
+        for i, existing_action in enumerate(self.action_list):
+            if existing_action.att is action.att:
+                self.action_list[i] = action
+                return
+        for i, existing_action in enumerate(self.action_list):
+            if action.speed > existing_action.speed:
+                self.action_list.insert(i, action)
+                break
+        else:
+            self.action_list.append(action)
+
+    def find_action_of_target(self, defender):
+        for action in self.action_list:
+            if action.att is defender:
+                return action
+        return None
+
+    def find_and_remove_action_by_att(self, defender):
+        for i, action in enumerate(self.action_list):
+            if action.att is defender:
+                del self.action_list[i]
+                return action
+        return None
+
+    def __len__(self) -> int:
+        return len(self.action_list)
+
+    def get_top_and_remove(self) -> Action:
+        return self.action_list.pop(0)
+
+class ActionListTest(unittest.TestCase):
+    def test_same_order_as_the_sorted_list(self):
+        rng = random.Random(0)
+        characters = numbers_to_characters(identity_catalog().numbers()[:8], MatchRandom(0))
+        for trial in range(3000):
+            heap, reference = ActionList(), SortedActionList()
+            # Speeds are rolled once an act, so an attacker declaring again does it at the same speed
+            speeds = {character: rng.randint(1, 6) for character in characters}
+            for _ in range(rng.randint(1, 40)):
+                operation = rng.random()
+                if operation < 0.55 or not len(reference):
+                    att = rng.choice(characters)
+                    number = rng.randint(1, 3)
+                    action = Action(speeds[att], att.skills[number - 1], att, rng.choice(characters), rng.choice(list(ActionType)), number)
+                    heap.add_action(action)
+                    reference.add_action(action)
+                elif operation < 0.7:
+                    target = rng.choice(characters)
+                    self.assertIs(heap.find_action_of_target(target), reference.find_action_of_target(target))
+                elif operation < 0.85:
+                    target = rng.choice(characters)
+                    self.assertIs(heap.find_and_remove_action_by_att(target), reference.find_and_remove_action_by_att(target))
+                else:
+                    self.assertIs(heap.get_top_and_remove(), reference.get_top_and_remove())
+                self.assertEqual(len(heap), len(reference), f"trial {trial}")
+            self.assertEqual(list(heap), reference.action_list)
+            while len(reference):
+                self.assertIs(heap.get_top_and_remove(), reference.get_top_and_remove())
+            self.assertEqual(len(heap), 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clash_odds import clash_odds
+from main import Action, ActionType, identity_catalog
+from match_random import MatchRandom
+from simulate import HEADLESS
+
+TRIALS = 20000
+# About five standard deviations of a rate measured over TRIALS clashes
+TOLERANCE = 0.018
+
+def duelist(number: int, seed: int):
+    character = identity_catalog()[number].build(MatchRandom(seed))
+    character.events = HEADLESS
+    return character
+
+class ClashOddsTest(unittest.TestCase):
+    def check(self, att_number: int, att_skill: int, defn_number: int, defn_skill: int, att_sanity: int, defn_sanity: int, seed: int):
+        att, defn = duelist(att_number, seed), duelist(defn_number, seed + 1)
+        att.sanity, defn.sanity = att_sanity, defn_sanity
+        att_save, defn_save = att.save(), defn.save()
+        attack = Action(0, att.skills[att_skill], att, defn, ActionType.CLASH)
+        defence = Action(0, defn.skills[defn_skill], defn, att, ActionType.CLASH)
+        wins = rounds = 0
+        for _ in range(TRIALS):
+            att.load(att_save)
+            defn.load(defn_save)
+            rounds += attack.clash(defence)
+            wins += att.sanity > att_sanity
+        odds = clash_odds(attack.skill, defence.skill, att_sanity, defn_sanity)
+        label = f"{attack.skill} vs {defence.skill} at sanity {att_sanity}/{defn_sanity}"
+        self.assertAlmostEqual(wins / TRIALS, odds.win, delta=TOLERANCE, msg=label)
+        self.assertAlmostEqual(rounds / TRIALS, odds.expected_rounds, delta=odds.expected_rounds * 0.03, msg=label)
+
+    def test_closed_form_matches_simulated_clashes(self):
+        numbers = identity_catalog().numbers()
+        cases = [
+            (numbers[0], 0, numbers[1], 0, 0, 0),
+            (numbers[2], 2, numbers[3], 1, 20, -15),
+            (numbers[4], 1, numbers[0], 2, -30, 45),
+            (numbers[1], 2, numbers[1], 2, 10, 10),
+        ]
+        for seed, case in enumerate(cases):
+            with self.subTest(case=case):
+                self.check(*case, seed=seed * 2)
+
+if __name__ == "__main__":
+    unittest.main()
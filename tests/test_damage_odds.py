@@ -0,0 +1,64 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from damage_odds import one_side_odds
+from main import Action, ActionType, identity_catalog
+from match_random import MatchRandom
+from simulate import HEADLESS
+
+TRIALS = 20000
+# About five standard deviations of a rate measured over TRIALS attacks
+TOLERANCE = 0.018
+
+def duelist(number: int, seed: int):
+    character = identity_catalog()[number].build(MatchRandom(seed))
+    character.events = HEADLESS
+    return character
+
+class DamageOddsTest(unittest.TestCase):
+    def check(self, att_number: int, skill: int, defn_number: int, sanity: int, curhp: int | None, curstag: int | None, seed: int):
+        att, defn = duelist(att_number, seed), duelist(defn_number, seed + 1)
+        att.sanity = sanity
+        if curhp is not None:
+            defn.curhp = curhp
+        if curstag is not None:
+            defn.curstag = curstag
+            # A target only ever sits at no stagger while its stagger is wearing off
+            defn.staggertimer = 0 if curstag else 1
+        att_save, defn_save = att.save(), defn.save()
+        attack = Action(0, att.skills[skill], att, defn, ActionType.ONESIDE)
+        odds = one_side_odds(attack.skill, sanity, defn)
+        damage: dict[int, int] = {}
+        staggers = kills = 0
+        for _ in range(TRIALS):
+            att.load(att_save)
+            defn.load(defn_save)
+            attack.one_side_attack()
+            dealt = defn_save[0] - defn.curhp
+            damage[dealt] = damage.get(dealt, 0) + 1
+            staggers += defn.staggertimer > defn_save[5]
+            kills += defn.curhp <= 0
+        label = f"{attack.skill} at sanity {sanity} against {defn.name} ({defn_save[0]} hp, {defn_save[1]} stagger)"
+        for dealt in damage.keys() | odds.damage.keys():
+            self.assertAlmostEqual(damage.get(dealt, 0) / TRIALS, odds.damage.get(dealt, 0.0), delta=TOLERANCE, msg=f"{label}, {dealt} damage")
+        self.assertAlmostEqual(staggers / TRIALS, odds.stagger, delta=TOLERANCE, msg=label)
+        self.assertAlmostEqual(kills / TRIALS, odds.kill, delta=TOLERANCE, msg=label)
+
+    def test_closed_form_matches_simulated_attacks(self):
+        numbers = identity_catalog().numbers()
+        cases = [
+            (numbers[0], 0, numbers[1], 0, None, None),
+            (numbers[0], 2, numbers[1], 0, 49, 45),
+            (numbers[2], 2, numbers[3], 25, 25, 22),
+            (numbers[4], 2, numbers[0], -20, 30, 20),
+            (numbers[1], 1, numbers[2], 40, 45, 0),
+        ]
+        for seed, case in enumerate(cases):
+            with self.subTest(case=case):
+                self.check(*case, seed=seed * 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import GameOver, identity_catalog
+from match_random import MatchRandom
+from simulate import new_match, play_act, random_policy
+
+def board(manager) -> tuple:
+    return manager.act, tuple(character.save() for character in (*manager.player.characters, *manager.enemy.characters))
+
+def play(manager, acts: int, policy_rng: random.Random):
+    try:
+        for _ in range(acts):
+            play_act(manager, random_policy, random_policy, policy_rng)
+    except GameOver:
+        manager.action_list.remove_all_actions()
+
+class GameStateTest(unittest.TestCase):
+    def setUp(self):
+        self.numbers = identity_catalog().numbers()
+
+    def match(self, seed: int):
+        picks = random.Random(seed).sample(self.numbers, 6)
+        return new_match(picks[:3], picks[3:], MatchRandom(seed))
+
+    def test_undo_puts_back_the_board_and_act(self):
+        for seed in range(200):
+            manager = self.match(seed)
+            policy_rng = random.Random(seed)
+            play(manager, seed % 4, policy_rng)
+            before = board(manager)
+            manager.push_undo()
+            play(manager, 3, policy_rng)
+            self.assertNotEqual(board(manager), before)
+            manager.undo()
+            self.assertEqual(board(manager), before, f"seed {seed}")
+            self.assertEqual(len(manager.action_list), 0)
+
+    def test_undo_frames_nest(self):
+        manager = self.match(7)
+        policy_rng = random.Random(7)
+        outer = board(manager)
+        manager.push_undo()
+        play(manager, 1, policy_rng)
+        inner = board(manager)
+        manager.push_undo()
+        play(manager, 2, policy_rng)
+        manager.undo()
+        self.assertEqual(board(manager), inner)
+        manager.undo()
+        self.assertEqual(board(manager), outer)
+
+    # Unlike undo, restore also rewinds the random streams, so the same decisions play out the same way again
+    def test_restore_replays_the_same_acts(self):
+        for seed in range(100):
+            manager = self.match(seed)
+            play(manager, 2, random.Random(seed))
+            snapshot = manager.snapshot()
+            play(manager, 4, random.Random(f"again:{seed}"))
+            first = board(manager)
+            manager.restore(snapshot)
+            play(manager, 4, random.Random(f"again:{seed}"))
+            self.assertEqual(board(manager), first, f"seed {seed}")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from match_random import MatchRandom
+
+# A mix of every kind of draw the game makes, from both sub-streams
+def draws(rng: MatchRandom, count: int, pattern: random.Random) -> list:
+    out = []
+    for _ in range(count):
+        kind = pattern.randrange(6)
+        if kind == 0:
+            out.append(rng.random())
+        elif kind == 1:
+            out.append(rng.randint(1, 7))
+        elif kind == 2:
+            out.append(rng.rolls_of(pattern.randint(1, 5)))
+        elif kind == 3:
+            out.append(rng.heads(pattern.randint(1, 5), pattern.randint(-45, 45)))
+        elif kind == 4:
+            out.append(rng.getrandbits(pattern.choice((8, 64, 100))))
+        else:
+            items = list(range(6))
+            rng.shuffle(items)
+            out.append(items)
+    return out
+
+class MatchRandomTest(unittest.TestCase):
+    def test_same_seed_same_draws(self):
+        for seed in (0, 1, -3, 2 ** 70):
+            self.assertEqual(draws(MatchRandom(seed), 2000, random.Random(seed)), draws(MatchRandom(seed), 2000, random.Random(seed)))
+            self.assertEqual(draws(MatchRandom(seed, 4), 500, random.Random(seed)), draws(MatchRandom(seed, 4), 500, random.Random(seed)))
+
+    def test_seeds_and_streams_differ(self):
+        sequences = {
+            tuple(MatchRandom(seed, stream).random() for _ in range(8))
+            for seed in range(20) for stream in range(5)
+        }
+        self.assertEqual(len(sequences), 100)
+        self.assertNotEqual(MatchRandom(1, 0).rolls_of(64), MatchRandom(1, 1).rolls_of(64))
+        self.assertNotEqual(MatchRandom(1, 0).rolls_of(64), MatchRandom(2, 0).rolls_of(64))
+
+    # Drawing from one stream, or from the other sub-stream of the same match, never shifts a stream's draws
+    def test_streams_are_independent(self):
+        alone = [MatchRandom(9, stream) for stream in range(3)]
+        expected = [[rng.random() for _ in range(300)] for rng in alone]
+        expected_rolls = MatchRandom(9, 0).rolls_of(1500)
+        shared = [MatchRandom(9, stream) for stream in range(3)]
+        got = [[], [], []]
+        pattern = random.Random(9)
+        for _ in range(900):
+            stream = pattern.randrange(3)
+            if len(got[stream]) < 300:
+                got[stream].append(shared[stream].random())
+        for stream in range(3):
+            got[stream] += [shared[stream].random() for _ in range(300 - len(got[stream]))]
+        self.assertEqual(got, expected)
+
+        mixed = MatchRandom(9, 0)
+        rolls = b""
+        for _ in range(500):
+            mixed.randint(1, 100)
+            rolls += mixed.rolls_of(3)
+        self.assertEqual(rolls, expected_rolls)
+
+    def test_rolls_and_heads_agree(self):
+        rng, twin = MatchRandom(3), MatchRandom(3)
+        pattern = random.Random(3)
+        for _ in range(2000):
+            count, sanity = pattern.randint(1, 5), pattern.randint(-45, 45)
+            rolls = rng.rolls_of(count)
+            self.assertTrue(all(roll < 100 for roll in rolls))
+            self.assertEqual(twin.heads(count, sanity), sum(roll < 50 + sanity for roll in rolls))
+
+    def test_state_round_trip(self):
+        pattern = random.Random(11)
+        rng = MatchRandom(11, 2)
+        # Enough draws to cross several blocks of both sub-streams between saves
+        for _ in range(12):
+            draws(rng, pattern.randint(0, 400), pattern)
+            state = rng.getstate()
+            ahead = pattern.getstate()
+            expected = draws(rng, 300, pattern)
+            pattern.setstate(ahead)
+            rng.setstate(state)
+            self.assertEqual(draws(rng, 300, pattern), expected)
+            pattern.setstate(ahead)
+            fresh = MatchRandom(0)
+            fresh.setstate(state)
+            self.assertEqual(draws(fresh, 300, pattern), expected)
+
+    def test_restoring_the_starting_state(self):
+        rng = MatchRandom(5)
+        state = rng.getstate()
+        expected = draws(rng, 1000, random.Random(5))
+        rng.setstate(state)
+        self.assertEqual(draws(rng, 1000, random.Random(5)), expected)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matchmaking import RatingStore
+from server import MatchServer
+from test_server import play
+
+class RankedServerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_far_ratings_pair_once_the_window_widens(self):
+        ratings = RatingStore()
+        for _ in range(5):
+            ratings.record("strong", "weak")
+        before = {name: ratings.rating(name) for name in ("strong", "weak")}
+        gap = before["strong"] - before["weak"]
+        match_server = MatchServer(act_seconds=5, pick_seconds=5, ratings=ratings)
+        # Too far apart to pair at join, close enough after a few widenings
+        self.assertGreater(gap, match_server.matchmaker.base_window)
+        self.assertLess(gap, match_server.matchmaker.max_window)
+        match_server.matchmaker.widen_every = 0.05
+        server = await match_server.serve_tcp("127.0.0.1", 0)
+        address = server.sockets[0].getsockname()
+        matchmaker = asyncio.create_task(match_server.run_matchmaker(interval=0.02))
+        try:
+            async with server:
+                strong, weak = await asyncio.wait_for(asyncio.gather(play(address, "strong"), play(address, "weak")), 60)
+                await asyncio.wait_for(asyncio.gather(*match_server.sessions), 10)
+        finally:
+            matchmaker.cancel()
+        self.assertEqual(strong[0], {"type": "waiting", "rating": round(before["strong"])})
+        self.assertEqual(weak[0], {"type": "waiting", "rating": round(before["weak"])})
+        self.assertEqual(strong[-1]["type"], "game_over")
+        self.assertEqual(strong[-1]["winner"], weak[-1]["winner"])
+        # The finished match is recorded: the winner gains what the loser loses
+        winner = strong[-1]["winner"]
+        self.assertGreater(ratings.rating(winner), before[winner])
+        self.assertAlmostEqual(sum(ratings.rating(name) for name in before), sum(before.values()))
+        self.assertEqual([games for _, _, games in ratings.top(2)], [6, 6])
+
+if __name__ == "__main__":
+    unittest.main()
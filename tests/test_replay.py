@@ -0,0 +1,79 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from effects import load_effects
+from main import GameOver, identity_catalog
+from match_random import MatchRandom
+from replay import MAGIC_UNSIGNED_SEED, ReplayLog, ReplayRecorder, Replayer, _put
+from simulate import greedy_policy, new_match, play_act, random_policy
+
+# Play a recorded match, returning the encoded log, the winner, and the board after every act
+def record(seed: int, effects=None, policy=random_policy) -> tuple[bytes, int | None, list[tuple]]:
+    picks = random.Random(seed).sample(identity_catalog().numbers(), 6)
+    team1, team2 = picks[:3], picks[3:]
+    manager = new_match(team1, team2, MatchRandom(seed), effects=effects)
+    recorder = ReplayRecorder(manager, seed, tuple(team1), tuple(team2), effects)
+    policy_rng = random.Random(f"policy:{seed}")
+    boards = [board(manager)]
+    winner = None
+    try:
+        while manager.act < 100:
+            play_act(manager, policy, policy, policy_rng)
+            boards.append(board(manager))
+    except GameOver as over:
+        winner = 2 if over.loser in manager.player.characters else 1
+        boards.append(board(manager))
+    return recorder.log.encode(), winner, boards
+
+def board(manager) -> tuple:
+    return manager.act, tuple(character.save() for character in (*manager.player.characters, *manager.enemy.characters))
+
+class ReplayTest(unittest.TestCase):
+    def test_round_trip_reproduces_the_match(self):
+        effects = load_effects()
+        for seed in range(150):
+            catalog = effects if seed % 3 == 0 else None
+            data, winner, boards = record(seed, catalog, greedy_policy if seed % 2 else random_policy)
+            log = ReplayLog.decode(data)
+            self.assertEqual(log.encode(), data)
+            replayer = Replayer(log)
+            self.assertEqual(replayer.run(), winner, f"seed {seed}")
+            self.assertEqual(board(replayer.manager), boards[-1], f"seed {seed}")
+
+    def test_seek_backward_and_forward(self):
+        for seed in range(30):
+            data, winner, boards = record(seed)
+            replayer = Replayer.from_bytes(data, snapshot_every=3)
+            replayer.run()
+            last = len(boards) - 1
+            rng = random.Random(seed)
+            for act in [0, last, *(rng.randint(0, last) for _ in range(10)), last // 2, 1, last]:
+                self.assertEqual(board(replayer.seek(act)), boards[act], f"seed {seed}, act {act}")
+            self.assertEqual(replayer.winner, winner)
+            with self.assertRaises(IndexError):
+                replayer.seek(last + 1)
+
+    def test_negative_seed(self):
+        data, winner, boards = record(-12345)
+        replayer = Replayer.from_bytes(data)
+        self.assertEqual(replayer.log.seed, -12345)
+        self.assertEqual(replayer.run(), winner)
+        self.assertEqual(board(replayer.manager), boards[-1])
+
+    def test_reads_logs_with_an_unsigned_seed(self):
+        data, winner, boards = record(77)
+        log = ReplayLog.decode(data)
+        # Same body, with the seed written as is after the older header
+        old = bytearray(MAGIC_UNSIGNED_SEED)
+        _put(old, 77)
+        body = bytearray()
+        _put(body, 77 << 1)
+        old += data[4 + len(body):]
+        self.assertEqual(ReplayLog.decode(bytes(old)), log)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import EventBus, GameOver
+from match_random import MatchRandom
+from server import MatchServer
+from simulate import new_match, random_policy, apply_decisions
+from spectate import SpectatorFeed
+
+# Most damaging hinted option of every character, then the end of the turn
+def declare(writer: asyncio.StreamWriter, act: dict):
+    best = {}
+    for hint in act["hints"]:
+        if hint["character"] not in best or hint["damage"] > best[hint["character"]]["damage"]:
+            best[hint["character"]] = hint
+    for hint in best.values():
+        action = {"type": "action", "character": hint["character"], "slot": hint["slot"], "target": hint["target"], "clash": False}
+        writer.write(json.dumps(action).encode() + b"\n")
+    writer.write(b'{"type": "end"}\n')
+
+# A client that picks the first identity offered, declares the most damaging hinted option of every
+# character each act and ends its turn, until the match is over. With a gate it makes no pick before it is set
+async def play(address: tuple, name: str, gate: asyncio.Event | None = None) -> list[dict]:
+    reader, writer = await asyncio.open_connection(*address)
+    writer.write(json.dumps({"type": "join", "name": name}).encode() + b"\n")
+    seen = []
+    async for line in reader:
+        message = json.loads(line)
+        seen.append(message)
+        if message["type"] == "pick":
+            if gate is not None:
+                await gate.wait()
+            writer.write(json.dumps({"type": "pick", "identity": message["available"][0]}).encode() + b"\n")
+        elif message["type"] == "act":
+            declare(writer, message)
+        elif message["type"] == "game_over":
+            break
+    writer.close()
+    return seen
+
+class MatchServerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_join_pick_act_game_over(self):
+        match_server = MatchServer(act_seconds=5, pick_seconds=5)
+        server = await match_server.serve_tcp("127.0.0.1", 0)
+        address = server.sockets[0].getsockname()
+        async with server:
+            first, second = await asyncio.wait_for(asyncio.gather(play(address, "first"), play(address, "second")), 60)
+        for seen in (first, second):
+            types = [message["type"] for message in seen]
+            self.assertEqual(types[:2], ["waiting", "start"])
+            self.assertNotIn("seed", seen[1])
+            self.assertEqual(types.count("picked"), 6)
+            self.assertIn("act", types)
+            self.assertIn("accepted", types)
+            self.assertNotIn("error", types)
+            self.assertEqual(types[-1], "game_over")
+            self.assertIn(seen[-1]["winner"], ("first", "second"))
+            self.assertIn("seed", seen[-1])
+        self.assertEqual(first[-1], second[-1])
+
+    async def test_clash_must_be_a_boolean(self):
+        match_server = MatchServer(act_seconds=5, pick_seconds=5)
+        server = await match_server.serve_tcp("127.0.0.1", 0)
+        address = server.sockets[0].getsockname()
+        errors = []
+
+        async def strict(name: str):
+            reader, writer = await asyncio.open_connection(*address)
+            writer.write(json.dumps({"type": "join", "name": name}).encode() + b"\n")
+            async for line in reader:
+                message = json.loads(line)
+                if message["type"] == "pick":
+                    writer.write(json.dumps({"type": "pick", "identity": message["available"][0]}).encode() + b"\n")
+                elif message["type"] == "act":
+                    hint = message["hints"][0]
+                    action = {"type": "action", "character": hint["character"], "slot": hint["slot"], "target": hint["target"], "clash": "false"}
+                    writer.write(json.dumps(action).encode() + b"\n")
+                elif message["type"] == "error":
+                    errors.append(message["message"])
+                    break
+            writer.close()
+
+        async with server:
+            await asyncio.wait_for(asyncio.gather(strict("first"), strict("second")), 60)
+        self.assertEqual(errors, ["clash must be true or false"] * 2)
+
+    async def test_numbers_must_be_whole(self):
+        match_server = MatchServer(act_seconds=5, pick_seconds=5)
+        server = await match_server.serve_tcp("127.0.0.1", 0)
+        address = server.sockets[0].getsockname()
+
+        # Sends a float and a boolean pick and an action with an overflowing number before playing properly
+        async def sloppy(name: str) -> list[dict]:
+            reader, writer = await asyncio.open_connection(*address)
+            writer.write(json.dumps({"type": "join", "name": name}).encode() + b"\n")
+            seen = []
+            tried_act = False
+            async for line in reader:
+                message = json.loads(line)
+                seen.append(message)
+                if message["type"] == "pick":
+                    number = message["available"][0]
+                    for identity in (float(number), True, number):
+                        writer.write(json.dumps({"type": "pick", "identity": identity}).encode() + b"\n")
+                elif message["type"] == "act":
+                    if not tried_act:
+                        tried_act = True
+                        writer.write(b'{"type": "action", "character": 1e400, "slot": 1, "target": 0}\n')
+                    declare(writer, message)
+                elif message["type"] == "game_over":
+                    break
+            writer.close()
+            return seen
+
+        async with server:
+            first, second = await asyncio.wait_for(asyncio.gather(sloppy("first"), sloppy("second")), 60)
+        for seen in (first, second):
+            errors = [message["message"] for message in seen if message["type"] == "error"]
+            self.assertIn("character must be a whole number", errors)
+            self.assertEqual(seen[-1]["type"], "game_over")
+        picked = [message["identity"] for message in first if message["type"] == "picked"]
+        self.assertTrue(all(type(identity) is int for identity in picked))
+        self.assertEqual(sum(message["type"] == "error" for message in first + second), 6 * 2 + 2)
+
+    async def test_overlong_line_closes_the_connection(self):
+        match_server = MatchServer(act_seconds=5, pick_seconds=5)
+        server = await match_server.serve_tcp("127.0.0.1", 0)
+        address = server.sockets[0].getsockname()
+        async with server:
+            reader, writer = await asyncio.open_connection(*address)
+            writer.write(b"x" * (1 << 17) + b"\n")
+            try:
+                self.assertEqual(await asyncio.wait_for(reader.read(), 10), b"")
+            except ConnectionResetError:
+                # Closed with the rest of the line still unread
+                pass
+            writer.close()
+            # The server carries on serving everyone else
+            first, second = await asyncio.wait_for(asyncio.gather(play(address, "first"), play(address, "second")), 60)
+        self.assertEqual(first[-1]["type"], "game_over")
+
+class ResolveOnLoopTest(unittest.TestCase):
+    # resolve_action runs on the event loop, with the match's bus, a spectator feed and the metrics subscribed.
+    # The slowest act of many must stay far below anything a player would notice as a stall
+    def test_resolving_an_act_is_bounded(self):
+        policy_rng = random.Random(0)
+        slowest = 0.0
+        for seed in range(100):
+            manager = new_match([1, 2, 3], [4, 5, 6], MatchRandom(seed), events=EventBus())
+            feed = SpectatorFeed(f"{seed}")
+            feed.start(manager, (manager.player, manager.enemy))
+            manager.events.subscribe(feed)
+            try:
+                while manager.act < 100:
+                    manager.next_turn()
+                    apply_decisions(manager, random_policy(manager, policy_rng))
+                    manager.change_side()
+                    apply_decisions(manager, random_policy(manager, policy_rng))
+                    manager.change_side()
+                    start = time.perf_counter()
+                    try:
+                        manager.resolve_action()
+                    finally:
+                        slowest = max(slowest, time.perf_counter() - start)
+                    feed.publish()
+            except GameOver:
+                pass
+        self.assertLess(slowest, 0.05)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import MatchServer
+from spectate import SpectatorBoard
+from test_server import play
+
+class SpectatorFeedTest(unittest.IsolatedAsyncioTestCase):
+    async def test_spectator_follows_a_match_to_game_over(self):
+        match_server = MatchServer(act_seconds=5, pick_seconds=5)
+        server = await match_server.serve_tcp("127.0.0.1", 0)
+        address = server.sockets[0].getsockname()
+        watching = asyncio.Event()
+
+        async def spectate() -> tuple[SpectatorBoard, dict, str]:
+            reader, writer = await asyncio.open_connection(*address)
+            while True:
+                writer.write(b'{"type": "matches"}\n')
+                listing = json.loads(await reader.readline())
+                if listing["matches"]:
+                    break
+                await asyncio.sleep(0.01)
+            match_id = listing["matches"][0]["match"]
+            writer.write(json.dumps({"type": "spectate", "match": match_id}).encode() + b"\n")
+            board = SpectatorBoard()
+            async for line in reader:
+                message = json.loads(line)
+                if message["type"] == "game_over":
+                    break
+                board.apply(message)
+                watching.set()
+            writer.close()
+            return board, message, match_id
+
+        async with server:
+            (board, over, match_id), first, _ = await asyncio.wait_for(
+                asyncio.gather(spectate(), play(address, "first", watching), play(address, "second", watching)), 60
+            )
+        self.assertEqual(over["winner"], first[-1]["winner"])
+        self.assertEqual(board.gaps, 0)
+        self.assertEqual(over["version"], board.version)
+        self.assertEqual(len(board.characters), 8)
+        # The id spectators find a match by says nothing about its seed
+        self.assertNotEqual(match_id, f"{first[-1]['seed']:016x}")
+
+if __name__ == "__main__":
+    unittest.main()
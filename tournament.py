@@ -0,0 +1,179 @@
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import random
+from dataclasses import dataclass
+from itertools import combinations
+from multiprocessing import Pool
+
+from main import identity_catalog
+from simulate import Policy, greedy_policy, random_policy, simulate_match
+
+POLICIES: dict[str, Policy] = {"random": random_policy, "greedy": greedy_policy}
+
+Roster = tuple[int, int, int]
+
+# Win counts of one ordered roster pairing, team1 acts as player 1
+@dataclass
+class PairingResult:
+    team1: Roster
+    team2: Roster
+    wins1: int
+    wins2: int
+    draws: int
+
+    @property
+    def games(self) -> int:
+        return self.wins1 + self.wins2 + self.draws
+
+    # Draws count as half a win
+    @property
+    def win_rate(self) -> float:
+        return (self.wins1 + self.draws / 2) / self.games
+
+# Identity numbers a draft picks from, read from the catalog when first asked for rather than on import
+def identities() -> list[int]:
+    return identity_catalog().numbers()
+
+def all_rosters() -> list[Roster]:
+    return list(combinations(identities(), 3))
+
+# Every ordered pairing of two drafts, the draft never gives the same identity to both sides
+def roster_pairings(sample: int | None = None, seed: int = 0) -> list[tuple[Roster, Roster]]:
+    rosters = all_rosters()
+    pairings = [(team1, team2) for team1 in rosters for team2 in rosters if not set(team1) & set(team2)]
+    if sample is not None and sample < len(pairings):
+        pairings = random.Random(seed).sample(pairings, sample)
+    return pairings
+
+# Seed of one game, derived from the pairing so it doesn't depend on which worker plays it or when
+def match_seed(base_seed: int, team1: Roster, team2: Roster, game: int) -> int:
+    text = f"{base_seed}:{team1}:{team2}:{game}".encode()
+    return int.from_bytes(hashlib.blake2b(text, digest_size=8).digest(), "little")
+
+def play_pairing(task: tuple[Roster, Roster, int, int, str, str, int]) -> PairingResult:
+    team1, team2, games, base_seed, policy1, policy2, max_acts = task
+    wins = [0, 0, 0]
+    for game in range(games):
+        result = simulate_match(
+            list(team1), list(team2), POLICIES[policy1], POLICIES[policy2],
+            match_seed(base_seed, team1, team2, game), max_acts,
+        )
+        wins[result.winner or 0] += 1
+    return PairingResult(team1, team2, wins[1], wins[2], wins[0])
+
+# Everything a pairing's result depends on besides the rosters, written as the checkpoint's first line
+def checkpoint_params(games: int, seed: int, policy1: str, policy2: str, max_acts: int) -> dict:
+    return {"games": games, "seed": seed, "policy1": policy1, "policy2": policy2, "max_acts": max_acts}
+
+# Results already written to the checkpoint file; a torn last line from an interrupted run is dropped.
+# With params, a checkpoint played with any other parameters is refused rather than mixed in
+def load_results(checkpoint: str, params: dict | None = None) -> dict[tuple[Roster, Roster], PairingResult]:
+    results = {}
+    if not os.path.exists(checkpoint):
+        return results
+    has_params = False
+    with open(checkpoint, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "params" in record:
+                if params is not None and record["params"] != params:
+                    raise ValueError(f"{checkpoint} was played with {record['params']}, not {params}")
+                has_params = True
+                continue
+            result = PairingResult(tuple(record["team1"]), tuple(record["team2"]), record["wins1"], record["wins2"], record["draws"])
+            results[(result.team1, result.team2)] = result
+    if params is not None and results and not has_params:
+        raise ValueError(f"{checkpoint} doesn't say what parameters it was played with")
+    return results
+
+# Cut a line left unfinished by an interrupted run, so the next result starts on a line of its own
+def truncate_torn_line(checkpoint: str):
+    if not os.path.exists(checkpoint):
+        return
+    with open(checkpoint, "rb+") as file:
+        end = file.seek(0, os.SEEK_END)
+        # A line is well under a kilobyte, so the last newline is in the last few of them
+        start = max(end - 4096, 0)
+        file.seek(start)
+        tail = file.read()
+        if tail and not tail.endswith(b"\n"):
+            file.truncate(start + tail.rfind(b"\n") + 1)
+
+def run_tournament(
+        checkpoint: str,
+        games: int = 20,
+        workers: int | None = None,
+        sample: int | None = None,
+        seed: int = 0,
+        policy1: str = "random",
+        policy2: str = "random",
+        max_acts: int = 100
+    ) -> dict[tuple[Roster, Roster], PairingResult]:
+    params = checkpoint_params(games, seed, policy1, policy2, max_acts)
+    results = load_results(checkpoint, params)
+    tasks = [
+        (team1, team2, games, seed, policy1, policy2, max_acts)
+        for team1, team2 in roster_pairings(sample, seed)
+        if (team1, team2) not in results
+    ]
+    if not tasks:
+        return results
+    truncate_torn_line(checkpoint)
+    with open(checkpoint, "a", encoding="utf-8") as file, Pool(workers) as pool:
+        if file.tell() == 0:
+            file.write(json.dumps({"params": params}) + "\n")
+        # Every finished pairing is flushed right away, so an interrupted run resumes where it stopped
+        for result in pool.imap_unordered(play_pairing, tasks, chunksize=8):
+            results[(result.team1, result.team2)] = result
+            file.write(json.dumps({
+                "team1": result.team1, "team2": result.team2,
+                "wins1": result.wins1, "wins2": result.wins2, "draws": result.draws,
+            }) + "\n")
+            file.flush()
+    return results
+
+# Win rate matrix with one row and column per roster, None where the pairing wasn't played
+def matchup_matrix(results: dict[tuple[Roster, Roster], PairingResult]) -> tuple[list[Roster], list[list[float | None]]]:
+    rosters = all_rosters()
+    index = {roster: i for i, roster in enumerate(rosters)}
+    matrix: list[list[float | None]] = [[None] * len(rosters) for _ in rosters]
+    for (team1, team2), result in results.items():
+        if result.games:
+            matrix[index[team1]][index[team2]] = result.win_rate
+    return rosters, matrix
+
+def write_matrix_csv(path: str, rosters: list[Roster], matrix: list[list[float | None]]):
+    names = ["-".join(map(str, roster)) for roster in rosters]
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("team1\\team2," + ",".join(names) + "\n")
+        for name, row in zip(names, matrix):
+            file.write(name + "," + ",".join("" if rate is None else f"{rate:.4f}" for rate in row) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Round-robin tournament over every draftable roster")
+    parser.add_argument("checkpoint", help="JSON lines file the results are streamed to and resumed from")
+    parser.add_argument("--games", type=int, default=20, help="games per roster pairing")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, all cores by default")
+    parser.add_argument("--sample", type=int, default=None, help="only play this many random pairings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--policy1", choices=POLICIES, default="random")
+    parser.add_argument("--policy2", choices=POLICIES, default="random")
+    parser.add_argument("--matrix", help="write the matchup matrix to this CSV file")
+    args = parser.parse_args()
+
+    try:
+        results = run_tournament(args.checkpoint, args.games, args.workers, args.sample, args.seed, args.policy1, args.policy2)
+    except ValueError as error:
+        parser.error(str(error))
+    print(f"{len(results)} pairings played")
+    if args.matrix:
+        write_matrix_csv(args.matrix, *matchup_matrix(results))
+
+if __name__ == "__main__":
+    main()